@@ -0,0 +1,182 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decoding query results straight into NumPy arrays.
+
+Used by :meth:`~apymongo.cursor.Cursor.to_arrays`. Needs NumPy.
+"""
+
+import struct
+
+import bson
+from apymongo.errors import ConfigurationError
+
+try:
+    import numpy
+    _use_numpy = True
+except ImportError:
+    _use_numpy = False
+
+_INT = struct.Struct("<i")
+_LONG = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+
+# Rows to make room for before the first batch arrives.
+_INITIAL_CAPACITY = 1024
+
+
+def _read_double(data, position):
+    return _DOUBLE.unpack_from(data, position)[0]
+
+
+def _read_int(data, position):
+    return _INT.unpack_from(data, position)[0]
+
+
+def _read_long(data, position):
+    return _LONG.unpack_from(data, position)[0]
+
+
+def _read_boolean(data, position):
+    return data[position] == "\x01"
+
+
+def _read_oid(data, position):
+    return data[position:position + 12]
+
+
+# BSON element types each kind of column can be filled from, and how
+# to read them. Values of any other type are masked out.
+_NUMBER_READERS = {
+    "\x01": _read_double,
+    "\x08": _read_boolean,
+    "\x10": _read_int,
+    "\x12": _read_long}
+_DATE_READERS = {"\x09": _read_long}
+_OID_READERS = {"\x07": _read_oid}
+
+
+class _Column(object):
+    """A growing array of values for one field, and its mask.
+    """
+
+    def __init__(self, path, dtype, capacity):
+        if dtype.kind in "biuf":
+            self.readers = _NUMBER_READERS
+            storage = dtype
+        elif dtype.kind == "M":
+            # Dates are read as milliseconds since the epoch, and only
+            # converted to `dtype` at the end.
+            self.readers = _DATE_READERS
+            storage = numpy.dtype("<i8")
+        elif dtype.kind == "V" and dtype.itemsize == 12:
+            self.readers = _OID_READERS
+            storage = dtype
+        else:
+            raise TypeError("can't decode field %r into an array of %s - "
+                            "only numbers, bools, dates and ObjectIds (as "
+                            "V12) are supported" % (path, dtype))
+        self.path = path
+        self.dtype = dtype
+        self.values = numpy.zeros(capacity, storage)
+        self.mask = numpy.ones(capacity, bool)
+
+    def grow(self, capacity):
+        size = len(self.values)
+        self.values.resize(capacity, refcheck=False)
+        self.mask.resize(capacity, refcheck=False)
+        self.mask[size:] = True
+
+    def finish(self, size):
+        values = self.values[:size]
+        if self.dtype.kind == "M":
+            values = values.view("datetime64[ms]").astype(self.dtype)
+        return numpy.ma.masked_array(values, self.mask[:size])
+
+
+class ColumnBuilder(object):
+    """Decodes BSON documents into one array per field of `schema`.
+
+    `schema` maps field names (dotted to reach into embedded
+    documents) to NumPy dtypes. Only the elements along those paths
+    are looked at; everything else is stepped over by its length.
+    """
+
+    def __init__(self, schema):
+        if not _use_numpy:
+            raise ConfigurationError("decoding into arrays needs NumPy, "
+                                     "which is not installed")
+        if not isinstance(schema, dict) or not schema:
+            raise TypeError("schema must be a non-empty dict of field "
+                            "names to dtypes")
+
+        self.__size = 0
+        self.__capacity = _INITIAL_CAPACITY
+        self.__columns = []
+        self.__tree = {}
+        for (path, dtype) in schema.iteritems():
+            if not isinstance(path, basestring):
+                raise TypeError("field names must be instances of "
+                                "basestring")
+            column = _Column(path, numpy.dtype(dtype), self.__capacity)
+            self.__columns.append(column)
+
+            node = self.__tree
+            parts = path.split(".")
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+                if isinstance(node, _Column):
+                    raise ValueError("field %r is inside field %r" %
+                                     (path, node.path))
+            if parts[-1] in node:
+                raise ValueError("field %r clashes with another field" %
+                                 (path,))
+            node[parts[-1]] = column
+
+    def add(self, documents):
+        """Add a row for each of `documents`, a list of BSON byte
+        strings.
+        """
+        for data in documents:
+            if self.__size == self.__capacity:
+                self.__capacity *= 2
+                for column in self.__columns:
+                    column.grow(self.__capacity)
+            self.__fill(data, 4, len(data) - 1, self.__tree)
+            self.__size += 1
+
+    def __fill(self, data, position, end, tree):
+        row = self.__size
+        for (element_type, name, start, _) in bson._iter_elements(
+                data, position, end):
+            node = tree.get(name)
+            if node is None:
+                continue
+            if isinstance(node, _Column):
+                reader = node.readers.get(element_type)
+                if reader is not None:
+                    node.values[row] = reader(data, start)
+                    node.mask[row] = False
+            elif element_type == "\x03":
+                self.__fill(data, start + 4, bson._object_end(data, start),
+                            node)
+
+    def finish(self):
+        """Get a dict of field names to
+        :class:`numpy.ma.MaskedArray` instances, one entry per row.
+        """
+        result = {}
+        for column in self.__columns:
+            result[column.path] = column.finish(self.__size)
+        return result
@@ -0,0 +1,180 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unordered bulk writes to a single collection."""
+
+from apymongo import message
+from apymongo.errors import InvalidOperation
+
+_INSERT = 0
+_UPDATE = 1
+_REMOVE = 2
+
+
+class BulkOperation(object):
+    """An unordered batch of inserts, updates and removes.
+
+    Get one from :meth:`~apymongo.collection.Collection.bulk`, queue up
+    operations, and then call :meth:`execute` to send them all at once.
+    Runs of consecutive inserts are coalesced into multi-document
+    insert messages, each followed by a single getLastError. Updates
+    and removes each get their own message and getLastError. All of
+    the messages are written to one stream without waiting for replies
+    in between, so the whole batch takes a single round-trip.
+    """
+
+    def __init__(self, collection):
+        """Create a new, empty batch of writes to `collection`.
+
+        :Parameters:
+          - `collection`: the :class:`~apymongo.collection.Collection`
+            to write to
+        """
+        self.__collection = collection
+        self.__ops = []
+        self.__executed = False
+
+    def insert(self, document, manipulate=True, check_keys=True):
+        """Queue an insert of `document`.
+
+        :Parameters:
+          - `document`: the document to insert
+          - `manipulate` (optional): manipulate the document before
+            inserting?
+          - `check_keys` (optional): check if keys start with '$' or
+            contain '.'
+        """
+        if not isinstance(document, dict):
+            raise TypeError("document must be an instance of dict")
+        if manipulate:
+            document = self.__collection.database._fix_incoming(
+                document, self.__collection)
+        self.__ops.append((_INSERT, (document, check_keys)))
+        return self
+
+    def update(self, spec, document, upsert=False, multi=False):
+        """Queue an update.
+
+        The arguments are the same as for
+        :meth:`~apymongo.collection.Collection.update`.
+        """
+        if not isinstance(spec, dict):
+            raise TypeError("spec must be an instance of dict")
+        if not isinstance(document, dict):
+            raise TypeError("document must be an instance of dict")
+        if not isinstance(upsert, bool):
+            raise TypeError("upsert must be an instance of bool")
+        self.__ops.append((_UPDATE, (upsert, multi, spec, document)))
+        return self
+
+    def remove(self, spec_or_id=None):
+        """Queue a remove.
+
+        The arguments are the same as for
+        :meth:`~apymongo.collection.Collection.remove`.
+        """
+        if spec_or_id is None:
+            spec_or_id = {}
+        if not isinstance(spec_or_id, dict):
+            spec_or_id = {"_id": spec_or_id}
+        self.__ops.append((_REMOVE, spec_or_id))
+        return self
+
+    def __len__(self):
+        return len(self.__ops)
+
+    def __groups(self, last_error_args):
+        """Yield (message, operation indexes) for every group.
+        """
+        connection = self.__collection.database.connection
+        name = self.__collection.full_name
+        inserts = []
+        for (index, (kind, args)) in enumerate(self.__ops + [(None, None)]):
+            if kind == _INSERT:
+                inserts.append((index, args))
+                continue
+
+            # Split a run of inserts into as few messages as the
+            # connection's limits allow. check_keys is per message, so
+            # a run is only as lenient as its strictest insert.
+            if inserts:
+                check_keys = max([check for (_, (_, check)) in inserts])
+                parts = connection._insert_batches(name,
+                                                   [doc for (_, (doc, _))
+                                                    in inserts],
+                                                   check_keys, True,
+                                                   last_error_args, True)
+                start = 0
+                for (request_id, data, count) in parts:
+                    yield ((request_id, data),
+                           [i for (i, _) in inserts[start:start + count]])
+                    start += count
+                inserts = []
+
+            if kind == _UPDATE:
+                (upsert, multi, spec, document) = args
+                yield (connection._build_message(message.update, name,
+                                                 upsert, multi, spec,
+                                                 document, True,
+                                                 last_error_args), [index])
+            elif kind == _REMOVE:
+                yield (connection._build_message(message.delete, name, args,
+                                                 True, last_error_args),
+                       [index])
+
+    def execute(self, callback=None, **kwargs):
+        """Send every queued operation to the server.
+
+        Operations are unordered: one failing does not stop the others
+        from being applied. `callback` is passed a list with one result
+        per operation, in the order they were queued. An insert's
+        result is the ``"_id"`` of its document and an update or
+        remove's is the response to its *lastError* command. Where
+        something went wrong the result is the exception instead. The
+        server only reports the last error in each insert message, so
+        that error is given for every insert that shared the message.
+
+        Any keyword arguments are used as options for the
+        `getLastError` commands. For example, to wait for replication
+        to 3 nodes, pass ``w=3``.
+
+        A batch can only be executed once.
+        """
+        if self.__executed:
+            raise InvalidOperation("bulk operation has already been "
+                                   "executed")
+        if not self.__ops:
+            raise InvalidOperation("cannot execute an empty bulk operation")
+
+        # Encoding may raise InvalidDocument: the batch isn't executed
+        # until it has all been encoded.
+        groups = list(self.__groups(kwargs))
+        self.__executed = True
+
+        def mod_callback(responses):
+            if not callback:
+                return
+            results = [None] * len(self.__ops)
+            for ((_, indexes), response) in zip(groups, responses):
+                for index in indexes:
+                    (kind, args) = self.__ops[index]
+                    if kind == _INSERT and \
+                            not isinstance(response, Exception):
+                        results[index] = args[0].get("_id", None)
+                    else:
+                        results[index] = response
+            callback(results)
+
+        self.__collection.database.connection._send_batch(
+            [msg for (msg, _) in groups], mod_callback)
@@ -21,6 +21,7 @@ from bson.code import Code
 from bson.son import SON
 from apymongo import (helpers,
                      message)
+from apymongo.bulk import BulkOperation
 from apymongo.cursor import Cursor
 from apymongo.errors import InvalidName
 
@@ -219,8 +220,9 @@ class Collection(object):
                         manipulate, safe, callback=mod_callback **kwargs)
            
 
-    def insert(self, doc_or_docs,
-               manipulate=True, safe=False, check_keys=True, callback=None, **kwargs):
+    def insert(self, doc_or_docs, manipulate=True, safe=False,
+               check_keys=True, callback=None, continue_on_error=False,
+               **kwargs):
         """Insert a document(s) into this collection.
 
         If `manipulate` is set, the document(s) are manipulated using
@@ -236,6 +238,20 @@ class Collection(object):
         to the callback if one occurred. Safe inserts wait for a response from the
         database, while normal inserts do not.
 
+        A list of documents is split into several insert messages
+        when it is bigger than the connection's
+        :attr:`~apymongo.connection.Connection.max_message_size` or
+        :attr:`~apymongo.connection.Connection.max_batch_count`. The
+        callback is still called just once, for the insert as a whole.
+        Unless `continue_on_error` is set, a safe insert sends each
+        message only after the one before it has succeeded, stopping
+        at the first error. With `continue_on_error` all the messages
+        are sent straight away, the server carries on past documents
+        that fail, and the first error (if any) is passed once every
+        message has been answered. Every document is encoded before
+        anything is sent, so if one of them can't be encoded the error
+        is raised here and none of them are inserted.
+
         Any additional keyword arguments imply ``safe=True``, and
         will be used as options for the resultant `getLastError`
         command. For example, to wait for replication to 3 nodes, pass
@@ -250,6 +266,8 @@ class Collection(object):
           - `check_keys` (optional): check if keys start with '$' or
             contain '.', passing :class:`~pymongo.errors.InvalidName`
             in either case
+          - `continue_on_error` (optional): keep inserting the rest of
+            the documents if one of them fails
           - `**kwargs` (optional): any additional arguments imply
             ``safe=True``, and will be used as options for the
             `getLastError` command
@@ -267,17 +285,58 @@ class Collection(object):
 
         if kwargs:
             safe = True
-            
-        if callback:
-            def mod_callback(result):
+
+        def finish(error):
+            if not callback:
+                return
+            if error:
+                callback(error)
+            else:
                 ids = [doc.get("_id", None) for doc in docs]
                 callback(return_one and ids[0] or ids)
-        else:
-            mod_callback = None
-               
-        self.__database.connection._send_message(
-            message.insert(self.__full_name, docs,
-                           check_keys, safe, kwargs), with_last_error=safe,callback=mod_callback)
+
+        connection = self.__database.connection
+        if connection.coalesce_writes and not safe:
+            connection._coalesce_insert(self.__full_name, docs, check_keys,
+                                        finish)
+            return
+
+        parts = connection._insert_batches(self.__full_name, docs,
+                                           check_keys, safe, kwargs,
+                                           continue_on_error)
+
+        if safe and not continue_on_error:
+            def next_part(result=None):
+                if isinstance(result, Exception):
+                    finish(result)
+                    return
+                for (request_id, data, _) in parts:
+                    connection._send_message((request_id, data),
+                                             with_last_error=True,
+                                             callback=next_part)
+                    return
+                finish(None)
+
+            next_part()
+            return
+
+        errors = []
+        pending = [1]
+
+        def part_done(result):
+            if isinstance(result, Exception):
+                errors.append(result)
+            pending[0] -= 1
+            if not pending[0]:
+                finish(errors and errors[0] or None)
+
+        for (request_id, data, _) in parts:
+            pending[0] += 1
+            connection._send_message((request_id, data),
+                                     with_last_error=safe,
+                                     callback=(safe or callback) and
+                                     part_done or None)
+        part_done(None)
 
 
     def update(self, spec, document, upsert=False, manipulate=False,
@@ -343,9 +402,28 @@ class Collection(object):
         if kwargs:
             safe = True
 
-        self.__database.connection._send_message(
-            message.update(self.__full_name, upsert, multi,
-                           spec, document, safe, kwargs), with_last_error = safe, callback=callback)
+        connection = self.__database.connection
+        connection._send_message(
+            connection._build_message(message.update, self.__full_name,
+                                      upsert, multi, spec, document, safe,
+                                      kwargs),
+            with_last_error=safe, callback=callback)
+
+    def bulk(self):
+        """Start an unordered batch of writes to this collection.
+
+        Returns a :class:`~apymongo.bulk.BulkOperation`. Queue inserts,
+        updates and removes on it, then call its
+        :meth:`~apymongo.bulk.BulkOperation.execute` method to send
+        them all in a single round-trip::
+
+          >>> bulk = db.foo.bulk()
+          >>> bulk.insert({"x": 1})
+          >>> bulk.update({"x": 2}, {"$inc": {"y": 1}})
+          >>> bulk.remove({"x": 3})
+          >>> bulk.execute(callback=results)
+        """
+        return BulkOperation(self)
 
     def drop(self):
         """Alias for :meth:`~pymongo.database.Database.drop_collection`.
@@ -402,8 +480,11 @@ class Collection(object):
         if kwargs:
             safe = True
 
-        self.__database.connection._send_message(
-            message.delete(self.__full_name, spec_or_id, safe, kwargs), with_last_error=safe,callback=callback)
+        connection = self.__database.connection
+        connection._send_message(
+            connection._build_message(message.delete, self.__full_name,
+                                      spec_or_id, safe, kwargs),
+            with_last_error=safe, callback=callback)
 
     def find_one(self, spec_or_id = None, callback=None,  *args, **kwargs):
         """Get a single document from the database.
@@ -426,7 +507,8 @@ class Collection(object):
             are the same as the arguments to :meth:`find`.
 
         """
-        if spec_or_id is not None and not isinstance(spec_or_id, dict):
+        if spec_or_id is not None and not isinstance(spec_or_id, dict) and \
+                not getattr(type(spec_or_id), "_raw_document", False):
             spec_or_id = {"_id": spec_or_id}
             
         def mod_callback(resp):
@@ -501,6 +583,17 @@ class Collection(object):
           - `network_timeout` (optional): specify a timeout to use for
             this query, which will override the
             :class:`~pymongo.connection.Connection`-level default
+          - `read_preference` (optional): the
+            :class:`~apymongo.read_preferences.ReadPreference` choosing
+            which replica set member to read from (default is
+            :attr:`~apymongo.connection.Connection.read_preference`)
+          - `raw` (optional): if ``True``, return each document as its
+            undecoded BSON byte string, for relaying results without
+            paying to decode them
+          - `decode_fields` (optional): only decode these (possibly
+            dotted) keys of each document returned, skipping the rest
+            client-side. Unlike `fields` the whole documents are still
+            sent by the server
 
         .. note:: The `max_scan` parameter requires server
            version **>= 1.5.1**
@@ -509,6 +602,96 @@ class Collection(object):
         """
         return Cursor(self, *args, **kwargs)
 
+    def parallel_scan(self, num_cursors, processor=None, callback=None,
+                      **kwargs):
+        """Read the whole collection using several cursors at once.
+
+        The collection's lowest and highest ``"_id"`` are looked up
+        first, and the range between them is split into `num_cursors`
+        parts: even spans of generation time for
+        :class:`~bson.objectid.ObjectId` ids, even intervals for
+        numeric ones. Each part is then read by its own cursor, all at
+        the same time, so each gets its own stream from the pool (up to
+        the connection's `max_pool_size`) and its own cursor on the
+        server. If the ids can't be split (e.g. they are strings, or of
+        mixed types) a single cursor reads everything.
+
+        `processor` is applied to every document as for :meth:`find`.
+        Once every cursor is done `callback` is passed the results of
+        all of them, part by part in ``"_id"`` order. If any cursor
+        fails it is passed the first error instead.
+
+        Any other keyword arguments (e.g. `fields`, `store`,
+        `read_preference`) are passed on to every cursor. The lowest and
+        highest ids are read with the same `read_preference`.
+
+        :Parameters:
+          - `num_cursors`: how many cursors to read with
+          - `processor` (optional): called on every document read
+          - `callback`: called with the results, as above
+        """
+        if not isinstance(num_cursors, int):
+            raise TypeError("num_cursors must be an instance of int")
+        if num_cursors < 1:
+            raise ValueError("num_cursors must be >= 1")
+        assert callback is not None, "callback must not be None"
+        for key in ("spec", "sort", "skip", "limit"):
+            if key in kwargs:
+                raise TypeError("parallel_scan does not take %r" % key)
+
+        bounds = {}
+        bound_kwargs = {}
+        if "read_preference" in kwargs:
+            bound_kwargs["read_preference"] = kwargs["read_preference"]
+
+        def on_bound(which, doc):
+            if isinstance(doc, Exception):
+                if "error" not in bounds:
+                    bounds["error"] = doc
+                    callback(doc)
+                return
+            bounds[which] = doc and doc["_id"]
+            if "low" in bounds and "high" in bounds:
+                points = helpers._split_points(bounds["low"],
+                                               bounds["high"], num_cursors)
+                scan(points)
+
+        def scan(points):
+            edges = [None] + points + [None]
+            results = [None] * (len(edges) - 1)
+            state = {"pending": len(results), "failed": False}
+
+            def on_part(index, result):
+                if state["failed"]:
+                    return
+                if isinstance(result, Exception):
+                    state["failed"] = True
+                    callback(result)
+                    return
+                results[index] = result
+                state["pending"] -= 1
+                if not state["pending"]:
+                    merged = []
+                    for part in results:
+                        merged.extend(part)
+                    callback(merged)
+
+            for index in range(len(results)):
+                spec = SON()
+                if edges[index] is not None:
+                    spec["$gte"] = edges[index]
+                if edges[index + 1] is not None:
+                    spec["$lt"] = edges[index + 1]
+                self.find(spec=spec and {"_id": spec} or {},
+                          processor=processor,
+                          callback=functools.partial(on_part, index),
+                          **kwargs).loop()
+
+        for (which, direction) in (("low", 1), ("high", -1)):
+            self.find_one(fields=["_id"], sort=[("_id", direction)],
+                          callback=functools.partial(on_bound, which),
+                          **bound_kwargs)
+
 
     def count(self,callback):
         """Get the number of documents in this collection.
@@ -33,31 +33,40 @@ access:
   Database(Connection('localhost', 27017), u'test-database')
 """
 
+import collections
 import datetime
 import os
 import select
 import struct
 import socket
-import threading
 import time
 import warnings
 import functools
 
+import tornado.ioloop
 import tornado.iostream
 
+import bson
 from apymongo import (database,
                      helpers,
-                     message)
+                     message,
+                     monitoring,
+                     read_preferences)
 from apymongo.cursor_manager import CursorManager
+from apymongo.read_preferences import ReadPreference
 from apymongo.errors import (AutoReconnect,
                             ConfigurationError,
                             ConnectionFailure,
                             DuplicateKeyError,
+                            InvalidOperation,
                             InvalidURI,
                             OperationFailure)
 
 
 _CONNECT_TIMEOUT = 20.0
+_PIPELINE_DEPTH = 100
+# How much each new ping time counts towards a node's moving average.
+_RTT_WEIGHT = 0.2
 
 
 def _partition(source, sub):
@@ -140,80 +149,580 @@ def _parse_uri(uri, default_port=27017):
     return (host_list, db, username, password, collection, options)
 
 
-def receive_body_on_stream(operation,request_id,strm,callback,header):
+class _StreamDispatcher(object):
+    """Routes replies arriving on a single stream to waiting callbacks.
 
-        length = struct.unpack("<i", header[:4])[0]
-        assert request_id == struct.unpack("<i", header[8:12])[0], \
-            "ids don't match %r %r" % (request_id,
-                                       struct.unpack("<i", header[8:12])[0])
-        assert operation == struct.unpack("<i", header[12:])[0]
+    Any number of requests can be in flight on the stream at once. A
+    single reader pulls OP_REPLY headers off the stream for as long as
+    requests are outstanding, and hands each body to the callback
+    registered under the reply's `responseTo` id. If the stream closes,
+    every outstanding callback is passed an
+    :class:`~apymongo.errors.AutoReconnect` instance.
+    """
 
-        strm.read_bytes(length-16,callback)
+    def __init__(self, stream, close_callback=None):
+        self.stream = stream
+        self.pending = {}
+        self.reading = False
+        self.close_callback = close_callback
+        stream.set_close_callback(self.__on_close)
 
+    def send(self, request_id, data, callback):
+        """Write `data` and pass the reply to `request_id` to `callback`.
+        """
+        self.pending[request_id] = callback
+        try:
+            self.stream.write(data)
+        except (IOError, socket.error), e:
+            del self.pending[request_id]
+            callback(AutoReconnect(str(e)))
+            return
 
-class _Pool(threading.local):
-    """A simple connection pool.
+        if not self.reading:
+            self.__read_header()
 
-    Uses thread-local stream per thread. By calling return_stream() a
-    thread can return a stream to the pool. Right now the pool size is
-    capped at 10 streams - we can expose this as a parameter later, if
-    needed.
-    """
+    def __read_header(self):
+        self.reading = True
+        self.__read(16, self.__on_header)
 
-    # Non thread-locals
-    __slots__ = ["streams", "stream_factory", "pool_size", "pid"]
+    def __on_header(self, header):
+        (length, _, response_to, operation) = struct.unpack("<iiii", header)
+        if operation != 1:
+            # Nothing read after this could be trusted, so give up on
+            # the stream and fail everything waiting on it.
+            self.stream.close()
+            return
+        self.__read(length - 16,
+                    functools.partial(self.__on_body, response_to))
 
-    # thread-local default
-    stream = None
+    def __read(self, length, callback):
+        try:
+            self.stream.read_bytes(length, callback)
+        except IOError:
+            # The stream has closed (StreamClosedError is an IOError)
+            # but may not have said so yet. Fail whatever is still
+            # waiting now, as nothing more will be read.
+            self.__on_close()
+
+    def __on_body(self, response_to, body):
+        callback = self.pending.pop(response_to, None)
+
+        # Keep reading before running the callback, which may well
+        # send another request on this same stream.
+        if self.pending:
+            self.__read_header()
+        else:
+            self.reading = False
+
+        if callback is not None:
+            callback(body)
+
+    def __on_close(self):
+        pending = self.pending
+        self.pending = {}
+        self.reading = False
+        if self.close_callback is not None:
+            self.close_callback(self.stream)
+        for callback in pending.itervalues():
+            callback(AutoReconnect("connection closed"))
+
+
+class _Pool(object):
+    """An IOLoop-aware pool of streams to a single host.
+
+    A stream is checked out with :meth:`get_stream` for a single request
+    and handed back with :meth:`return_stream` as soon as the reply to
+    that request has been read (or as soon as the request has been
+    written, if it expects no reply). At most `max_size` streams are
+    open or opening at any time. When all of them are busy, checkouts
+    queue up and are served in FIFO order as streams come back, failing
+    with :class:`~apymongo.errors.ConnectionFailure` if
+    `wait_queue_timeout` seconds pass first.
+
+    Each stream carries at most `max_in_flight` requests at once -
+    ``1`` unless replies are being pipelined. The pool tops itself back
+    up to `min_size` streams when it has to discard one.
+
+    If `check_interval` is given, :meth:`reap` runs on the IOLoop every
+    `check_interval` seconds. It evicts idle streams that have been open
+    longer than `max_lifetime` or unused for longer than
+    `max_idle_time`, and checks the remaining idle streams are still
+    alive by passing them to `ping`. That way dead sockets are found in
+    the background rather than by the next request to use them. Nothing
+    else is sent down a stream while it is being pinged, so a ping that
+    goes unanswered only ever closes a stream it has to itself. The
+    number of streams evicted for each reason is kept in `evictions`.
+    """
 
-    def __init__(self, stream_factory):
-        self.pid = os.getpid()
-        self.pool_size = 10
+    def __init__(self, stream_factory, io_loop, min_size=0, max_size=10,
+                 max_in_flight=1, wait_queue_timeout=None,
+                 check_interval=None, max_idle_time=None, max_lifetime=None,
+                 ping=None, evictions=None):
         self.stream_factory = stream_factory
-        if not hasattr(self, "streams"):
-            self.streams = []
+        self.io_loop = io_loop
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_in_flight = max_in_flight
+        self.wait_queue_timeout = wait_queue_timeout
+        self.check_interval = check_interval
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.ping = ping
+        if evictions is None:
+            evictions = {}
+        self.evictions = evictions
+        self.closed = False
+        self.__reset()
+
+        self.__reaper = None
+        if check_interval is not None:
+            self.__reaper = tornado.ioloop.PeriodicCallback(
+                self.reap, check_interval * 1000, io_loop)
+            self.__reaper.start()
+
+    def __reset(self):
+        self.pid = os.getpid()
+        self.streams = []
+        self.in_flight = {}
+        self.created = {}
+        self.last_used = {}
+        self.pinging = set()
+        self.opening = 0
+        self.waiters = collections.deque()
+
+    def __io_loop(self):
+        return self.io_loop or tornado.ioloop.IOLoop.instance()
 
+    @property
+    def size(self):
+        """Number of streams that are open or being opened.
+        """
+        return len(self.streams) + self.opening
+
+    def get_stream(self, callback):
+        """Pass a stream to `callback` as soon as one is available.
 
-    def get_stream(self,callback):
+        If the stream cannot be opened, or the checkout times out,
+        `callback` is passed the exception instead.
+        """
         # We use the pid here to avoid issues with fork / multiprocessing.
         # See test.test_connection:TestConnection.test_fork for an example of
         # what could go wrong otherwise
-        pid = os.getpid()
+        if os.getpid() != self.pid:
+            self.__reset()
+
+        if self.closed:
+            callback(AutoReconnect("connection pool has been closed"))
+        elif not self.__check_out(callback):
+            self.__wait(callback)
+
+    def return_stream(self, strm):
+        """Give back a stream checked out with :meth:`get_stream`.
+        """
+        if strm not in self.in_flight:
+            # Discarded already, or left over from before a fork.
+            return
+
+        self.in_flight[strm] -= 1
+        self.last_used[strm] = time.time()
+        if strm.closed():
+            self.__discard(strm, "closed")
+        elif self.closed and not self.in_flight[strm]:
+            self.__discard(strm)
 
-        if pid != self.pid:
-            self.sock = None
-            self.streams = []
-            self.pid = pid
+        self.__serve_waiters()
 
-        if self.stream is not None and self.stream[0] == pid:
-            callback(self.stream[1])
+    def close(self, abort=False):
+        """Close all streams once they are no longer in use.
 
+        Idle streams are closed immediately, busy ones when they are
+        returned - or straight away too if `abort` is ``True``, failing
+        whatever they have in flight. Checkouts still waiting are failed.
+        """
+        self.closed = True
+        if self.__reaper is not None:
+            self.__reaper.stop()
+
+        for strm in [s for s in self.streams
+                     if abort or not self.in_flight[s]]:
+            self.__discard(strm)
+
+        waiters = self.waiters
+        self.waiters = collections.deque()
+        for (callback, timeout) in waiters:
+            if timeout is not None:
+                self.__io_loop().remove_timeout(timeout)
+            callback(AutoReconnect("connection pool has been closed"))
+
+    def __pick(self):
+        """Find the open stream with the fewest requests in flight,
+        leaving out any being pinged.
+
+        Closed streams found along the way are discarded.
+        """
+        best = None
+        for strm in self.streams[:]:
+            if strm.closed():
+                self.__discard(strm, "closed")
+                continue
+            if strm in self.pinging:
+                continue
+            count = self.in_flight[strm]
+            if count < self.max_in_flight and \
+                    (best is None or count < self.in_flight[best]):
+                best = strm
+        return best
+
+    def fill(self, callback=None):
+        """Open streams in parallel until there are `min_size` of them.
+
+        `callback`, if given, is passed ``None`` once they are all open,
+        or the first exception raised while opening them.
+        """
+        needed = self.min_size - self.size
+        if needed <= 0:
+            if callback:
+                callback(None)
+            return
+
+        state = {"left": needed, "error": None}
+
+        def stream_callback(strm):
+            if isinstance(strm, Exception):
+                state["error"] = state["error"] or strm
+            else:
+                self.return_stream(strm)
+
+            state["left"] -= 1
+            if not state["left"] and callback:
+                callback(state["error"])
+
+        for _ in range(needed):
+            self.__open(stream_callback)
+
+    def __serve_waiters(self):
+        while self.waiters and self.__available():
+            (callback, timeout) = self.waiters.popleft()
+            if timeout is not None:
+                self.__io_loop().remove_timeout(timeout)
+            self.__check_out(callback)
+
+    def __available(self):
+        return self.size < self.max_size or self.__pick() is not None
+
+    def __check_out(self, callback):
+        """Pass `callback` a stream without waiting, if we can.
+
+        An idle stream is preferred, then a new one if the pool may
+        still grow, then the least loaded stream with room for another
+        request. Returns ``False`` if none of those is possible.
+        """
+        strm = self.__pick()
+        if strm is not None and \
+                (not self.in_flight[strm] or self.size >= self.max_size):
+            self.in_flight[strm] += 1
+            callback(strm)
+        elif self.size < self.max_size:
+            self.__open(callback)
         else:
-            try:
-                self.stream = (pid, self.streams.pop())
-            except IndexError:
+            return False
+        return True
 
-                def stream_callback(strm):
-                    if not isinstance(strm,Exception):
-                        self.stream = (pid,strm)
-                    callback(strm)
+    def __open(self, callback):
+        pid = self.pid
 
-                self.stream_factory(stream_callback)
+        def stream_callback(strm):
+            if pid != self.pid:
+                # We forked while connecting.
+                if not isinstance(strm, Exception):
+                    strm.close()
+                return
 
+            self.opening -= 1
+            if isinstance(strm, Exception):
+                callback(strm)
+                # Let the next waiter have a go at connecting.
+                self.__serve_waiters()
             else:
-                callback(self.stream[1])
+                self.streams.append(strm)
+                self.in_flight[strm] = 1
+                self.created[strm] = self.last_used[strm] = time.time()
+                callback(strm)
+                # Pipelined streams have room for the waiters too.
+                self.__serve_waiters()
 
+        self.opening += 1
+        try:
+            self.stream_factory(stream_callback)
+        except:
+            self.opening -= 1
+            raise
+
+    def __wait(self, callback):
+        waiter = [callback, None]
+        self.waiters.append(waiter)
+
+        if self.wait_queue_timeout is not None:
+            def expire():
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    return
+                callback(ConnectionFailure("timed out waiting %s seconds for "
+                                           "a stream from the pool" %
+                                           self.wait_queue_timeout))
+
+            waiter[1] = self.__io_loop().add_timeout(
+                time.time() + self.wait_queue_timeout, expire)
+
+    def reap(self):
+        """Evict stale idle streams and ping the rest.
+
+        Streams with requests in flight are left alone - they are
+        either healthy or about to find out that they are not.
+        """
+        now = time.time()
+        for strm in self.streams[:]:
+            if self.in_flight[strm]:
+                continue
+
+            if strm.closed():
+                self.__discard(strm, "closed")
+            elif self.max_lifetime is not None and \
+                    now - self.created[strm] > self.max_lifetime:
+                self.__discard(strm, "lifetime")
+            elif self.max_idle_time is not None and \
+                    now - self.last_used[strm] > self.max_idle_time and \
+                    self.size > self.min_size:
+                self.__discard(strm, "idle")
+            elif self.ping is not None and \
+                    now - self.last_used[strm] >= self.check_interval:
+                self.__ping(strm)
+
+    def __ping(self, strm):
+        # Check the stream out while it is being pinged, and give up on
+        # it if there is no answer before the next check. It isn't
+        # shared with pipelined requests meanwhile, which closing it
+        # would fail.
+        self.in_flight[strm] += 1
+        self.pinging.add(strm)
+        io_loop = self.__io_loop()
+        timeout = io_loop.add_timeout(time.time() + self.check_interval,
+                                      strm.close)
+
+        def callback(alive):
+            io_loop.remove_timeout(timeout)
+            if strm not in self.in_flight:
+                return
+            self.pinging.discard(strm)
+            if alive:
+                self.return_stream(strm)
+            else:
+                self.in_flight[strm] -= 1
+                self.__discard(strm, "ping")
+                self.__serve_waiters()
+
+        self.ping(strm, callback)
+
+    def __discard(self, strm, reason=None):
+        self.streams.remove(strm)
+        del self.in_flight[strm]
+        del self.created[strm]
+        del self.last_used[strm]
+        self.pinging.discard(strm)
+        if not strm.closed():
+            strm.close()
+        if reason is not None:
+            self.evictions[reason] = self.evictions.get(reason, 0) + 1
+
+        if not self.closed and self.size < self.min_size:
+            self.__open(self.return_stream)
+
+
+class _Monitor(object):
+    """Keeps track of the role and round-trip time of every node.
+
+    Each round of checks sends an ``ismaster`` to every node in `nodes`
+    at once, over streams opened with `connect` and kept just for
+    monitoring. Hosts that a replica set member reports are added to
+    `nodes` and checked in the same round. Once every node has replied,
+    failed or gone `timeout` seconds without answering, `primary` is
+    updated and `on_check` is called. Each node's ping time is kept in
+    `rtts` as a moving average.
+
+    :meth:`start` runs a round straight away and, if that round finds
+    more than one node, a replica set member or no primary, another
+    every `interval` seconds. A lone standalone server that answers is
+    not polled, and its monitoring stream is closed, so nothing is left
+    open between rounds. :meth:`check` runs a round straight away.
+    """
+
+    def __init__(self, connect, nodes, io_loop, interval, on_check,
+                 timeout=_CONNECT_TIMEOUT):
+        self.connect = connect
+        self.nodes = nodes
+        self.io_loop = io_loop
+        self.interval = interval
+        self.on_check = on_check
+        self.timeout = timeout
+        # node -> "primary", "secondary", "arbiter", "other", or None
+        # if the node could not be reached
+        self.roles = {}
+        self.rtts = {}
+        self.primary = None
+        self.dispatchers = {}
+        self.started = False
+        self.closed = False
+        self.__pending = None
+        self.__periodic = None
+        self.__replica_set = False
+        # node -> timeout for connections still being opened
+        self.__connecting = {}
+
+    def __io_loop(self):
+        return self.io_loop or tornado.ioloop.IOLoop.instance()
+
+    def start(self):
+        """Run a round of checks now, and every `interval` seconds after
+        if there is more than one node to watch.
+        """
+        self.started = True
+        self.check()
 
-    def return_stream(self):
-        if self.stream is not None and self.stream[0] == os.getpid():
-            # There's a race condition here, but we deliberately
-            # ignore it.  It means that if the pool_size is 10 we
-            # might actually keep slightly more than that.
-            if len(self.streams) < self.pool_size:
-                self.streams.append(self.stream[1])
+    def close(self):
+        """Stop checking and close the monitoring streams.
+        """
+        self.closed = True
+        self.__stop()
+
+    def __stop(self):
+        if self.__periodic is not None:
+            self.__periodic.stop()
+            self.__periodic = None
+        for dispatcher in self.dispatchers.values():
+            dispatcher.stream.close()
+        self.dispatchers = {}
+
+    def check(self):
+        """Start a round of checks, if monitoring has been started and
+        no round is already under way.
+        """
+        if self.closed or not self.started or self.__pending is not None:
+            return
+        # Every node is pending before any is checked, so the round
+        # cannot finish early when a check fails straight away.
+        self.__pending = set(self.nodes)
+        for node in list(self.__pending):
+            self.__check(node)
+
+    def __check(self, node):
+        dispatcher = self.dispatchers.get(node)
+        if dispatcher is not None and not dispatcher.stream.closed():
+            self.__send(node, dispatcher)
+        else:
+            # A node that never answers the connect must not hold up the
+            # round, so the connect gets the same timeout as the check.
+            timeout = self.__io_loop().add_timeout(
+                time.time() + self.timeout,
+                functools.partial(self.__connect_timed_out, node))
+            self.__connecting[node] = timeout
+            self.connect(node, functools.partial(self.__on_connect, node,
+                                                 timeout))
+
+    def __connect_timed_out(self, node):
+        del self.__connecting[node]
+        self.__checked(node, None)
+
+    def __on_connect(self, node, timeout, strm):
+        if self.__connecting.get(node) is not timeout:
+            # Too late - the node has been marked unreachable already.
+            if not isinstance(strm, Exception):
+                strm.close()
+            return
+        del self.__connecting[node]
+        self.__io_loop().remove_timeout(timeout)
+        if isinstance(strm, Exception):
+            self.__checked(node, None)
+            return
+        if self.closed:
+            strm.close()
+            return
+        dispatcher = _StreamDispatcher(strm)
+        self.dispatchers[node] = dispatcher
+        self.__send(node, dispatcher)
+
+    def __send(self, node, dispatcher):
+        (request_id, data) = message.query(0, "admin.$cmd", 0, -1,
+                                           {"ismaster": 1})
+        io_loop = self.__io_loop()
+        start = time.time()
+        timeout = io_loop.add_timeout(start + self.timeout,
+                                      dispatcher.stream.close)
+
+        def callback(response):
+            io_loop.remove_timeout(timeout)
+            if isinstance(response, Exception):
+                self.__checked(node, None)
+                return
+            try:
+                response = helpers._unpack_response(response)["data"][0]
+            except Exception:
+                dispatcher.stream.close()
+                self.__checked(node, None)
+                return
+            rtt = time.time() - start
+            if node in self.rtts:
+                rtt = (1 - _RTT_WEIGHT) * self.rtts[node] + _RTT_WEIGHT * rtt
+            self.rtts[node] = rtt
+            self.__checked(node, response)
+
+        dispatcher.send(request_id, data, callback)
+
+    def __checked(self, node, response):
+        if response is None:
+            self.roles[node] = None
+            self.rtts.pop(node, None)
+            dispatcher = self.dispatchers.pop(node, None)
+            if dispatcher is not None:
+                dispatcher.stream.close()
+        else:
+            if response.get("ismaster"):
+                self.roles[node] = "primary"
+            elif response.get("secondary"):
+                self.roles[node] = "secondary"
+            elif response.get("arbiterOnly"):
+                self.roles[node] = "arbiter"
+            else:
+                self.roles[node] = "other"
+            if response.get("setName") or response.get("hosts"):
+                self.__replica_set = True
+
+            hosts = response.get("hosts", []) + response.get("passives", [])
+            for new in [_str_to_node(h) for h in hosts]:
+                if new not in self.nodes:
+                    self.nodes.add(new)
+                    self.__pending.add(new)
+                    self.__check(new)
+
+        self.__pending.discard(node)
+        if not self.__pending:
+            self.__pending = None
+            primaries = [n for n in self.nodes
+                         if self.roles.get(n) == "primary"]
+            self.primary = primaries and primaries[0] or None
+            if self.closed:
+                return
+            if len(self.nodes) > 1 or self.__replica_set or \
+                    self.primary is None:
+                if self.__periodic is None:
+                    self.__periodic = tornado.ioloop.PeriodicCallback(
+                        self.check, self.interval * 1000, self.io_loop)
+                    self.__periodic.start()
             else:
-                self.stream[1].close()
-        self.stream = None
+                # A lone standalone server that is up has nothing to
+                # fail over to, so stop polling.
+                self.__stop()
+            self.on_check()
 
 
 class Connection(object):  # TODO support auth for pooling
@@ -226,7 +735,17 @@ class Connection(object):  # TODO support auth for pooling
     def __init__(self, host=None, port=None, io_loop=None, pool_size=None,
                  auto_start_request=None, timeout=None, slave_okay=False,
                  network_timeout=None, document_class=dict, tz_aware=False,
-                 _connect=True):
+                 pipeline=False, min_pool_size=0, max_pool_size=10,
+                 wait_queue_timeout=None, health_check_interval=None,
+                 max_idle_time=None, max_lifetime=None,
+                 max_message_size=message.MAX_MESSAGE_SIZE,
+                 max_batch_count=message.MAX_BATCH_COUNT,
+                 coalesce_writes=False, heartbeat_interval=10,
+                 read_preference=ReadPreference.PRIMARY,
+                 secondary_acceptable_latency_ms=15, decode_executor=None,
+                 decode_threshold=1024 * 1024, event_listeners=None,
+                 slow_op_threshold_ms=None, slow_op_log_size=100,
+                 callback=None, _connect=True):
         """Create a new connection to a single MongoDB instance at *host:port*.
 
         The resultant connection object has connection-pooling built
@@ -240,8 +759,9 @@ class Connection(object):  # TODO support auth for pooling
         execute.
 
         Raises :class:`TypeError` if port is not an instance of
-        ``int``. Raises :class:`~pymongo.errors.ConnectionFailure` if
-        the connection cannot be made.
+        ``int``. If no primary can be found, `callback` is passed an
+        :class:`~pymongo.errors.AutoReconnect` and operations fail with
+        one until the node monitoring finds a primary.
 
         The `host` parameter can be a full `mongodb URI
         <http://dochub.mongodb.org/core/connections>`_, in addition to
@@ -270,8 +790,84 @@ class Connection(object):  # TODO support auth for pooling
             :class:`~datetime.datetime` instances returned as values
             in a document by this :class:`Connection` will be timezone
             aware (otherwise they will be naive)
-
-        .. seealso:: :meth:`end_request`
+          - `pipeline` (optional): if ``True``, requests that expect a
+            reply do not wait for each other - they are all written to
+            a shared stream straight away and replies are matched back
+            to their callbacks by request id
+          - `min_pool_size` (optional): number of streams the pool
+            keeps open even when they are not in use
+          - `max_pool_size` (optional): largest number of streams
+            that may be open to the server at once; further requests
+            wait for a stream to be returned
+          - `wait_queue_timeout` (optional): how long (in seconds) a
+            request may wait for a stream before it fails with
+            :class:`~apymongo.errors.ConnectionFailure` - default is to
+            wait indefinitely
+          - `health_check_interval` (optional): how often (in seconds)
+            to check on idle streams in the background. Each check
+            evicts streams that have outlived `max_idle_time` or
+            `max_lifetime`, and sends a cheap ``ismaster`` down any
+            other stream that has sat idle since the last check,
+            evicting it if no reply comes back in time
+          - `max_idle_time` (optional): evict streams that have not
+            been used for this many seconds, as long as that leaves at
+            least `min_pool_size` of them
+          - `max_lifetime` (optional): evict streams once they have
+            been open for this many seconds
+          - `max_message_size` (optional): largest message (in bytes)
+            a bulk insert is sent in - bigger inserts are split
+          - `max_batch_count` (optional): most documents a bulk insert
+            puts in a single message - bigger inserts are split
+          - `coalesce_writes` (optional): if ``True``, unsafe inserts
+            to the same collection made during one iteration of the
+            IOLoop are sent together as a single insert message (which
+            continues past documents that fail), flushing early once
+            it reaches `max_batch_count` documents or
+            `max_message_size` bytes. Queued inserts are also written
+            before any other message is. That only orders them on the
+            server if both go down the same stream, so use safe
+            writes where a later read must see them
+          - `heartbeat_interval` (optional): how often (in seconds)
+            to check the role of every known node. If the primary
+            changes, everything in flight to the old one fails with
+            :class:`~apymongo.errors.AutoReconnect` and new requests
+            go to the new one. Nodes are only checked this way when
+            more than one is known or the server is a replica set
+            member, or no primary has been found yet; a single
+            standalone server stops being checked once it answers. Call
+            :meth:`close` to stop the checks
+          - `read_preference` (optional): which replica set members
+            queries read from by default - one of the
+            :class:`~apymongo.read_preferences.ReadPreference` modes.
+            Reads that are sent to a secondary go through a separate
+            pool of streams to that secondary
+          - `secondary_acceptable_latency_ms` (optional): when several
+            members could serve a read, it goes to one whose average
+            ping time is within this many milliseconds of the fastest
+          - `decode_executor` (optional): a thread or process pool
+            (anything with a ``submit(fn, *args)`` method returning a
+            future, e.g. a :class:`concurrent.futures.ThreadPoolExecutor`)
+            that large query replies are decoded in, so decoding them
+            doesn't hold up the IOLoop. Cursor callbacks are still run
+            on the IOLoop, once the decoding is done
+          - `decode_threshold` (optional): replies of at least this many
+            bytes are decoded by `decode_executor`; smaller ones aren't
+            worth the trip and are decoded on the IOLoop
+          - `event_listeners` (optional): a list of
+            :class:`~apymongo.monitoring.OperationListener` instances
+            to tell when each operation starts, succeeds or fails, with
+            its timings and sizes. See :mod:`apymongo.monitoring`
+          - `slow_op_threshold_ms` (optional): queries, getMores and
+            commands taking at least this many milliseconds (from
+            sending to having decoded the reply) are kept in the log
+            returned by :meth:`slow_operations`. ``None`` (the default)
+            turns the log off
+          - `slow_op_log_size` (optional): how many slow operations to
+            keep; older ones are dropped
+          - `callback` (optional): called once the primary has been
+            found and `min_pool_size` streams to it have been opened
+            (in parallel). Passed this :class:`Connection`, or the
+            exception that stopped it from getting ready
 
         .. mongodoc:: connections
         """
@@ -315,6 +911,50 @@ class Connection(object):  # TODO support auth for pooling
             warnings.warn("The timeout parameter to Connection is deprecated",
                           DeprecationWarning)
 
+        if not isinstance(min_pool_size, int) or \
+                not isinstance(max_pool_size, int):
+            raise TypeError("min_pool_size and max_pool_size must be "
+                            "instances of int")
+        if max_pool_size < 1:
+            raise ConfigurationError("max_pool_size must be at least 1")
+        if health_check_interval is None and \
+                (max_idle_time is not None or max_lifetime is not None):
+            raise ConfigurationError("max_idle_time and max_lifetime "
+                                     "require a health_check_interval")
+        if read_preference not in read_preferences.MODES:
+            raise ConfigurationError("unknown read preference %r" %
+                                     (read_preference,))
+        if heartbeat_interval <= 0:
+            raise ConfigurationError("heartbeat_interval must be positive")
+        if max_message_size < 1 or max_batch_count < 1:
+            raise ConfigurationError("max_message_size and max_batch_count "
+                                     "must be at least 1")
+        if not 0 <= min_pool_size <= max_pool_size:
+            raise ConfigurationError("min_pool_size must be between 0 and "
+                                     "max_pool_size")
+        if decode_executor is not None and \
+                not callable(getattr(decode_executor, "submit", None)):
+            raise TypeError("decode_executor must have a submit method")
+        if not isinstance(decode_threshold, (int, long)):
+            raise TypeError("decode_threshold must be an instance of int")
+        if decode_threshold < 0:
+            raise ConfigurationError("decode_threshold must not be negative")
+        event_listeners = tuple(event_listeners or ())
+        for listener in event_listeners:
+            if not isinstance(listener, monitoring.OperationListener):
+                raise TypeError("event listeners must be instances of "
+                                "OperationListener")
+        if slow_op_threshold_ms is not None:
+            if not isinstance(slow_op_threshold_ms, (int, long, float)):
+                raise TypeError("slow_op_threshold_ms must be a number")
+            if slow_op_threshold_ms < 0:
+                raise ConfigurationError("slow_op_threshold_ms must not be "
+                                         "negative")
+        if not isinstance(slow_op_log_size, int):
+            raise TypeError("slow_op_log_size must be an instance of int")
+        if slow_op_log_size < 1:
+            raise ConfigurationError("slow_op_log_size must be at least 1")
+
         self.__host = None
         self.__port = None
 
@@ -336,8 +976,42 @@ class Connection(object):  # TODO support auth for pooling
 
         self.__cursor_manager = CursorManager(self)
 
-        self.__pool = _Pool(self.__connect)
-        self.__last_checkout = time.time()
+        self.__pipeline = pipeline
+        self.__min_pool_size = min_pool_size
+        self.__max_pool_size = max_pool_size
+        self.__wait_queue_timeout = wait_queue_timeout
+        self.__health_check_interval = health_check_interval
+        self.__max_idle_time = max_idle_time
+        self.__max_lifetime = max_lifetime
+        self.__evictions = {}
+        self.__max_message_size = max_message_size
+        self.__max_batch_count = max_batch_count
+        self.__coalesce_writes = coalesce_writes
+        # Queues by collection name, and the names in the order the
+        # queues were started, so that they go out in the order the
+        # inserts were made.
+        self.__coalesced = {}
+        self.__coalesced_order = []
+        self.__flush_scheduled = False
+
+        self.__read_preference = read_preference
+        self.__latency = secondary_acceptable_latency_ms / 1000.0
+        self.__decode_executor = decode_executor
+        self.__decode_threshold = decode_threshold
+        self.__listeners = event_listeners
+        # How long the messages built by _build_message took, by
+        # request id, until they are sent.
+        self.__encode_durations = {}
+        self.__slow_op_threshold_ms = slow_op_threshold_ms
+        self.__slow_ops = collections.deque(maxlen=slow_op_log_size)
+
+        self.__pool = self.__make_pool(None)
+        self.__read_pools = {}
+        self.__dispatchers = {}
+        self.__ready_callback = callback
+        self.__discovering = False
+        self.__monitor = _Monitor(self.__connect, self.__nodes, io_loop,
+                                  heartbeat_interval, self.__topology_checked)
 
         self.__network_timeout = network_timeout
         self.__document_class = document_class
@@ -469,6 +1143,103 @@ class Connection(object):  # TODO support auth for pooling
         """
         return self.__nodes
 
+    @property
+    def pool_evictions(self):
+        """How many pooled streams have been evicted, and why.
+
+        A dictionary mapping each reason (``"closed"``, ``"idle"``,
+        ``"lifetime"`` or ``"ping"``) to a count.
+        """
+        return dict(self.__evictions)
+
+    @property
+    def max_message_size(self):
+        """Largest message (in bytes) a bulk insert is sent in.
+        """
+        return self.__max_message_size
+
+    @property
+    def max_batch_count(self):
+        """Most documents a bulk insert puts in a single message.
+        """
+        return self.__max_batch_count
+
+    @property
+    def coalesce_writes(self):
+        """Are unsafe inserts coalesced into shared messages?
+        """
+        return self.__coalesce_writes
+
+    @property
+    def decode_executor(self):
+        """The executor large replies are decoded in, or ``None``.
+        """
+        return self.__decode_executor
+
+    @property
+    def decode_threshold(self):
+        """Smallest reply (in bytes) handed to :attr:`decode_executor`.
+        """
+        return self.__decode_threshold
+
+    @property
+    def event_listeners(self):
+        """The listeners operations are reported to, as a tuple.
+        """
+        return self.__listeners
+
+    @property
+    def slow_op_threshold_ms(self):
+        """How long (in milliseconds) an operation takes to be logged
+        as slow, or ``None`` if slow operations aren't logged.
+        """
+        return self.__slow_op_threshold_ms
+
+    def slow_operations(self):
+        """Get the most recent slow operations, oldest first.
+
+        Each is a dict in the style of a ``system.profile`` document,
+        ready to be dumped with :mod:`~apymongo.json_util`:
+
+          - ``"ts"``: when the operation finished (UTC)
+          - ``"op"``: ``"query"``, ``"getmore"`` or ``"command"``
+          - ``"ns"``: the full name of the collection
+          - ``"millis"``: how long it took
+          - ``"query"``: the shape of the query or command - its
+            document with every value replaced by a placeholder naming
+            its type, e.g. ``{"age": {"$gt": "<int>"}}``
+          - ``"orderby"``, ``"hint"``: the cursor's sort and hint, or
+            ``None``
+          - ``"nreturned"``: the number of documents in the reply
+          - ``"batches"``: the number of batches the cursor had had,
+            this one included
+
+        See the `slow_op_threshold_ms` parameter to :class:`Connection`.
+        """
+        return list(self.__slow_ops)
+
+    def clear_slow_operations(self):
+        """Empty the slow operation log.
+        """
+        self.__slow_ops.clear()
+
+    def _is_slow(self, duration):
+        """Does an operation taking `duration` seconds go in the slow
+        operation log?
+        """
+        threshold = self.__slow_op_threshold_ms
+        return threshold is not None and duration * 1000 >= threshold
+
+    def _log_slow_operation(self, entry):
+        self.__slow_ops.append(entry)
+
+    @property
+    def read_preference(self):
+        """The :class:`~apymongo.read_preferences.ReadPreference` queries
+        use unless they are given one of their own.
+        """
+        return self.__read_preference
+
     @property
     def slave_okay(self):
         """Is it okay for this connection to connect directly to a slave?
@@ -500,67 +1271,107 @@ class Connection(object):  # TODO support auth for pooling
 
 
     def __find_master(self):
+        """Start monitoring the nodes. Until the first round of checks
+        is over requests go to the first node given.
         """
-           do it and downstream with callbacks
-        """
-        # Special case the first node to try to get the primary or any
-        # additional hosts from a replSet:
-        first = iter(self.__nodes).next()
-
-        callback = self.__callback_master
-        self.__try_node(first,callback)
-
-
-    def __try_node(self, node,callback):
-        self.disconnect()
-        self.__host, self.__port = node
-        self.admin.command("ismaster",callback=callback)
-
-
-    def __callback_master(self,response):
-
-        if isinstance(response,Exception):
-            raise response
+        self.__discovering = True
+        self.__select(iter(self.__nodes).next())
+        self.__monitor.start()
 
+    def __choose_node(self):
+        """Pick the node requests should go to, or ``None`` if there is
+        no suitable node.
+        """
+        monitor = self.__monitor
+        if monitor.primary is not None:
+            return monitor.primary
+        if self.__slave_okay:
+            current = (self.__host, self.__port)
+            if monitor.roles.get(current) in ("secondary", "other"):
+                return current
+            for node in monitor.nodes:
+                if monitor.roles.get(node) in ("secondary", "other"):
+                    return node
+        return None
+
+    def __topology_checked(self):
+        roles = self.__monitor.roles
+        for (node, pool) in self.__read_pools.items():
+            if roles.get(node) != "secondary":
+                pool.close(abort=True)
+                del self.__read_pools[node]
+
+        node = self.__choose_node()
+        if node != (self.__host, self.__port) and \
+                (node is not None or self.__host is not None):
+            self.__select(node)
+
+        callback = None
+        if self.__discovering:
+            self.__discovering = False
+            callback = self.__ready_callback
+            self.__ready_callback = None
+
+        if node is None:
+            # Never raised: this runs on the IOLoop, where nobody could
+            # catch it. The pool now points at no node, so requests fail
+            # with the same error until a later round finds one.
+            if callback is not None:
+                callback(AutoReconnect("could not find master/primary"))
+        elif callback is not None:
+            self.__pool.fill(functools.partial(self.__pool_filled, callback))
         else:
+            # Warm the pool up again, whether or not the node changed.
+            self.__pool.fill()
 
-            primary = self.__add_hosts_and_get_primary(response)
-            self.end_request()
-
-            if response["ismaster"]:
-                primary = True
-
-            if (primary is True) or (self.__slave_okay and primary is not None):
-                return
-            else:
-                raise AutoReconnect("could not find master/primary")
-
-
-    def __add_hosts_and_get_primary(self, response):
-        if "hosts" in response:
-            self.__nodes.update([_str_to_node(h) for h in response["hosts"]])
-        if "primary" in response:
-            return _str_to_node(response["primary"])
-        return False
+    def __select(self, node):
+        """Point the pool at `node`.
 
+        Streams to the old node are closed straight away, so requests
+        in flight on them fail fast with
+        :class:`~apymongo.errors.AutoReconnect`.
+        """
+        self.__pool.close(abort=True)
+        if node is None:
+            (self.__host, self.__port) = (None, None)
+        else:
+            (self.__host, self.__port) = node
+        self.__pool = self.__make_pool(node)
 
-    def __connect(self,callback):
-        """(Re-)connect to Mongo and return a new (connected) socket.
+    def __pool_filled(self, callback, error):
+        if error is not None:
+            callback(error)
+        else:
+            callback(self)
 
-        Connect to the master if this is a paired connection.
+    def __connect(self, node, callback):
+        """Open a new stream to `node`, passing it to `callback` once it
+        is connected.
         """
-        host, port = self.__host, self.__port
+        if node is None:
+            callback(AutoReconnect("could not find master/primary"))
+            return
+        host, port = node
 
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
             sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             stream = tornado.iostream.IOStream(sock,self.__io_loop)
         except:
-            self.disconnect()
-            raise AutoReconnect("could not connect to %r" % list(self.__nodes))
+            callback(AutoReconnect("could not connect to %s:%d" %
+                                   (host, port)))
         else:
             def scallback():
+                stream.set_close_callback(None)
                 callback(stream)
+
+            def ccallback():
+                callback(AutoReconnect("could not connect to %s:%d" %
+                                       (host, port)))
+
+            # The stream is closed without calling scallback if the
+            # connection attempt fails.
+            stream.set_close_callback(ccallback)
             try:
                 stream.connect((host,port),callback=scallback)
             except:
@@ -568,29 +1379,86 @@ class Connection(object):  # TODO support auth for pooling
 
 
 
-    def __stream(self,callback):
-        """Get a stream from the pool.
-
-        If it's been > 1 second since the last time we checked out a
-        socket, we also check to see if the socket has been closed -
-        this let's us avoid seeing *some*
-        :class:`~apymongo.errors.AutoReconnect` exceptions on server
-        hiccups, etc. We only do this if it's been > 1 second since
-        the last socket checkout, to keep performance reasonable - we
-        can't avoid those completely anyway.
+    def __make_pool(self, node):
+        if self.__pipeline:
+            max_in_flight = _PIPELINE_DEPTH
+        else:
+            max_in_flight = 1
+        return _Pool(functools.partial(self.__connect, node),
+                     self.__io_loop,
+                     min_size=self.__min_pool_size,
+                     max_size=self.__max_pool_size,
+                     max_in_flight=max_in_flight,
+                     wait_queue_timeout=self.__wait_queue_timeout,
+                     check_interval=self.__health_check_interval,
+                     max_idle_time=self.__max_idle_time,
+                     max_lifetime=self.__max_lifetime,
+                     ping=self.__ping,
+                     evictions=self.__evictions)
+
+    def __node(self):
+        if self.__host is None:
+            return None
+        return (self.__host, self.__port)
+
+    def __ping(self, strm, callback):
+        """Send an ``ismaster`` down `strm`, passing ``True`` to
+        `callback` if a good reply comes back.
         """
+        (request_id, data) = message.query(0, "admin.$cmd", 0, -1,
+                                           {"ismaster": 1})
 
-        def scallback(strm):
-            t = time.time()
-            if t - self.__last_checkout > 1 and strm._check_closed():
-                self.disconnect()
-                self.__pool.get_stream(scallback)
+        def mod_callback(response):
+            if isinstance(response, Exception):
+                callback(False)
+                return
+            try:
+                response = helpers._unpack_response(response)
+            except Exception:
+                callback(False)
             else:
-                self.__last_checkout = t
-                callback(strm)
+                callback(bool(response["data"] and
+                              response["data"][0].get("ok")))
 
-        self.__pool.get_stream(scallback)
+        self.__dispatcher(strm).send(request_id, data, mod_callback)
 
+    def __stream(self, callback, node=None):
+        """Check a stream out of the pool.
+
+        `callback` is passed the pool the stream must be returned to,
+        followed by the stream itself (or the exception raised trying to
+        get one). Streams come from the primary's pool unless `node` is
+        some other member.
+        """
+        if node is None or node == self.__node():
+            pool = self.__pool
+        else:
+            pool = self.__read_pools.get(node)
+            if pool is None:
+                pool = self.__make_pool(node)
+                self.__read_pools[node] = pool
+        pool.get_stream(functools.partial(callback, pool))
+
+    def __read_node(self, read_preference):
+        """Choose the member a read with `read_preference` goes to.
+
+        Returns ``None`` for the primary's pool, and raises
+        :class:`~apymongo.errors.AutoReconnect` if no member will do.
+        """
+        if read_preference == ReadPreference.PRIMARY:
+            return None
+        monitor = self.__monitor
+        secondaries = [node for (node, role) in monitor.roles.items()
+                       if role == "secondary"]
+        node = read_preferences.select_node(read_preference,
+                                            monitor.primary, secondaries,
+                                            monitor.rtts, self.__latency)
+        if node is None:
+            if read_preference == ReadPreference.SECONDARY:
+                raise AutoReconnect("no secondary available")
+            # Nothing is known about the members yet.
+            return self.__node()
+        return node
 
 
     def disconnect(self):
@@ -603,10 +1471,29 @@ class Connection(object):  # TODO support auth for pooling
         sequence of operations in which ordering is important. This
         could lead to unexpected results.
 
-        .. seealso:: :meth:`end_request`
         .. versionadded:: 1.3
         """
-        self.__pool = _Pool(self.__connect)
+        self.__pool.close()
+        self.__dispatchers = {}
+        self.__host = None
+        self.__port = None
+        self.__pool = self.__make_pool(None)
+        for pool in self.__read_pools.values():
+            pool.close()
+        self.__read_pools = {}
+        self.__monitor.check()
+
+    def close(self):
+        """Disconnect from MongoDB for good.
+
+        Like :meth:`disconnect`, but node monitoring stops as well, so
+        the :class:`Connection` will not re-open itself.
+        """
+        self.__monitor.close()
+        self.__pool.close()
+        for pool in self.__read_pools.values():
+            pool.close()
+        self.__read_pools = {}
         self.__host = None
         self.__port = None
 
@@ -661,10 +1548,76 @@ class Connection(object):  # TODO support auth for pooling
 
         return response
 
-    def _send_message(self, message,with_last_error=False,callback=None):
+    def __operation(self, msg):
+        """Start timing the message `msg` for the event listeners, if
+        there are any.
+        """
+        if not self.__listeners:
+            return None
+        encode_duration = self.__encode_durations.pop(msg[0], None)
+        return monitoring._Operation(self.__listeners, msg, encode_duration)
+
+    def _build_message(self, builder, *args):
+        """Build a message with `builder`, one of the functions in
+        :mod:`~apymongo.message`, passing it `args`.
+
+        If there are event listeners, how long it took is kept for the
+        operation the message is sent as.
+        """
+        if not self.__listeners:
+            return builder(*args)
+        started = time.time()
+        msg = builder(*args)
+        self.__encode_durations[msg[0]] = time.time() - started
+        return msg
+
+    def _insert_batches(self, collection_name, docs, check_keys, safe,
+                        last_error_args, continue_on_error=False):
+        """Get the messages for inserting `docs`, split to fit
+        :attr:`max_message_size` and :attr:`max_batch_count`, as for
+        :func:`~apymongo.message.insert_batches`.
+
+        If there are event listeners, each message is timed as for
+        :meth:`_build_message`. The documents are all encoded up front,
+        so each message is also charged its share of that.
+        """
+        if not self.__listeners:
+            return message.insert_batches(collection_name, docs, check_keys,
+                                          safe, last_error_args,
+                                          continue_on_error,
+                                          self.__max_message_size,
+                                          self.__max_batch_count)
+        docs = list(docs)
+        started = time.time()
+        parts = message.insert_batches(collection_name, docs, check_keys,
+                                       safe, last_error_args,
+                                       continue_on_error,
+                                       self.__max_message_size,
+                                       self.__max_batch_count)
+        per_doc = (time.time() - started) / len(docs)
+        return self.__timed_batches(parts, per_doc)
+
+    def __timed_batches(self, parts, per_doc):
+        started = time.time()
+        for (request_id, data, count) in parts:
+            self.__encode_durations[request_id] = \
+                time.time() - started + per_doc * count
+            yield (request_id, data, count)
+            started = time.time()
+
+    def __finish(self, operation, result):
+        if isinstance(result, Exception):
+            operation.failed(result)
+        else:
+            operation.succeeded()
+
+    def _send_message(self, message, with_last_error=False, callback=None,
+                      _connection_to_use=None):
         """Say something to Mongo.
 
-        Passes ConnectionFailure if callback is defined, if the message cannot be sent. Raises
+        Passes ConnectionFailure if callback is defined, if the message
+        cannot be sent (without a callback the failure is dropped, as
+        for any unacknowledged write). Passes
         OperationFailure if `with_last_error` is ``True`` and the
         response to the getLastError call returns an error. Otherwise, passes the
         response from lastError, or ``None`` if `with_last_error`
@@ -672,70 +1625,352 @@ class Connection(object):  # TODO support auth for pooling
         it MUST be a callable).
 
         :Parameters:
-          - `message`: message to send
+          - `message`: (request_id, data) pair to send
           - `with_last_error`: check getLastError status after sending the
             message
         """
+        if self.__coalesced:
+            self.__flush_inserts()
+
+        operation = self.__operation(message)
+
+        def send_callback(pool, strm):
+            if isinstance(strm, Exception):
+                if operation is not None:
+                    operation.failed(strm)
+                # Without a callback there is nobody to tell: raising
+                # here would only escape into the IOLoop.
+                if callback:
+                    callback(strm)
+                return
 
-
-        def send_callback(strm):
             (request_id, data) = message
+            if operation is not None:
+                operation.checked_out()
+
+            if with_last_error:
+                assert callback != None
+                def mod_callback(resp):
+                    pool.return_stream(strm)
+                    # Runs on the IOLoop: a bad reply has to be passed
+                    # back, or the caller would never hear of it.
+                    if not isinstance(resp,Exception):
+                        if operation is not None:
+                            operation.received(len(resp))
+                        try:
+                            resp = self.__check_response_to_last_error(resp)
+                        except Exception, e:
+                            resp = e
+                    if operation is not None:
+                        self.__finish(operation, resp)
+                    callback(resp)
+
+                self.__dispatcher(strm).send(request_id, data, mod_callback)
+                return
+
             try:
                 strm.write(data)
-            except (ConnectionFailure,socket.error),e:
+            except (IOError,socket.error),e:
+                pool.return_stream(strm)
                 self.disconnect()
-                raise AutoReconnect(str(e))
+                error = AutoReconnect(str(e))
+                if operation is not None:
+                    operation.failed(error)
+                if callback:
+                    callback(error)
             else:
-                if with_last_error:
-                    assert callback != None
-                    def mod_callback(resp):
-                        resp = self.__check_response_to_last_error(resp)
-                        callback(resp)
-
-                    self.__receive_message_on_stream(1,request_d,strm,callback=mod_callback)
-                elif callback:
+                pool.return_stream(strm)
+                if operation is not None:
+                    operation.received(0)
+                    operation.succeeded()
+                if callback:
                      callback(None)
 
 
-        self.__stream(send_callback)
+        self.__stream(send_callback, _connection_to_use)
 
 
-    def __receive_message_on_stream(self, operation, request_id, strm,callback):
-        """Receive a message in response to `request_id` on `sock`.
-
-        Passes the response data with the header removed to the callback
-        """
-
-        receive_body_curry = functools.partial(receive_body_on_stream,operation,request_id,strm,callback)
-        strm.read_bytes(16,receive_body_curry)
+    def _send_message_with_response(self, message, callback,
+                                    read_preference=None,
+                                    _connection_to_use=None,
+                                    _unpack_args=None):
+        """Send a message to Mongo and pass the response data to the
+        callback.
 
+        The stream used is returned to the pool as soon as the reply
+        has been read, before `callback` runs. If `_unpack_args` is
+        given, the reply is unpacked with :meth:`_unpack_response`
+        (passing it `_unpack_args`) before it goes to `callback`, and
+        gets a ``"wire_duration"`` entry: the seconds from writing the
+        message to its reply arriving, leaving out any wait for a
+        stream and the time taken decoding.
 
-
-    def __send_and_receive(self, message, callback,strm):
-        """Send a message on the given socket and pass the response data to the callback.
+        If a `read_preference` is given the message goes to a member
+        chosen by it, and `callback` is passed a (node, response) pair
+        so that later messages (e.g. getMores) can be sent to the same
+        member as `_connection_to_use`.
         """
+        if self.__coalesced:
+            self.__flush_inserts()
         (request_id, data) = message
+        operation = self.__operation(message)
 
-        if isinstance(strm,Exception):
-
-            callback(strm)
-
-        else:
-
-            strm.write(data)
-            self.__receive_message_on_stream(1, request_id, strm, callback)
+        node = _connection_to_use
+        if node is None and read_preference is not None:
+            try:
+                node = self.__read_node(read_preference)
+            except AutoReconnect, e:
+                if operation is not None:
+                    operation.failed(e)
+                callback(e)
+                return
+        if node is None and read_preference is not None:
+            node = self.__node()
+        tag = read_preference is not None or _connection_to_use is not None
+
+        def on_unpacked(response, wire_duration=None):
+            if operation is not None:
+                self.__finish(operation, response)
+            if not isinstance(response, Exception):
+                if wire_duration is not None:
+                    response["wire_duration"] = wire_duration
+                if tag:
+                    response = (node, response)
+            callback(response)
+
+        def send_callback(pool, strm):
+            if isinstance(strm, Exception):
+                self.__read_failed(pool, strm)
+                on_unpacked(strm)
+                return
+            if operation is not None:
+                operation.checked_out()
+
+            def mod_callback(response):
+                wire_duration = time.time() - written
+                pool.return_stream(strm)
+                if isinstance(response, Exception):
+                    self.__read_failed(pool, response)
+                    on_unpacked(response)
+                    return
+                if operation is not None:
+                    operation.received(len(response))
+                if _unpack_args is None:
+                    on_unpacked(response)
+                else:
+                    self._unpack_response(
+                        response, functools.partial(
+                            on_unpacked, wire_duration=wire_duration),
+                        *_unpack_args)
+
+            written = time.time()
+            self.__dispatcher(strm).send(request_id, data, mod_callback)
+
+        self.__stream(send_callback, node)
+
+    def __read_failed(self, pool, error):
+        """Throw away the read pool `pool` if `error` means its member
+        could not be reached, so that the next read there starts afresh.
+
+        The primary's pool is left alone: failing over from it is up to
+        the monitor (or to :meth:`disconnect`).
+        """
+        if not isinstance(error, AutoReconnect):
+            return
+        for (node, read_pool) in self.__read_pools.items():
+            if read_pool is pool:
+                del self.__read_pools[node]
+                pool.close()
+
+    def _unpack_response(self, response, callback, *args):
+        """Unpack a reply with :func:`helpers._unpack_response`, passing
+        the result, or the exception it raised, to `callback`.
+
+        `args` are passed on after `response`. Replies of at least
+        `decode_threshold` bytes are unpacked in the `decode_executor`,
+        if there is one, and `callback` then runs on the IOLoop.
+        """
+        executor = self.__decode_executor
+        if executor is None or len(response) < self.__decode_threshold:
+            try:
+                result = helpers._unpack_response(response, *args)
+            except Exception, e:
+                result = e
+            callback(result)
+            return
 
+        io_loop = self.__io_loop or tornado.ioloop.IOLoop.instance()
 
+        # May be called on one of the executor's threads, so go back to
+        # the IOLoop through add_callback, the one thread-safe method.
+        def done(future):
+            try:
+                result = future.result()
+            except Exception, e:
+                result = e
+            io_loop.add_callback(callback, result)
 
-    def _send_message_with_response(self, message, callback):
+        try:
+            future = executor.submit(helpers._unpack_response,
+                                     response, *args)
+        except Exception, e:
+            # e.g. the executor has been shut down
+            callback(e)
+            return
+        future.add_done_callback(done)
+
+
+    def _coalesce_insert(self, collection_name, docs, check_keys,
+                         callback=None):
+        """Queue an unsafe insert of `docs` to go out with any other
+        unsafe inserts to `collection_name` made during this iteration
+        of the IOLoop.
+
+        The documents are encoded straight away, so invalid ones are
+        raised here. The queue is sent as a single insert message on
+        the next iteration, or sooner if it reaches `max_batch_count`
+        documents or `max_message_size` bytes, or if any other message
+        is sent first. All queues are sent together, in the order they
+        were started. `callback` is passed
+        ``None`` once the message holding the last of `docs` has been
+        written, or the exception that stopped it.
         """
+        started = time.time()
+        encoded_docs = [bson.BSON.encode(doc, check_keys) for doc in docs]
+        if not encoded_docs:
+            raise InvalidOperation("cannot do an empty bulk insert")
+        per_doc = (time.time() - started) / len(encoded_docs)
+
+        for encoded in encoded_docs:
+            queue = self.__coalesced.get(collection_name)
+            if queue is not None and \
+                    (len(queue[0]) == self.__max_batch_count or
+                     queue[1] + len(encoded) > self.__max_message_size):
+                # Everything queued so far goes, so that the other
+                # queues are not overtaken by this one.
+                self.__flush_inserts()
+                queue = None
+            if queue is None:
+                # [encoded documents, message size, callbacks,
+                #  time spent encoding]
+                queue = [[], message._insert_overhead(collection_name),
+                         [], 0.0]
+                self.__coalesced[collection_name] = queue
+                self.__coalesced_order.append(collection_name)
+                if not self.__flush_scheduled:
+                    self.__flush_scheduled = True
+                    io_loop = self.__io_loop or \
+                        tornado.ioloop.IOLoop.instance()
+                    io_loop.add_callback(self.__flush_scheduled_inserts)
+            queue[0].append(encoded)
+            queue[1] += len(encoded)
+            queue[3] += per_doc
+
+        if callback:
+            queue[2].append(callback)
+
+    def __flush_scheduled_inserts(self):
+        self.__flush_scheduled = False
+        self.__flush_inserts()
+
+    def __flush_inserts(self):
+        """Send every queued insert, oldest queue first.
         """
-
-        send_callback = functools.partial(self.__send_and_receive,message,callback)
+        coalesced = self.__coalesced
+        order = self.__coalesced_order
+        # Swapped out first, as sending each queue would flush the rest.
+        self.__coalesced = {}
+        self.__coalesced_order = []
+        for collection_name in order:
+            self.__flush_insert(collection_name, coalesced[collection_name])
+
+    def __flush_insert(self, collection_name, queue):
+        (encoded_docs, _, callbacks, encoding) = queue
+
+        def mod_callback(result):
+            for callback in callbacks:
+                callback(result)
+
+        msg = self._build_message(message.insert_encoded, collection_name,
+                                  encoded_docs, True)
+        if msg[0] in self.__encode_durations:
+            # The documents were encoded as they were queued.
+            self.__encode_durations[msg[0]] += encoding
+        self._send_message(msg, callback=mod_callback)
+
+    def _send_batch(self, messages, callback):
+        """Send several messages down one stream without waiting for
+        any of the replies in between.
+
+        Every message in `messages` must be a (request_id, data) pair
+        whose data ends with a getLastError. Once all of the responses
+        are in they are checked as for :meth:`_send_message`, and
+        `callback` is passed a list of them in the same order as
+        `messages`. Each message is reported to the event listeners as
+        an operation of its own.
+        """
+        if not messages:
+            callback([])
+            return
+        if self.__coalesced:
+            self.__flush_inserts()
+        operations = [self.__operation(msg) for msg in messages]
+
+        def send_callback(pool, strm):
+            if isinstance(strm, Exception):
+                for operation in operations:
+                    if operation is not None:
+                        operation.failed(strm)
+                callback([strm] * len(messages))
+                return
+            for operation in operations:
+                if operation is not None:
+                    operation.checked_out()
+
+            results = [None] * len(messages)
+            pending = [len(messages)]
+
+            def mod_callback(index, resp):
+                operation = operations[index]
+                # A bad reply is that message's result: raising here
+                # would leak the stream and lose every other result.
+                if not isinstance(resp, Exception):
+                    if operation is not None:
+                        operation.received(len(resp))
+                    try:
+                        resp = self.__check_response_to_last_error(resp)
+                    except Exception, e:
+                        resp = e
+                if operation is not None:
+                    self.__finish(operation, resp)
+                results[index] = resp
+                pending[0] -= 1
+                if not pending[0]:
+                    pool.return_stream(strm)
+                    callback(results)
+
+            dispatcher = self.__dispatcher(strm)
+            for (index, (request_id, data)) in enumerate(messages):
+                dispatcher.send(request_id, data,
+                                functools.partial(mod_callback, index))
 
         self.__stream(send_callback)
 
 
+    def __dispatcher(self, strm):
+        """Get the reply dispatcher for a stream, creating it the first
+        time the stream is used.
+        """
+        try:
+            return self.__dispatchers[strm]
+        except KeyError:
+            dispatcher = _StreamDispatcher(strm, self.__drop_dispatcher)
+            self.__dispatchers[strm] = dispatcher
+            return dispatcher
+
+    def __drop_dispatcher(self, strm):
+        self.__dispatchers.pop(strm, None)
+
 
     def start_request(self):
         """DEPRECATED all operations will start a request.
@@ -747,25 +1982,11 @@ class Connection(object):  # TODO support auth for pooling
                       DeprecationWarning)
 
     def end_request(self):
-        """Allow this thread's connection to return to the pool.
-
-        Calling :meth:`end_request` allows the :class:`~socket.socket`
-        that has been reserved for this thread to be returned to the
-        pool. Other threads will then be able to re-use that
-        :class:`~socket.socket`. If your application uses many
-        threads, or has long-running threads that infrequently perform
-        MongoDB operations, then judicious use of this method can lead
-        to performance gains. Care should be taken, however, to make
-        sure that :meth:`end_request` is not called in the middle of a
-        sequence of operations in which ordering is important. This
-        could lead to unexpected results.
-
-        One important case is when a thread is dying permanently. It
-        is best to call :meth:`end_request` when you know a thread is
-        finished, as otherwise its :class:`~socket.socket` will not be
-        reclaimed.
+        """DEPRECATED streams are returned to the pool as soon as the
+        reply to the request they carried has been read.
         """
-        self.__pool.return_stream()
+        warnings.warn("the Connection.end_request method is deprecated",
+                      DeprecationWarning)
 
     def __cmp__(self, other):
         if isinstance(other, Connection):
@@ -801,12 +2022,14 @@ class Connection(object):  # TODO support auth for pooling
         """
         return self.__getattr__(name)
 
-    def close_cursor(self, cursor_id):
+    def close_cursor(self, cursor_id, _conn_id=None):
         """Close a single database cursor.
 
         Raises :class:`TypeError` if `cursor_id` is not an instance of
         ``(int, long)``. What closing the cursor actually means
-        depends on this connection's cursor manager.
+        depends on this connection's cursor manager, unless the cursor
+        lives on a member other than the primary, in which case it is
+        killed there straight away.
 
         :Parameters:
           - `cursor_id`: id of cursor to close
@@ -817,7 +2040,12 @@ class Connection(object):  # TODO support auth for pooling
         if not isinstance(cursor_id, (int, long)):
             raise TypeError("cursor_id must be an instance of (int, long)")
 
-        self.__cursor_manager.close(cursor_id)
+        if _conn_id is not None and _conn_id != self.__node():
+            self._send_message(self._build_message(message.kill_cursors,
+                                                   [cursor_id]),
+                               _connection_to_use=_conn_id)
+        else:
+            self.__cursor_manager.close(cursor_id)
 
     def kill_cursors(self, cursor_ids):
         """Send a kill cursors message with the given ids.
@@ -830,7 +2058,8 @@ class Connection(object):  # TODO support auth for pooling
         """
         if not isinstance(cursor_ids, list):
             raise TypeError("cursor_ids must be a list")
-        self._send_message(message.kill_cursors(cursor_ids))
+        self._send_message(self._build_message(message.kill_cursors,
+                                               cursor_ids))
 
     def server_info(self,callback):
         """Get information about the MongoDB server we're connected to.
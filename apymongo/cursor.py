@@ -14,15 +14,25 @@
 
 """Cursor class to iterate over Mongo query results."""
 
+import datetime
 import functools
+import time
 
 from bson.code import Code
 from bson.son import SON
-from apymongo import (helpers,
-                     message)
+from apymongo import (arrays,
+                     helpers,
+                     message,
+                     read_preferences)
+from apymongo.read_preferences import ReadPreference
 from apymongo.errors import (InvalidOperation,
+                            OperationFailure,
                             AutoReconnect)
 
+# How much each reply counts towards the average document size used by
+# adaptive batch sizing.
+_DOC_BYTES_WEIGHT = 0.5
+
 _QUERY_OPTIONS = {
     "tailable_cursor": 2,
     "slave_okay": 4,
@@ -44,6 +54,27 @@ class Cursor(object):
           (kicked off via, e.g. the loop method) is done.
           - `processor`:  online processor callable to be called on each record
           during the process of reading. 
+          - `read_preference` (optional): the
+          :class:`~apymongo.read_preferences.ReadPreference` choosing which
+          member to read from (default is the connection's
+          :attr:`~apymongo.connection.Connection.read_preference`).
+          - `prefetch` (optional): how many batches to fetch ahead of
+          the one being processed, so that the server produces the next
+          batches while this one is decoded and processed. Servers only
+          run one getMore on a cursor at a time, so the getMores still go
+          out one after another: the next is sent as soon as a reply
+          arrives, until `prefetch` batches are waiting to be used.
+          Ignored for cursors with a limit and tailable cursors.
+          - `raw` (optional): if ``True``, documents are not decoded at
+          all. Each reply is split into the BSON byte strings of its
+          documents using only their length prefixes, and those are what
+          `processor` and the callback get. Manipulators are skipped.
+          Useful for relaying results elsewhere untouched.
+          - `decode_fields` (optional): a list of (possibly dotted) key
+          names, or a dict like `fields`. The server still sends whole
+          documents, but only these keys are decoded; everything else is
+          skipped over by its length. Cheap client-side projection for
+          wide documents when `fields` can't be used.
           
           All other parameters are as in PyMongo.
     """
@@ -62,6 +93,10 @@ class Cursor(object):
                  max_scan=None, 
                  as_class=None,
                  store = True,
+                 read_preference=None,
+                 prefetch=0,
+                 raw=False,
+                 decode_fields=None,
                  _must_use_master=False, 
                  _is_command=False,
                  **kwargs):
@@ -79,7 +114,8 @@ class Cursor(object):
         if spec is None:
             spec = {}
 
-        if not isinstance(spec, dict):
+        if not isinstance(spec, dict) and \
+                not getattr(type(spec), "_raw_document", False):
             raise TypeError("spec must be an instance of dict")
         if not isinstance(skip, int):
             raise TypeError("skip must be an instance of int")
@@ -91,6 +127,16 @@ class Cursor(object):
             raise TypeError("snapshot must be an instance of bool")
         if not isinstance(tailable, bool):
             raise TypeError("tailable must be an instance of bool")
+        if not isinstance(prefetch, int):
+            raise TypeError("prefetch must be an instance of int")
+        if prefetch < 0:
+            raise ValueError("prefetch must be >= 0")
+        if not isinstance(raw, bool):
+            raise TypeError("raw must be an instance of bool")
+        if decode_fields is not None and \
+                not isinstance(decode_fields, (list, tuple, dict)):
+            raise TypeError("decode_fields must be an instance of list, "
+                            "tuple or dict")
 
         if fields is not None:
             if not fields:
@@ -101,6 +147,13 @@ class Cursor(object):
         if as_class is None:
             as_class = collection.database.connection.document_class
 
+        if _must_use_master:
+            read_preference = ReadPreference.PRIMARY
+        elif read_preference is None:
+            read_preference = collection.database.connection.read_preference
+        elif read_preference not in read_preferences.MODES:
+            raise ValueError("unknown read preference %r" % (read_preference,))
+
         self.__collection = collection
         self.__callback = callback
         self.__processor = processor
@@ -109,6 +162,8 @@ class Cursor(object):
         self.__skip = skip
         self.__limit = limit
         self.__batch_size = 0
+        self.__adaptive = None
+        self.__doc_bytes = None
         self.__store = store
 
         self.__empty = False
@@ -121,16 +176,24 @@ class Cursor(object):
         self.__explain = False
         self.__hint = None
         self.__as_class = as_class
+        self.__raw = raw
+        self.__decode_fields = decode_fields
         self.__tz_aware = collection.database.connection.tz_aware
         self.__must_use_master = _must_use_master
+        self.__read_preference = read_preference
         self.__is_command = _is_command
 
         self.__data = []
         self.__datastore = []
         self.__connection_id = None
         self.__retrieved = 0
+        self.__batches = 0
         self.__killed = False
 
+        self.__prefetch = prefetch
+        self.__generation = 0
+        self.__reset_prefetch()
+
         # this is for passing network_timeout through if it's specified
         # need to use kwargs as None is a legit value for network_timeout
         self.__kwargs = kwargs
@@ -148,6 +211,15 @@ class Cursor(object):
         if self.__id and not self.__killed:
             self.__die()
 
+    def close(self):
+        """Explicitly close / kill this cursor.
+
+        Prefetched batches not yet used are dropped, and the reply to a
+        getMore still in flight is ignored when it arrives.
+        """
+        self.__ready = []
+        self.__die()
+
     def rewind(self):
         """Rewind this cursor to it's unevaluated state.
 
@@ -161,10 +233,23 @@ class Cursor(object):
         self.__id = None
         self.__connection_id = None
         self.__retrieved = 0
+        self.__batches = 0
         self.__killed = False
+        self.__reset_prefetch()
 
         return self
 
+    def __reset_prefetch(self):
+        # Prefetched batches waiting to be used, oldest first. At most
+        # one getMore is in flight. The generation is bumped on rewind
+        # so that a reply still in flight from before is ignored.
+        self.__ready = []
+        self.__in_flight = False
+        self.__exhausted = False
+        self.__prefetch_error = None
+        self.__waiting = None
+        self.__generation += 1
+
     def clone(self):
         """Get a clone of this cursor.
 
@@ -180,6 +265,11 @@ class Cursor(object):
         copy.__explain = self.__explain
         copy.__hint = self.__hint
         copy.__batch_size = self.__batch_size
+        copy.__adaptive = self.__adaptive
+        copy.__read_preference = self.__read_preference
+        copy.__prefetch = self.__prefetch
+        copy.__raw = self.__raw
+        copy.__decode_fields = self.__decode_fields
         return copy
 
     def __die(self):
@@ -199,6 +289,11 @@ class Cursor(object):
         spec = self.__spec
         if not self.__is_command and "$query" not in self.__spec:
             spec = SON({"$query": self.__spec})
+        elif self.__ordering or self.__explain or self.__hint or \
+                self.__snapshot or self.__max_scan:
+            # Add to a copy: the caller's spec must not change, and may
+            # not even be writable (like a bound QueryTemplate).
+            spec = SON(spec)
         if self.__ordering:
             spec["$orderby"] = self.__ordering
         if self.__explain:
@@ -217,7 +312,8 @@ class Cursor(object):
         options = 0
         if self.__tailable:
             options |= _QUERY_OPTIONS["tailable_cursor"]
-        if self.__collection.database.connection.slave_okay:
+        if self.__collection.database.connection.slave_okay or \
+                self.__read_preference != ReadPreference.PRIMARY:
             options |= _QUERY_OPTIONS["slave_okay"]
         if not self.__timeout:
             options |= _QUERY_OPTIONS["no_timeout"]
@@ -272,6 +368,41 @@ class Cursor(object):
         self.__check_okay_to_chain()
 
         self.__batch_size = batch_size == 1 and 2 or batch_size
+        self.__adaptive = None
+        return self
+
+    def adaptive_batch_size(self, target_bytes=1024 * 1024,
+                            max_latency=0.1):
+        """Size each getMore to fit the documents this cursor returns.
+
+        After every reply the cursor updates a moving average of the
+        bytes per document, and asks for as many documents next time as
+        should make up about `target_bytes`. If a batch took longer
+        than `max_latency` seconds to come back (from the getMore being
+        written to the reply arriving - waiting for a stream and
+        decoding are not counted), the next one is shrunk in
+        proportion. Batches at most double from one to the next.
+        Scans of small documents then take few round-trips, and scans of
+        huge documents do not hold up the IOLoop.
+
+        Raises :class:`ValueError` if `target_bytes` or `max_latency`
+        is not positive. Raises
+        :class:`~pymongo.errors.InvalidOperation` if this
+        :class:`Cursor` has already been used. Overrides
+        :meth:`batch_size`, and vice versa.
+
+        :Parameters:
+          - `target_bytes` (optional): how big each batch should be
+          - `max_latency` (optional): how long (in seconds) a batch
+            may take to arrive
+        """
+        if target_bytes <= 0 or max_latency <= 0:
+            raise ValueError("target_bytes and max_latency must be "
+                             "positive")
+        self.__check_okay_to_chain()
+
+        self.__adaptive = (target_bytes, max_latency)
+        self.__batch_size = 0
         return self
 
     def skip(self, skip):
@@ -515,25 +646,10 @@ class Cursor(object):
             self.__callback(self.__error)
             
         else:
-            if len(self.__data):
-                
-                collection = self.__collection
-                db = collection.database
-                processor = self.__processor
-                
-                for r in self.__data:
-    
-                    r = db._fix_outgoing(r, collection)
-                   
-                    if processor:
-                        r = processor(r,collection)
-                        
-                    if self.__store and r:
-                        self.__datastore.append(r)
-                        
-                
-                self.__data = []
-                    
+            if self.__store:
+                self.__datastore.extend([r for r in self.__process() if r])
+            else:
+                self.__process()
                     
             if not self.__killed:
                 self._refresh()
@@ -541,23 +657,143 @@ class Cursor(object):
             else:
                 
                 self.__callback(self.__datastore)
-        
-        
 
-    def _refresh(self):
-        """Refreshes the cursor with more data from Mongo.
+    def each_batch(self, callback):
+        """Stream the results of this cursor one batch at a time.
+
+        Instead of collecting every document and calling the cursor's
+        callback once at the end, `callback` is called as
+        ``callback(batch, more)`` for each reply from the server, where
+        `batch` is the list of documents it held (after manipulators and
+        `processor` have been applied - documents `processor` returns
+        ``None`` for are left out). The next batch is not requested
+        until the consumer calls ``more()``, so a result set of any size
+        can be worked through in constant memory.
+
+        Once the cursor is exhausted `callback` is passed ``None`` as the
+        batch. If anything goes wrong it is passed the exception instead.
+        Either way `more` is ``None`` then.
 
+        :Parameters:
+          - `callback`: called with each batch, as above
         """
+        def on_batch():
+            if self.__error:
+                callback(self.__error, None)
+                return
+            batch = [r for r in self.__process() if r is not None]
+            if batch or not self.__killed:
+                callback(batch, more)
+            else:
+                callback(None, None)
+
+        def more():
+            if self.__killed:
+                callback(None, None)
+            else:
+                self._refresh(on_batch)
+
+        more()
+
+    def to_arrays(self, schema, callback=None):
+        """Decode the results of this cursor into NumPy arrays, one
+        per field.
+
+        `schema` maps field names (dotted to reach into embedded
+        documents) to NumPy dtypes. Numeric, bool and ``datetime64``
+        dtypes are supported, as is ``"V12"`` for the raw bytes of
+        ObjectIds. Each batch
+        is decoded straight into the arrays without building a
+        document for any result; only the elements named in `schema`
+        are read at all. Manipulators and `processor` are not applied.
+
+        Once the cursor is exhausted `callback` (the cursor's callback
+        by default) is passed a dict of field names to
+        :class:`numpy.ma.MaskedArray` instances with one entry per
+        result. Where a result has no value for a field, or the value
+        is of the wrong type, the entry is masked. If anything goes
+        wrong the callback is passed the exception instead.
+
+        If the cursor has no `fields` of its own, only the fields in
+        `schema` are asked for.
+
+        Raises :class:`~apymongo.errors.ConfigurationError` if NumPy is
+        not installed.
+
+        :Parameters:
+          - `schema`: dict of field names to dtypes
+          - `callback` (optional): called with the arrays, as above
+        """
+        self.__check_okay_to_chain()
+        if callback is None:
+            assert self.__callback is not None, "callback must not be none"
+            callback = self.__callback
+
+        builder = arrays.ColumnBuilder(schema)
+        self.__raw = True
+        if self.__fields is None:
+            self.__fields = dict([(path, 1) for path in schema])
+
+        def on_batch():
+            if self.__error:
+                callback(self.__error)
+                return
+            try:
+                builder.add(self.__data)
+            except Exception, e:
+                self.__die()
+                callback(e)
+                return
+            self.__data = []
+            if self.__killed:
+                callback(builder.finish())
+            else:
+                self._refresh(on_batch)
+
+        self._refresh(on_batch)
 
-        callback = self.loop
+    def __process(self):
+        """Apply manipulators and the processor to the current batch,
+        returning the results and emptying the batch.
+        """
+        collection = self.__collection
+        db = collection.database
+        processor = self.__processor
+
+        results = []
+        for r in self.__data:
+            if not self.__raw:
+                r = db._fix_outgoing(r, collection)
+            if processor:
+                r = processor(r, collection)
+            results.append(r)
+
+        self.__data = []
+        return results
         
+
+    def _refresh(self, callback=None):
+        """Refreshes the cursor with more data from Mongo, calling
+        `callback` (:meth:`loop` by default) once it has arrived.
+        """
+
+        if callback is None:
+            callback = self.loop
+        connection = self.__collection.database.connection
         
         if self.__id is None: 
             self.__send_message(
-                message.query(self.__query_options(),
-                              self.__collection.full_name,
-                              self.__skip, self.__limit,
-                              self.__query_spec(), self.__fields),callback)
+                connection._build_message(message.query,
+                                          self.__query_options(),
+                                          self.__collection.full_name,
+                                          self.__skip, self.__limit,
+                                          self.__query_spec(),
+                                          self.__fields), callback)
+
+        elif self.__id and self.__can_prefetch():
+            self.__waiting = callback
+            self.__top_up()
+            self.__deliver()
 
         elif self.__id:  # Get More
             if self.__limit:
@@ -568,8 +804,9 @@ class Cursor(object):
                 limit = self.__batch_size
 
             self.__send_message(
-                message.get_more(self.__collection.full_name,
-                                 limit, self.__id),callback)
+                connection._build_message(message.get_more,
+                                          self.__collection.full_name,
+                                          limit, self.__id), callback)
 
 
 
@@ -577,47 +814,187 @@ class Cursor(object):
         """Send a query or getmore message and handles the response.
         """
         db = self.__collection.database
+        started = time.time()
 
         def mod_callback(response):
-            
-            if isinstance(response,Exception):
+            self.__check_reconnect(response)
+            response = self.__unpacked(response, started)
+            if isinstance(response, Exception):
                 self.__error = response
-                      
             else:
-                if isinstance(response, tuple):
-                    (connection_id, response) = response
-                else:
-                    connection_id = None
-        
-                self.__connection_id = connection_id
-        
-                try:
-                    response = helpers._unpack_response(response, self.__id,
-                                                        self.__as_class,
-                                                        self.__tz_aware)
-                except AutoReconnect:
-                    db.connection.disconnect()
-                    raise
-                    
-                self.__id = response["cursor_id"]
-                 
-                # starting from doesn't get set on getmore's for tailable cursors
-                if not self.__tailable:                    
-                    assert response["starting_from"] == self.__retrieved
-        
-                self.__retrieved += response["number_returned"]
-                self.__data = response["data"]
-        
-                die_now = (self.__id == 0) or (len(self.__data) == 0) or (self.__limit and self.__id and self.__limit <= self.__retrieved)
-        
-                if die_now:
-                    self.__die()
-                                
-                
+                self.__apply(response)
+                if self.__can_prefetch():
+                    self.__top_up()
             callback()
-    
 
-        db.connection._send_message_with_response(message,mod_callback)
+        db.connection._send_message_with_response(
+            message, mod_callback, read_preference=self.__read_preference,
+            _connection_to_use=self.__connection_id,
+            _unpack_args=self.__unpack_args())
+
+    def __unpack_args(self):
+        """How the connection should unpack replies to this cursor.
+
+        Large replies may be decoded off the IOLoop; see the
+        `decode_executor` parameter to
+        :class:`~apymongo.connection.Connection`.
+        """
+        return (self.__id, self.__as_class, self.__tz_aware, self.__raw,
+                self.__decode_fields)
+
+    def __check_reconnect(self, response):
+        """Drop the connection's streams if `response` says the primary
+        could not be reached.
+
+        Only the primary is reset: the pool to any other member has
+        been dropped by the connection already, and no member may have
+        been chosen at all.
+        """
+        if isinstance(response, AutoReconnect) and \
+                self.__read_preference == ReadPreference.PRIMARY:
+            self.__collection.database.connection.disconnect()
+
+    def __unpacked(self, response, started):
+        """Take an unpacked reply to a message sent at `started`,
+        noting which member it came from, and return it (or the error it
+        held).
+        """
+        if isinstance(response, Exception):
+            return response
+        if isinstance(response, tuple):
+            (self.__connection_id, response) = response
+        else:
+            self.__connection_id = None
+
+        elapsed = time.time() - started
+        self.__batches += 1
+        if self.__adaptive and response["number_returned"]:
+            self.__adapt(response["length"], response["number_returned"],
+                         response["wire_duration"])
+        connection = self.__collection.database.connection
+        if connection._is_slow(elapsed):
+            connection._log_slow_operation(self.__describe(response, elapsed))
+        return response
+
+    def __describe(self, response, elapsed):
+        """Describe the message a slow reply answered, for the
+        connection's slow operation log.
+        """
+        spec = self.__spec
+        if self.__is_command:
+            operation = "command"
+        else:
+            operation = self.__id and "getmore" or "query"
+            if "$query" in spec:
+                spec = spec["$query"]
+        return {"ts": datetime.datetime.utcnow(),
+                "op": operation,
+                "ns": self.__collection.full_name,
+                "millis": elapsed * 1000,
+                "query": helpers._query_shape(spec),
+                "orderby": self.__ordering,
+                "hint": self.__hint,
+                "nreturned": response["number_returned"],
+                "batches": self.__batches}
+
+    def __adapt(self, size, number_returned, elapsed):
+        """Pick the size of the next getMore from the last reply, which
+        took `elapsed` seconds to arrive once its message was written.
+        """
+        (target_bytes, max_latency) = self.__adaptive
+
+        doc_bytes = float(size) / number_returned
+        if self.__doc_bytes is not None:
+            doc_bytes = ((1 - _DOC_BYTES_WEIGHT) * self.__doc_bytes +
+                         _DOC_BYTES_WEIGHT * doc_bytes)
+        self.__doc_bytes = doc_bytes
+
+        batch_size = min(target_bytes / doc_bytes, 2 * number_returned)
+        if elapsed > max_latency:
+            batch_size = min(batch_size,
+                             number_returned * max_latency / elapsed)
+        # A batch size of 1 would close the cursor.
+        self.__batch_size = max(2, int(batch_size))
+
+    def __apply(self, response):
+        """Make an unpacked reply the current batch.
+        """
+        self.__id = response["cursor_id"]
+
+        # starting from doesn't get set on getmore's for tailable cursors
+        if not self.__tailable:
+            assert response["starting_from"] == self.__retrieved
+
+        self.__retrieved += response["number_returned"]
+        self.__data = response["data"]
+
+        die_now = (self.__id == 0) or (len(self.__data) == 0) or (self.__limit and self.__id and self.__limit <= self.__retrieved)
+
+        if die_now:
+            self.__die()
+
+    def __can_prefetch(self):
+        return self.__prefetch and not self.__limit and not self.__tailable
+
+    def __top_up(self):
+        """Send the next getMore, unless one is already in flight or
+        `prefetch` batches are already waiting to be used.
+        """
+        connection = self.__collection.database.connection
+        if self.__id and not self.__killed and not self.__exhausted and \
+                not self.__in_flight and self.__prefetch_error is None and \
+                len(self.__ready) < self.__prefetch:
+            self.__in_flight = True
+            connection._send_message_with_response(
+                connection._build_message(message.get_more,
+                                          self.__collection.full_name,
+                                          self.__batch_size, self.__id),
+                functools.partial(self.__on_prefetched, self.__generation,
+                                  time.time()),
+                read_preference=self.__read_preference,
+                _connection_to_use=self.__connection_id,
+                _unpack_args=self.__unpack_args())
+
+    def __on_prefetched(self, generation, started, response):
+        # Even for a getMore nobody wants any more.
+        self.__check_reconnect(response)
+        if generation != self.__generation:
+            return
+        self.__in_flight = False
+        if self.__killed:
+            return
+
+        response = self.__unpacked(response, started)
+
+        if isinstance(response, Exception):
+            # Passed on once the batches before it have been used.
+            self.__prefetch_error = response
+        else:
+            if not response["cursor_id"]:
+                self.__exhausted = True
+            self.__ready.append(response)
+            self.__top_up()
+
+        self.__deliver()
+
+    def __deliver(self):
+        """Pass the next batch to whoever is waiting for it, once it is
+        here.
+        """
+        callback = self.__waiting
+        if callback is None:
+            return
+
+        if self.__ready:
+            self.__waiting = None
+            self.__apply(self.__ready.pop(0))
+            self.__top_up()
+            callback()
+        elif not self.__in_flight:
+            self.__waiting = None
+            self.__error = self.__prefetch_error or \
+                OperationFailure("prefetched batch went missing")
+            callback()
 
 
 
@@ -397,6 +397,9 @@ class Database(object):
     def profiling_info(self,callback):
         """Passes to callback a list containing current profiling information.
 
+        .. seealso:: :meth:`~apymongo.connection.Connection.slow_operations`
+           for slow operations as seen by the client, without polling
+
         .. mongodoc:: profiling
         """
         
@@ -23,6 +23,8 @@ except:  # for Python < 2.5
 import struct
 
 import bson
+from bson.errors import InvalidBSON
+from bson.objectid import ObjectId
 from bson.son import SON
 import pymongo
 import apymongo
@@ -31,6 +33,11 @@ from apymongo.errors import (AutoReconnect,
                             TimeoutError)
 
 
+# responseFlags, cursorID, startingFrom, numberReturned
+_REPLY_HEADER = struct.Struct("<iqii")
+_INT = struct.Struct("<i")
+
+
 def _index_list(key_or_list, direction=None):
     """Helper to generate a list of (key, direction) pairs.
 
@@ -73,7 +80,74 @@ def _index_document(index_list):
     return index
 
 
-def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
+def _split_points(low, high, count):
+    """Pick up to `count` - 1 values strictly between `low` and `high`
+    that split the range between them into `count` roughly even parts,
+    in ascending order.
+
+    ObjectIds are split into even spans of generation time. Numbers
+    are split evenly. For anything else there are no split points.
+    """
+    if isinstance(low, ObjectId) and isinstance(high, ObjectId):
+        start = low.generation_time
+        step = (high.generation_time - start) / count
+        points = [ObjectId.from_datetime(start + step * i)
+                  for i in range(1, count)]
+    elif isinstance(low, (int, long, float)) and \
+            isinstance(high, (int, long, float)) and \
+            not isinstance(low, bool) and not isinstance(high, bool):
+        step = (high - low) / float(count)
+        points = [low + step * i for i in range(1, count)]
+    else:
+        return []
+
+    result = []
+    for point in points:
+        if low < point < high and (not result or result[-1] < point):
+            result.append(point)
+    return result
+
+
+def _split_documents(data, offset=0):
+    """Split concatenated BSON documents into a list of byte strings,
+    reading only their length prefixes.
+    """
+    docs = []
+    end = len(data)
+    while offset < end:
+        if end - offset < 5:
+            raise InvalidBSON("not enough data for a BSON document")
+        obj_size = _INT.unpack_from(data, offset)[0]
+        if obj_size < 5 or end - offset < obj_size:
+            raise InvalidBSON("invalid object size")
+        docs.append(data[offset:offset + obj_size])
+        offset += obj_size
+    return docs
+
+
+def _query_shape(value):
+    """Replace the values in a query document with placeholders
+    naming their types, so that queries differing only in their values
+    have the same shape.
+
+    Lists become the distinct shapes of their items, so an ``$in`` of
+    ten ints has the same shape as an ``$in`` of two.
+    """
+    if isinstance(value, dict) or getattr(value, "_raw_document", False):
+        return SON([(key, _query_shape(item))
+                    for (key, item) in value.iteritems()])
+    if isinstance(value, (list, tuple)):
+        shapes = []
+        for item in value:
+            shape = _query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "<%s>" % (type(value).__name__,)
+
+
+def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False,
+                     raw=False, fields=None):
     """Unpack a response from the database.
 
     Check the response for errors and unpack, returning a dictionary
@@ -85,8 +159,16 @@ def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
         used for raising an informative exception when we get cursor id not
         valid at server response
       - `as_class` (optional): class to use for resulting documents
+      - `raw` (optional): leave the documents as BSON byte strings
+        instead of decoding them
+      - `fields` (optional): only decode these keys of each document
+        (see :func:`bson.decode_all`)
     """
-    response_flag = struct.unpack("<i", response[:4])[0]
+    # The reply header and documents are read straight out of
+    # `response` by offset - slicing off the documents would copy what
+    # may be several megabytes of getMore data before decoding it.
+    (response_flag, cursor, starting_from,
+     number_returned) = _REPLY_HEADER.unpack_from(response)
     if response_flag & 1:
         # Shouldn't get this response if we aren't doing a getMore
         assert cursor_id is not None
@@ -94,17 +176,23 @@ def _unpack_response(response, cursor_id=None, as_class=dict, tz_aware=False):
         raise OperationFailure("cursor id '%s' not valid at server" %
                                cursor_id)
     elif response_flag & 2:
-        error_object = bson.BSON(response[20:]).decode()
+        error_object = bson.decode_all(response, dict, True,
+                                      _REPLY_HEADER.size)[0]
         if error_object["$err"] == "not master":
             raise AutoReconnect("master has changed")
         raise OperationFailure("database error: %s" %
                                error_object["$err"])
 
     result = {}
-    result["cursor_id"] = struct.unpack("<q", response[4:12])[0]
-    result["starting_from"] = struct.unpack("<i", response[12:16])[0]
-    result["number_returned"] = struct.unpack("<i", response[16:20])[0]
-    result["data"] = bson.decode_all(response[20:], as_class, tz_aware)
+    result["cursor_id"] = cursor
+    result["starting_from"] = starting_from
+    result["number_returned"] = number_returned
+    result["length"] = len(response)
+    if raw:
+        result["data"] = _split_documents(response, _REPLY_HEADER.size)
+    else:
+        result["data"] = bson.decode_all(response, as_class, tz_aware,
+                                         _REPLY_HEADER.size, fields)
     assert len(result["data"]) == result["number_returned"]
     return result
 
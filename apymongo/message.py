@@ -22,10 +22,12 @@ MongoDB.
 .. versionadded:: 1.1.2
 """
 
+import collections
 import random
 import struct
 
 import bson
+from bson.objectid import ObjectId
 from bson.son import SON
 try:
     from apymongo import _cbson
@@ -37,47 +39,293 @@ from apymongo.errors import InvalidOperation
 
 __ZERO = "\x00\x00\x00\x00"
 
+# messageLength, requestID, responseTo, opCode
+_HEADER = struct.Struct("<iiii")
+_INT = struct.Struct("<i")
+_DOUBLE = struct.Struct("<d")
 
-def __last_error(args):
-    """Data to send to do a lastError.
+# Default limits for one insert message when splitting a bulk insert.
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+MAX_BATCH_COUNT = 1000
+
+# How many encoded commands and getLastErrors to keep.
+MAX_CACHED_MESSAGES = 256
+
+
+class _MessageBuilder(object):
+    """Builds wire protocol messages in a single growable buffer.
+
+    Each message starts with a header holding a placeholder length.
+    The body is appended piece by piece, and the real length is
+    patched into the header once the message is finished. Messages
+    that follow (e.g. the getLastError after a safe write) go on the
+    end of the same buffer, so building is linear in the total size
+    and nothing is concatenated along the way.
     """
-    cmd = SON([("getlasterror", 1)])
-    cmd.update(args)
-    return query(0, "admin.$cmd", 0, -1, cmd)
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.__start = None
+
+    def start(self, operation):
+        """Begin a new message for `operation`, returning its request id.
+        """
+        request_id = random.randint(-2 ** 31 - 1, 2 ** 31)
+        self.__start = len(self.buffer)
+        self.buffer.extend(_HEADER.pack(0, request_id, 0, operation))
+        return request_id
+
+    def write(self, data):
+        self.buffer.extend(data)
+
+    def finish(self):
+        """Patch the length of the current message into its header.
+        """
+        _INT.pack_into(self.buffer, self.__start,
+                       len(self.buffer) - self.__start)
+        self.__start = None
+
+    def getvalue(self):
+        return str(self.buffer)
 
 
-def __pack_message(operation, data):
-    """Takes message data and adds a message header based on the operation.
+class _MessageCache(object):
+    """A least recently used cache of message bodies (everything after
+    the header), keyed by what the message was built from.
 
-    Returns the resultant message string.
+    Each use of an entry stamps it and queues the stamp, so the oldest
+    stamp still current is always the entry to evict. Stale stamps are
+    skipped as they come up, and the queue is rebuilt if they pile up.
     """
+
+    def __init__(self, size):
+        self.__size = size
+        # key -> (body, stamp)
+        self.__entries = {}
+        # (stamp, key) in the order they were used
+        self.__order = collections.deque()
+        self.__stamp = 0
+
+    def get(self, key):
+        entry = self.__entries.get(key)
+        if entry is None:
+            return None
+        self.__use(key, entry[0])
+        return entry[0]
+
+    def put(self, key, body):
+        if key not in self.__entries and len(self.__entries) >= self.__size:
+            self.__evict()
+        self.__use(key, body)
+
+    def __use(self, key, body):
+        self.__stamp += 1
+        self.__entries[key] = (body, self.__stamp)
+        self.__order.append((self.__stamp, key))
+        if len(self.__order) > 2 * self.__size:
+            order = [(stamp, key) for (key, (_, stamp))
+                     in self.__entries.iteritems()]
+            order.sort()
+            self.__order = collections.deque(order)
+
+    def __evict(self):
+        while True:
+            (stamp, key) = self.__order.popleft()
+            entry = self.__entries.get(key)
+            if entry is not None and entry[1] == stamp:
+                del self.__entries[key]
+                return
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+_commands = _MessageCache(MAX_CACHED_MESSAGES)
+
+
+# Types whose values are immutable and encode the same whenever they
+# compare equal. Floats aren't among them (0.0 == -0.0), so they are
+# keyed on their encoding instead.
+_FREEZABLE_TYPES = frozenset([str, unicode, int, long, bool,
+                              type(None), ObjectId])
+
+
+def _freeze(value):
+    """Turn a document into a hashable key for :class:`_MessageCache`.
+
+    Raises :class:`TypeError` for documents holding values that can't
+    safely be cached on.
+    """
+    value_type = type(value)
+    if value_type in _FREEZABLE_TYPES:
+        return (value_type, value)
+    if value_type is float:
+        return (float, _DOUBLE.pack(value))
+    if isinstance(value, dict):
+        return (dict, tuple([(key, _freeze(item))
+                             for (key, item) in value.iteritems()]))
+    if value_type in (list, tuple):
+        return (list, tuple([_freeze(item) for item in value]))
+    raise TypeError("can't cache a message holding %r" % value_type)
+
+
+def __cache_key(*parts):
+    """Get the :class:`_MessageCache` key for a message built from
+    `parts` (documents and plain values), or ``None`` if it can't be
+    cached.
+    """
+    try:
+        return tuple([_freeze(part) for part in parts])
+    except TypeError:
+        return None
+
+
+def __reuse(builder, key):
+    """Add the cached message for `key` to `builder`, returning its
+    request id, or ``None`` if there isn't one.
+    """
+    if key is None:
+        return None
+    body = _commands.get(key)
+    if body is None:
+        return None
+    request_id = builder.start(2004)
+    builder.write(body)
+    builder.finish()
+    return request_id
+
+
+def __remember(builder, key, start):
+    """Cache the body of the message `builder` holds from `start` on.
+    """
+    if key is not None:
+        _commands.put(key, str(builder.buffer[start + _HEADER.size:]))
+
+
+def __last_error(builder, args):
+    """Add a lastError to `builder`, returning its request id.
+    """
+    key = __cache_key("getlasterror", args)
+    request_id = __reuse(builder, key)
+    if request_id is None:
+        start = len(builder.buffer)
+        cmd = SON([("getlasterror", 1)])
+        cmd.update(args)
+        request_id = __query(builder, 0, "admin.$cmd", 0, -1, cmd)
+        __remember(builder, key, start)
+    return request_id
+
+
+def __insert_flags(continue_on_error):
+    if continue_on_error:
+        return _INT.pack(1)
+    return __ZERO
+
+
+def __insert_message(collection_name, encoded_docs, continue_on_error,
+                     safe, last_error_args):
+    """Get an **insert** message holding `encoded_docs`, followed by a
+    getLastError if `safe` is ``True``.
+
+    An insert is almost all document data that has already been
+    encoded, so unlike other messages it isn't put together with a
+    :class:`_MessageBuilder` - joining the pieces once is cheaper than
+    copying each document into the buffer.
+    """
+    name = bson._make_c_string(collection_name)
     request_id = random.randint(-2 ** 31 - 1, 2 ** 31)
-    message = struct.pack("<i", 16 + len(data))
-    message += struct.pack("<i", request_id)
-    message += __ZERO  # responseTo
-    message += struct.pack("<i", operation)
-    return (request_id, message + data)
+    length = _HEADER.size + 4 + len(name) + sum(map(len, encoded_docs))
+    parts = [_HEADER.pack(length, request_id, 0, 2002),
+             __insert_flags(continue_on_error), name]
+    parts.extend(encoded_docs)
+    data = "".join(parts)
+    if safe:
+        builder = _MessageBuilder()
+        request_id = __last_error(builder, last_error_args)
+        data += builder.getvalue()
+    return (request_id, data)
 
 
-def insert(collection_name, docs, check_keys, safe, last_error_args):
+def insert(collection_name, docs, check_keys,
+           safe, last_error_args, continue_on_error=False):
     """Get an **insert** message.
     """
-    data = __ZERO
-    data += bson._make_c_string(collection_name)
-    bson_data = "".join([bson.BSON.encode(doc, check_keys) for doc in docs])
-    if not bson_data:
+    encoded_docs = [bson.BSON.encode(doc, check_keys) for doc in docs]
+    if not encoded_docs:
         raise InvalidOperation("cannot do an empty bulk insert")
-    data += bson_data
-    if safe:
-        (_, insert_message) = __pack_message(2002, data)
-        (request_id, error_message) = __last_error(last_error_args)
-        return (request_id, insert_message + error_message)
-    else:
-        return __pack_message(2002, data)
+    return __insert_message(collection_name, encoded_docs,
+                            continue_on_error, safe, last_error_args)
 if _use_c:
     insert = _cbson._insert_message
 
 
+def insert_encoded(collection_name, encoded_docs, continue_on_error=False):
+    """Get an unsafe **insert** message for documents that have
+    already been encoded to BSON.
+    """
+    if not encoded_docs:
+        raise InvalidOperation("cannot do an empty bulk insert")
+    return __insert_message(collection_name, encoded_docs,
+                            continue_on_error, False, None)
+
+
+def insert_batches(collection_name, docs, check_keys, safe, last_error_args,
+                   continue_on_error=False, max_message_size=MAX_MESSAGE_SIZE,
+                   max_batch_count=MAX_BATCH_COUNT):
+    """Get **insert** messages for `docs`, splitting them so that
+    no message is bigger than `max_message_size` bytes or holds more
+    than `max_batch_count` documents. Returns an iterator of
+    (request_id, data, count) triples, `count` being the number of
+    documents in the message.
+
+    Every document is encoded before this returns, so an invalid one
+    raises here, before any of the messages can have been sent. The
+    messages themselves are built one at a time as the iterator is
+    consumed. A document that is too big to share a message goes in
+    one on its own. If `safe` is ``True`` every message is followed by
+    its own getLastError.
+    """
+    encoded_docs = [bson.BSON.encode(doc, check_keys) for doc in docs]
+    if not encoded_docs:
+        raise InvalidOperation("cannot do an empty bulk insert")
+    return __insert_batches(collection_name, encoded_docs, safe,
+                            last_error_args, continue_on_error,
+                            max_message_size, max_batch_count)
+
+
+def _insert_overhead(collection_name):
+    """Get the size of everything in an insert message but the
+    documents.
+    """
+    return _HEADER.size + 4 + len(bson._make_c_string(collection_name))
+
+
+def __insert_batches(collection_name, encoded_docs, safe, last_error_args,
+                     continue_on_error, max_message_size, max_batch_count):
+    overhead = _insert_overhead(collection_name)
+    batch = []
+    size = overhead
+    for encoded in encoded_docs:
+        if batch and (len(batch) == max_batch_count or
+                      size + len(encoded) > max_message_size):
+            yield __finish_insert(collection_name, batch, continue_on_error,
+                                  safe, last_error_args)
+            batch = []
+            size = overhead
+        batch.append(encoded)
+        size += len(encoded)
+    yield __finish_insert(collection_name, batch, continue_on_error,
+                          safe, last_error_args)
+
+
+def __finish_insert(collection_name, batch, continue_on_error,
+                    safe, last_error_args):
+    (request_id, data) = __insert_message(collection_name, batch,
+                                          continue_on_error, safe,
+                                          last_error_args)
+    return (request_id, data, len(batch))
+
+
 def update(collection_name, upsert, multi, spec, doc, safe, last_error_args):
     """Get an **update** message.
     """
@@ -87,33 +335,55 @@ def update(collection_name, upsert, multi, spec, doc, safe, last_error_args):
     if multi:
         options += 2
 
-    data = __ZERO
-    data += bson._make_c_string(collection_name)
-    data += struct.pack("<i", options)
-    data += bson.BSON.encode(spec)
-    data += bson.BSON.encode(doc)
+    builder = _MessageBuilder()
+    request_id = builder.start(2001)
+    builder.write(__ZERO)
+    builder.write(bson._make_c_string(collection_name))
+    builder.write(_INT.pack(options))
+    builder.write(bson.BSON.encode(spec))
+    builder.write(bson.BSON.encode(doc))
+    builder.finish()
     if safe:
-        (_, update_message) = __pack_message(2001, data)
-        (request_id, error_message) = __last_error(last_error_args)
-        return (request_id, update_message + error_message)
-    else:
-        return __pack_message(2001, data)
+        request_id = __last_error(builder, last_error_args)
+    return (request_id, builder.getvalue())
 if _use_c:
     update = _cbson._update_message
 
 
+def __query(builder, options, collection_name,
+            num_to_skip, num_to_return, query, field_selector=None):
+    """Add a **query** message to `builder`, returning its request id.
+    """
+    request_id = builder.start(2004)
+    builder.write(struct.pack("<I", options))
+    builder.write(bson._make_c_string(collection_name))
+    builder.write(struct.pack("<ii", num_to_skip, num_to_return))
+    builder.write(bson.BSON.encode(query))
+    if field_selector is not None:
+        builder.write(bson.BSON.encode(field_selector))
+    builder.finish()
+    return request_id
+
+
 def query(options, collection_name,
           num_to_skip, num_to_return, query, field_selector=None):
     """Get a **query** message.
+
+    Commands are only encoded the first time they are sent; after
+    that the encoded message is reused.
     """
-    data = struct.pack("<I", options)
-    data += bson._make_c_string(collection_name)
-    data += struct.pack("<i", num_to_skip)
-    data += struct.pack("<i", num_to_return)
-    data += bson.BSON.encode(query)
-    if field_selector is not None:
-        data += bson.BSON.encode(field_selector)
-    return __pack_message(2004, data)
+    builder = _MessageBuilder()
+    key = None
+    if collection_name.endswith(".$cmd"):
+        key = __cache_key(options, collection_name, num_to_skip,
+                          num_to_return, query, field_selector)
+    request_id = __reuse(builder, key)
+    if request_id is None:
+        request_id = __query(builder, options, collection_name,
+                             num_to_skip, num_to_return, query,
+                             field_selector)
+        __remember(builder, key, 0)
+    return (request_id, builder.getvalue())
 if _use_c:
     query = _cbson._query_message
 
@@ -121,11 +391,13 @@ if _use_c:
 def get_more(collection_name, num_to_return, cursor_id):
     """Get a **getMore** message.
     """
-    data = __ZERO
-    data += bson._make_c_string(collection_name)
-    data += struct.pack("<i", num_to_return)
-    data += struct.pack("<q", cursor_id)
-    return __pack_message(2005, data)
+    builder = _MessageBuilder()
+    request_id = builder.start(2005)
+    builder.write(__ZERO)
+    builder.write(bson._make_c_string(collection_name))
+    builder.write(struct.pack("<iq", num_to_return, cursor_id))
+    builder.finish()
+    return (request_id, builder.getvalue())
 if _use_c:
     get_more = _cbson._get_more_message
 
@@ -133,23 +405,25 @@ if _use_c:
 def delete(collection_name, spec, safe, last_error_args):
     """Get a **delete** message.
     """
-    data = __ZERO
-    data += bson._make_c_string(collection_name)
-    data += __ZERO
-    data += bson.BSON.encode(spec)
+    builder = _MessageBuilder()
+    request_id = builder.start(2006)
+    builder.write(__ZERO)
+    builder.write(bson._make_c_string(collection_name))
+    builder.write(__ZERO)
+    builder.write(bson.BSON.encode(spec))
+    builder.finish()
     if safe:
-        (_, remove_message) = __pack_message(2006, data)
-        (request_id, error_message) = __last_error(last_error_args)
-        return (request_id, remove_message + error_message)
-    else:
-        return __pack_message(2006, data)
+        request_id = __last_error(builder, last_error_args)
+    return (request_id, builder.getvalue())
 
 
 def kill_cursors(cursor_ids):
     """Get a **killCursors** message.
     """
-    data = __ZERO
-    data += struct.pack("<i", len(cursor_ids))
-    for cursor_id in cursor_ids:
-        data += struct.pack("<q", cursor_id)
-    return __pack_message(2007, data)
+    builder = _MessageBuilder()
+    request_id = builder.start(2007)
+    builder.write(__ZERO)
+    builder.write(_INT.pack(len(cursor_ids)))
+    builder.write(struct.pack("<%dq" % len(cursor_ids), *cursor_ids))
+    builder.finish()
+    return (request_id, builder.getvalue())
@@ -0,0 +1,339 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Listening to the operations a :class:`~apymongo.connection.Connection`
+sends.
+
+Pass a list of :class:`OperationListener` instances as the
+`event_listeners` of a :class:`~apymongo.connection.Connection`. Each
+message sent to the server then produces an
+:class:`OperationStartedEvent` once it has a stream to go out on, and
+an :class:`OperationSucceededEvent` or :class:`OperationFailedEvent`
+once its reply (if it expects one) has been read and decoded.
+Listeners are called on the IOLoop, so they should be quick.
+
+:class:`HistogramListener` keeps latency histograms per collection,
+for reporting percentiles to a metrics system:
+
+>>> histograms = HistogramListener()
+>>> connection = Connection(event_listeners=[histograms])
+>>> ...
+>>> histograms.snapshot()["test.things"]["p99"]
+"""
+
+import math
+import struct
+import time
+import warnings
+
+# Operation names by wire protocol opcode.
+_OPERATIONS = {2001: "update",
+               2002: "insert",
+               2004: "query",
+               2005: "getmore",
+               2006: "delete",
+               2007: "killcursors"}
+
+# Opcodes whose messages have the collection name after a 4 byte
+# field following the header.
+_HAS_NAMESPACE = frozenset([2001, 2002, 2004, 2005, 2006])
+
+_OPCODE = struct.Struct("<i")
+
+
+class OperationListener(object):
+    """Base class for operation listeners. Override whichever of
+    :meth:`started`, :meth:`succeeded` and :meth:`failed` you need.
+
+    Exceptions raised by a listener are turned into warnings, rather
+    than breaking the operation that was being reported on.
+    """
+
+    def started(self, event):
+        """Called with an :class:`OperationStartedEvent`.
+        """
+        pass
+
+    def succeeded(self, event):
+        """Called with an :class:`OperationSucceededEvent`.
+        """
+        pass
+
+    def failed(self, event):
+        """Called with an :class:`OperationFailedEvent`.
+        """
+        pass
+
+
+class OperationStartedEvent(object):
+    """A message has been given a stream and is being sent.
+
+    Durations are in seconds; `encode_duration` is ``None`` if the
+    message was built before being handed to the connection, rather
+    than by it.
+
+    :Attributes:
+      - `operation`: ``"query"``, ``"getmore"``, ``"command"``,
+        ``"insert"``, ``"update"``, ``"delete"`` or ``"killcursors"``
+      - `namespace`: the full name of the collection, or ``None``
+      - `request_id`: the id of the message whose reply is waited for
+      - `bytes_sent`: the size of the message (with any getLastError)
+      - `encode_duration`: time spent building the message, including
+        encoding its documents
+      - `pool_wait`: time spent waiting for a stream from the pool
+    """
+
+    def __init__(self, operation):
+        self.operation = operation.operation
+        self.namespace = operation.namespace
+        self.request_id = operation.request_id
+        self.bytes_sent = operation.bytes_sent
+        self.encode_duration = operation.encode_duration
+        self.pool_wait = operation.pool_wait
+
+    def __repr__(self):
+        return "%s(%s %s, request_id=%r)" % (self.__class__.__name__,
+                                             self.operation, self.namespace,
+                                             self.request_id)
+
+
+class OperationSucceededEvent(OperationStartedEvent):
+    """A message has been sent and its reply (if any) decoded.
+
+    Has the attributes of :class:`OperationStartedEvent`, and:
+
+    :Attributes:
+      - `bytes_received`: the size of the reply, ``0`` if there wasn't
+        one
+      - `wire_duration`: time from checking out a stream to having read
+        the reply (or written the message, if there is no reply)
+      - `decode_duration`: time spent decoding the reply, ``0`` if there
+        wasn't one
+      - `duration`: time from the message being handed to the
+        :class:`~apymongo.connection.Connection` to the operation
+        finishing - pool wait, wire and decode time together
+    """
+
+    def __init__(self, operation):
+        OperationStartedEvent.__init__(self, operation)
+        self.bytes_received = operation.bytes_received
+        self.wire_duration = operation.wire_duration
+        self.decode_duration = operation.decode_duration
+        self.duration = operation.duration
+
+
+class OperationFailedEvent(OperationSucceededEvent):
+    """A message could not be sent, or its reply held an error.
+
+    Has the attributes of :class:`OperationSucceededEvent` (those for
+    stages that weren't reached are ``None``), and:
+
+    :Attributes:
+      - `failure`: the exception the operation failed with
+    """
+
+    def __init__(self, operation, failure):
+        OperationSucceededEvent.__init__(self, operation)
+        self.failure = failure
+
+
+def _describe(data):
+    """Get the operation name and namespace of the message `data`
+    starts with.
+    """
+    opcode = _OPCODE.unpack_from(data, 12)[0]
+    operation = _OPERATIONS.get(opcode, str(opcode))
+    namespace = None
+    if opcode in _HAS_NAMESPACE:
+        namespace = data[20:data.index("\x00", 20)]
+        if opcode == 2004 and namespace.endswith(".$cmd"):
+            operation = "command"
+    return (operation, namespace)
+
+
+class _Operation(object):
+    """Times one message on its way through a
+    :class:`~apymongo.connection.Connection` and reports it to
+    `listeners`.
+
+    Created when the message is handed over; the connection then calls
+    :meth:`checked_out`, :meth:`received` and :meth:`succeeded` as the
+    message goes along, or :meth:`failed` if it goes wrong.
+    """
+
+    def __init__(self, listeners, message, encode_duration):
+        (request_id, data) = message
+        self.listeners = listeners
+        self.request_id = request_id
+        self.bytes_sent = len(data)
+        (self.operation, self.namespace) = _describe(data)
+        self.encode_duration = encode_duration
+        self.pool_wait = None
+        self.bytes_received = None
+        self.wire_duration = None
+        self.decode_duration = None
+        self.duration = None
+        self.__created = time.time()
+        self.__checked_out = None
+        self.__received = None
+
+    def checked_out(self):
+        """A stream has been found; the message is about to be written.
+        """
+        self.__checked_out = time.time()
+        self.pool_wait = self.__checked_out - self.__created
+        self.__publish("started", OperationStartedEvent(self))
+
+    def received(self, length):
+        """The reply, `length` bytes long, has been read - or the
+        message has been written, if there is no reply (`length` 0).
+        """
+        self.__received = time.time()
+        self.bytes_received = length
+        self.wire_duration = self.__received - self.__checked_out
+
+    def succeeded(self):
+        """The reply (if any) has been decoded.
+        """
+        now = time.time()
+        self.decode_duration = now - self.__received
+        self.duration = now - self.__created
+        self.__publish("succeeded", OperationSucceededEvent(self))
+
+    def failed(self, failure):
+        now = time.time()
+        if self.__received is not None:
+            self.decode_duration = now - self.__received
+        self.duration = now - self.__created
+        self.__publish("failed", OperationFailedEvent(self, failure))
+
+    def __publish(self, name, event):
+        for listener in self.listeners:
+            try:
+                getattr(listener, name)(event)
+            except Exception, e:
+                warnings.warn("%r raised %r handling %r" %
+                              (listener, e, event), RuntimeWarning)
+
+
+class _Histogram(object):
+    """Counts of durations in logarithmic buckets, each `_GROWTH` times
+    as wide as the last, so percentiles come out within a few percent
+    whatever the range of the durations.
+    """
+
+    _GROWTH = 1.05
+    # Durations are bucketed in microseconds.
+    _UNIT = 1e-6
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+
+    def add(self, seconds):
+        units = max(seconds / self._UNIT, 1.0)
+        bucket = int(math.log(units) / math.log(self._GROWTH))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+
+    def percentile(self, percent):
+        """The duration (in seconds) `percent` percent of those added
+        were no longer than, or ``None`` if none have been.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * percent / 100.0)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+        # The middle of the bucket.
+        return self._GROWTH ** (bucket + 0.5) * self._UNIT
+
+
+class _CollectionStats(object):
+
+    def __init__(self):
+        self.latency = _Histogram()
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class HistogramListener(OperationListener):
+    """Keeps a latency histogram, failure count and byte counts for each
+    namespace operations are sent to.
+
+    Only finished operations are counted, by their total `duration`.
+    Memory use depends on the number of namespaces and the spread of
+    latencies, not on the number of operations.
+    """
+
+    def __init__(self, percentiles=(50, 90, 99)):
+        """Create a listener.
+
+        :Parameters:
+          - `percentiles` (optional): the percentiles reported by
+            :meth:`snapshot`
+        """
+        self.__percentiles = tuple(percentiles)
+        self.__stats = {}
+
+    def __record(self, event):
+        stats = self.__stats.get(event.namespace)
+        if stats is None:
+            stats = self.__stats[event.namespace] = _CollectionStats()
+        stats.latency.add(event.duration)
+        stats.bytes_sent += event.bytes_sent
+        stats.bytes_received += event.bytes_received or 0
+        return stats
+
+    def succeeded(self, event):
+        self.__record(event)
+
+    def failed(self, event):
+        self.__record(event).failures += 1
+
+    def percentile(self, namespace, percent):
+        """The `percent` percentile latency (in seconds) of operations
+        on `namespace`, or ``None`` if there haven't been any.
+        """
+        stats = self.__stats.get(namespace)
+        if stats is None:
+            return None
+        return stats.latency.percentile(percent)
+
+    def snapshot(self):
+        """Get a dict mapping each namespace to a dict of its
+        ``"count"``, ``"failures"``, ``"bytes_sent"``,
+        ``"bytes_received"`` and, for each of the percentiles, e.g.
+        ``"p99"``: latency in seconds.
+        """
+        result = {}
+        for (namespace, stats) in self.__stats.iteritems():
+            summary = {"count": stats.latency.count,
+                       "failures": stats.failures,
+                       "bytes_sent": stats.bytes_sent,
+                       "bytes_received": stats.bytes_received}
+            for percent in self.__percentiles:
+                summary["p%s" % (percent,)] = \
+                    stats.latency.percentile(percent)
+            result[namespace] = summary
+        return result
+
+    def reset(self):
+        """Forget everything recorded so far.
+        """
+        self.__stats = {}
@@ -0,0 +1,85 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read preferences, for choosing which replica set member serves a read."""
+
+import random
+
+
+class ReadPreference:
+    """The read preferences a :class:`~apymongo.connection.Connection`,
+    :meth:`~apymongo.collection.Collection.find` and
+    :class:`~apymongo.cursor.Cursor` accept.
+
+    - ``PRIMARY``: read from the primary only.
+    - ``PRIMARY_PREFERRED``: read from the primary, or from a secondary
+      if there is no primary.
+    - ``SECONDARY``: read from a secondary only.
+    - ``SECONDARY_PREFERRED``: read from a secondary, or from the
+      primary if there is no secondary.
+    - ``NEAREST``: read from whichever member answers pings fastest,
+      primary or secondary.
+
+    Where several members qualify, one is picked at random from those
+    whose average ping time is within the connection's
+    `secondary_acceptable_latency_ms` of the fastest.
+    """
+
+    PRIMARY = 0
+    PRIMARY_PREFERRED = 1
+    SECONDARY = 2
+    SECONDARY_PREFERRED = 3
+    NEAREST = 4
+
+MODES = frozenset([ReadPreference.PRIMARY,
+                   ReadPreference.PRIMARY_PREFERRED,
+                   ReadPreference.SECONDARY,
+                   ReadPreference.SECONDARY_PREFERRED,
+                   ReadPreference.NEAREST])
+
+
+def _pick_nearest(nodes, rtts, latency):
+    """Pick at random one of `nodes` within `latency` seconds of the
+    fastest. Nodes without a ping time are never picked.
+    """
+    timed = [node for node in nodes if node in rtts]
+    if not timed:
+        return None
+    fastest = min([rtts[node] for node in timed])
+    return random.choice([node for node in timed
+                          if rtts[node] <= fastest + latency])
+
+
+def select_node(mode, primary, secondaries, rtts, latency):
+    """Choose the member a read with read preference `mode` goes to.
+
+    `primary` is the primary's node, or ``None`` if there is none.
+    `secondaries` is a list of the secondaries that can be reached, and
+    `rtts` maps nodes to their average ping time in seconds. Returns
+    ``None`` if no member is suitable.
+    """
+    if mode == ReadPreference.PRIMARY:
+        return primary
+    if mode == ReadPreference.PRIMARY_PREFERRED:
+        return primary or _pick_nearest(secondaries, rtts, latency)
+    if mode == ReadPreference.SECONDARY:
+        return _pick_nearest(secondaries, rtts, latency)
+    if mode == ReadPreference.SECONDARY_PREFERRED:
+        return _pick_nearest(secondaries, rtts, latency) or primary
+    if mode == ReadPreference.NEAREST:
+        members = list(secondaries)
+        if primary is not None:
+            members.append(primary)
+        return _pick_nearest(members, rtts, latency)
+    raise ValueError("unknown read preference %r" % (mode,))
@@ -0,0 +1,170 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Query documents that are encoded once and then filled in."""
+
+import struct
+
+import bson
+from bson.raw_bson import RawBSONDocument
+
+_INT = struct.Struct("<i")
+
+
+class Param(object):
+    """A named slot in a :class:`QueryTemplate`, filled in when the
+    template is bound.
+    """
+
+    def __init__(self, name):
+        if not isinstance(name, basestring):
+            raise TypeError("name must be an instance of basestring")
+        self.__name = name
+
+    @property
+    def name(self):
+        return self.__name
+
+    def __repr__(self):
+        return "Param(%r)" % (self.__name,)
+
+
+class _Slot(object):
+    """An element whose value is the parameter `param`."""
+
+    def __init__(self, name, param):
+        self.name = name
+        self.param = param
+
+
+class _Embedded(object):
+    """An embedded document or array holding parameters. `prefix` is
+    its element's type and name, `parts` its compiled elements.
+    """
+
+    def __init__(self, prefix, parts):
+        self.prefix = prefix
+        self.parts = parts
+
+
+def _has_params(value):
+    if isinstance(value, Param):
+        return True
+    if isinstance(value, dict):
+        return any([_has_params(v) for v in value.itervalues()])
+    if isinstance(value, (list, tuple)):
+        return any([_has_params(v) for v in value])
+    return False
+
+
+def _compile(items, params):
+    """Compile (key, value) pairs into a list of parts: runs of
+    elements without parameters are encoded up front into a single
+    string, and the rest become :class:`_Slot` and :class:`_Embedded`
+    instances. The names of any parameters are added to `params`.
+    """
+    parts = []
+    static = []
+    for (key, value) in items:
+        if not _has_params(value):
+            static.append(bson._element_to_bson(key, value, False))
+            continue
+
+        if static:
+            parts.append("".join(static))
+            static = []
+        name = bson._make_c_string(key, True)
+        if isinstance(value, Param):
+            parts.append(_Slot(name, value.name))
+            params.add(value.name)
+        elif isinstance(value, dict):
+            parts.append(_Embedded("\x03" + name,
+                                   _compile(value.iteritems(), params)))
+        else:
+            parts.append(_Embedded("\x04" + name,
+                                   _compile([(str(i), v) for (i, v)
+                                             in enumerate(value)], params)))
+    if static:
+        parts.append("".join(static))
+    return parts
+
+
+def _render(parts, values):
+    """Encode compiled `parts` as a document, filling in `values`.
+    """
+    elements = []
+    for part in parts:
+        if isinstance(part, str):
+            elements.append(part)
+        elif isinstance(part, _Slot):
+            elements.append(bson._value_to_bson(part.name,
+                                                values[part.param], False))
+        else:
+            elements.append(part.prefix + _render(part.parts, values))
+    elements = "".join(elements)
+    return _INT.pack(len(elements) + 5) + elements + "\x00"
+
+
+class QueryTemplate(object):
+    """A query document encoded ahead of time, with :class:`Param`
+    slots for the values that change from query to query.
+
+    Everything but the parameters is encoded to BSON once, when the
+    template is created. :meth:`bind` then only has to encode the
+    parameters' values and join them with the pre-encoded pieces:
+
+    >>> by_user = QueryTemplate({"user": Param("user"), "active": True})
+    >>> collection.find(by_user.bind(user=user_id), callback=callback)
+
+    Parameters can be nested at any depth, e.g.
+    ``{"age": {"$gte": Param("min_age")}}``.
+    """
+
+    def __init__(self, spec):
+        """Compile `spec`, a query document holding :class:`Param`
+        instances.
+
+        :Parameters:
+          - `spec`: the query document
+        """
+        if not isinstance(spec, dict):
+            raise TypeError("spec must be an instance of dict")
+        items = spec.items()
+        # Encode "_id" first, as bson.BSON.encode does.
+        items.sort(key=lambda (key, _): key != "_id")
+        self.__params = set()
+        self.__parts = _compile(items, self.__params)
+
+    @property
+    def params(self):
+        """The names of this template's parameters.
+        """
+        return frozenset(self.__params)
+
+    def bind(self, **values):
+        """Fill in the parameters, returning the finished query as a
+        :class:`~bson.raw_bson.RawBSONDocument` that can be passed to
+        :meth:`~apymongo.collection.Collection.find` and friends.
+
+        Every parameter must be given a value, by keyword.
+        """
+        missing = self.__params.difference(values)
+        if missing:
+            raise TypeError("missing values for parameters: %s" %
+                            ", ".join(sorted(missing)))
+        unknown = set(values).difference(self.__params)
+        if unknown:
+            raise TypeError("unknown parameters: %s" %
+                            ", ".join(sorted(unknown)))
+        return RawBSONDocument(_render(self.__parts, values))
@@ -51,25 +51,52 @@ except ImportError:
 # This sort of sucks, but seems to be as good as it gets...
 RE_TYPE = type(re.compile(""))
 
-
-def _get_int(data, as_class=None, tz_aware=False, unsigned=False):
-    format = unsigned and "I" or "i"
+_INT = struct.Struct("<i")
+_UINT = struct.Struct("<I")
+_LONG = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_TIMESTAMP = struct.Struct("<II")
+
+# Size of the value of each fixed-size element type.
+_FIXED_SIZES = {
+    "\x01": 8,   # double
+    "\x06": 0,   # undefined
+    "\x07": 12,  # ObjectId
+    "\x08": 1,   # boolean
+    "\x09": 8,   # UTC datetime
+    "\x0A": 0,   # null
+    "\x10": 4,   # int32
+    "\x11": 8,   # timestamp
+    "\x12": 8,   # int64
+    "\xFF": 0,   # min key
+    "\x7F": 0}   # max key
+
+
+# The decoder works on a single buffer and integer offsets into it:
+# each _get_* function takes the position of a value and returns the
+# value along with the position just past it. Nothing but the values
+# themselves is ever sliced out of `data`.
+
+
+def _get_int(data, position, as_class=None, tz_aware=False, unsigned=False):
     try:
-        value = struct.unpack("<%s" % format, data[:4])[0]
+        value = (unsigned and _UINT or _INT).unpack_from(data, position)[0]
     except struct.error:
         raise InvalidBSON()
 
-    return (value, data[4:])
+    return (value, position + 4)
 
 
-def _get_c_string(data, length=None):
+def _get_c_string(data, position, length=None):
     if length is None:
         try:
-            length = data.index("\x00")
+            end = data.index("\x00", position)
         except ValueError:
             raise InvalidBSON()
+    else:
+        end = position + length
 
-    return (unicode(data[:length], "utf-8"), data[length + 1:])
+    return (unicode(data[position:end], "utf-8"), end + 1)
 
 
 def _make_c_string(string, check_null=False):
@@ -87,78 +114,87 @@ def _make_c_string(string, check_null=False):
                                     "UTF-8: %r" % string)
 
 
-def _get_number(data, as_class, tz_aware):
-    return (struct.unpack("<d", data[:8])[0], data[8:])
+def _get_number(data, position, as_class, tz_aware):
+    return (_DOUBLE.unpack_from(data, position)[0], position + 8)
 
 
-def _get_string(data, as_class, tz_aware):
-    return _get_c_string(data[4:], struct.unpack("<i", data[:4])[0] - 1)
+def _get_string(data, position, as_class, tz_aware):
+    (length, position) = _get_int(data, position)
+    return _get_c_string(data, position, length - 1)
 
 
-def _get_object(data, as_class, tz_aware):
-    (object, data) = _bson_to_dict(data, as_class, tz_aware)
+def _get_object(data, position, as_class, tz_aware):
+    end = _object_end(data, position)
+    object = _elements_to_dict(data, position + 4, end, as_class, tz_aware)
     if "$ref" in object:
         return (DBRef(object.pop("$ref"), object.pop("$id"),
-                      object.pop("$db", None), object), data)
-    return (object, data)
+                      object.pop("$db", None), object), end + 1)
+    return (object, end + 1)
 
 
-def _get_array(data, as_class, tz_aware):
-    (obj, data) = _get_object(data, as_class, tz_aware)
+def _get_array(data, position, as_class, tz_aware):
+    end = _object_end(data, position)
+    position += 4
     result = []
-    i = 0
-    while True:
+    append = result.append
+    while position < end:
+        element_type = data[position]
         try:
-            result.append(obj[str(i)])
-            i += 1
-        except KeyError:
-            break
-    return (result, data)
-
-
-def _get_binary(data, as_class, tz_aware):
-    (length, data) = _get_int(data)
-    subtype = ord(data[0])
-    data = data[1:]
+            position = data.index("\x00", position + 1) + 1
+        except ValueError:
+            raise InvalidBSON()
+        (value, position) = _get_element(element_type)(data, position,
+                                                       as_class, tz_aware)
+        append(value)
+    if position != end:
+        raise InvalidBSON("bad array length")
+    return (result, end + 1)
+
+
+def _get_binary(data, position, as_class, tz_aware):
+    (length, position) = _get_int(data, position)
+    subtype = ord(data[position])
+    position += 1
     if subtype == 2:
-        (length2, data) = _get_int(data)
+        (length2, position) = _get_int(data, position)
         if length2 != length - 4:
             raise InvalidBSON("invalid binary (st 2) - lengths don't match!")
         length = length2
+    end = position + length
     if subtype == 3 and _use_uuid:
-        return (uuid.UUID(bytes=data[:length]), data[length:])
-    return (Binary(data[:length], subtype), data[length:])
+        return (uuid.UUID(bytes=data[position:end]), end)
+    return (Binary(data[position:end], subtype), end)
 
 
-def _get_oid(data, as_class, tz_aware):
-    return (ObjectId(data[:12]), data[12:])
+def _get_oid(data, position, as_class, tz_aware):
+    end = position + 12
+    return (ObjectId(data[position:end]), end)
 
 
-def _get_boolean(data, as_class, tz_aware):
-    return (data[0] == "\x01", data[1:])
+def _get_boolean(data, position, as_class, tz_aware):
+    return (data[position] == "\x01", position + 1)
 
 
-def _get_date(data, as_class, tz_aware):
-    seconds = float(struct.unpack("<q", data[:8])[0]) / 1000.0
+def _get_date(data, position, as_class, tz_aware):
+    seconds = float(_LONG.unpack_from(data, position)[0]) / 1000.0
     if tz_aware:
-        return (datetime.datetime.fromtimestamp(seconds, utc), data[8:])
-    return (datetime.datetime.utcfromtimestamp(seconds), data[8:])
+        return (datetime.datetime.fromtimestamp(seconds, utc), position + 8)
+    return (datetime.datetime.utcfromtimestamp(seconds), position + 8)
 
 
-def _get_code_w_scope(data, as_class, tz_aware):
-    (_, data) = _get_int(data)
-    (code, data) = _get_string(data)
-    (scope, data) = _get_object(data, as_class, tz_aware)
-    return (Code(code, scope), data)
+def _get_code_w_scope(data, position, as_class, tz_aware):
+    (code, position) = _get_string(data, position + 4, as_class, tz_aware)
+    (scope, position) = _get_object(data, position, as_class, tz_aware)
+    return (Code(code, scope), position)
 
 
-def _get_null(data, as_class, tz_aware):
-    return (None, data)
+def _get_null(data, position, as_class, tz_aware):
+    return (None, position)
 
 
-def _get_regex(data, as_class, tz_aware):
-    (pattern, data) = _get_c_string(data)
-    (bson_flags, data) = _get_c_string(data)
+def _get_regex(data, position, as_class, tz_aware):
+    (pattern, position) = _get_c_string(data, position)
+    (bson_flags, position) = _get_c_string(data, position)
     flags = 0
     if "i" in bson_flags:
         flags |= re.IGNORECASE
@@ -172,23 +208,22 @@ def _get_regex(data, as_class, tz_aware):
         flags |= re.UNICODE
     if "x" in bson_flags:
         flags |= re.VERBOSE
-    return (re.compile(pattern, flags), data)
+    return (re.compile(pattern, flags), position)
 
 
-def _get_ref(data, as_class, tz_aware):
-    (collection, data) = _get_c_string(data[4:])
-    (oid, data) = _get_oid(data)
-    return (DBRef(collection, oid), data)
+def _get_ref(data, position, as_class, tz_aware):
+    (collection, position) = _get_c_string(data, position + 4)
+    (oid, position) = _get_oid(data, position, as_class, tz_aware)
+    return (DBRef(collection, oid), position)
 
 
-def _get_timestamp(data, as_class, tz_aware):
-    (inc, data) = _get_int(data, unsigned=True)
-    (timestamp, data) = _get_int(data, unsigned=True)
-    return (Timestamp(timestamp, inc), data)
+def _get_timestamp(data, position, as_class, tz_aware):
+    (inc, timestamp) = _TIMESTAMP.unpack_from(data, position)
+    return (Timestamp(timestamp, inc), position + 8)
 
 
-def _get_long(data, as_class, tz_aware):
-    return (struct.unpack("<q", data[:8])[0], data[8:])
+def _get_long(data, position, as_class, tz_aware):
+    return (_LONG.unpack_from(data, position)[0], position + 8)
 
 
 _element_getter = {
@@ -210,35 +245,364 @@ _element_getter = {
     "\x10": _get_int,  # number_int
     "\x11": _get_timestamp,
     "\x12": _get_long,
-    "\xFF": lambda x, y, z: (MinKey(), x),
-    "\x7F": lambda x, y, z: (MaxKey(), x)}
+    "\xFF": lambda w, x, y, z: (MinKey(), x),
+    "\x7F": lambda w, x, y, z: (MaxKey(), x)}
+
+
+def _get_element(element_type):
+    try:
+        return _element_getter[element_type]
+    except KeyError:
+        raise InvalidBSON("unknown element type %r" % element_type)
 
 
-def _element_to_dict(data, as_class, tz_aware):
-    element_type = data[0]
-    (element_name, data) = _get_c_string(data[1:])
-    (value, data) = _element_getter[element_type](data, as_class, tz_aware)
-    return (element_name, value, data)
+def _object_end(data, position):
+    """Check the embedded document or array at `position` and return
+    the position of its terminating null.
+    """
+    try:
+        obj_size = _INT.unpack_from(data, position)[0]
+    except struct.error:
+        raise InvalidBSON("not enough data for a BSON document")
+    if obj_size < 5:
+        raise InvalidBSON("invalid object size")
+    end = position + obj_size - 1
+    if end >= len(data):
+        raise InvalidBSON("objsize too large")
+    if data[end] != "\x00":
+        raise InvalidBSON("bad eoo")
+    return end
 
 
-def _elements_to_dict(data, as_class, tz_aware):
+def _value_end(data, element_type, position):
+    """Find where the value of an element starting at `position` ends,
+    without decoding it.
+    """
+    try:
+        size = _FIXED_SIZES.get(element_type)
+        if size is not None:
+            return position + size
+        if element_type in "\x02\x0D\x0E":  # string, code, symbol
+            return position + 4 + _INT.unpack_from(data, position)[0]
+        if element_type in "\x03\x04\x0F":  # document, array, code w/ scope
+            return position + _INT.unpack_from(data, position)[0]
+        if element_type == "\x05":  # binary
+            return position + 5 + _INT.unpack_from(data, position)[0]
+        if element_type == "\x0B":  # regex
+            position = data.index("\x00", position) + 1
+            return data.index("\x00", position) + 1
+        if element_type == "\x0C":  # DBPointer
+            return position + 16 + _INT.unpack_from(data, position)[0]
+    except (struct.error, ValueError):
+        raise InvalidBSON("not enough data for element")
+    raise InvalidBSON("unknown element type %r" % element_type)
+
+
+def _projection(fields):
+    """Turn `fields`, a list of (possibly dotted) key names or a dict
+    whose true-valued keys are such names, into a tree of dicts keyed by
+    unicode names. A key mapping to ``True`` is kept whole.
+    """
+    if isinstance(fields, dict):
+        fields = [key for (key, value) in fields.iteritems() if value]
+    tree = {}
+    for field in fields:
+        if not isinstance(field, basestring):
+            raise TypeError("fields must be key names, not %r" % (field,))
+        if isinstance(field, str):
+            field = field.decode("utf-8")
+        node = tree
+        parts = field.split(".")
+        for part in parts[:-1]:
+            child = node.get(part)
+            if child is True:
+                break
+            if child is None:
+                child = node[part] = {}
+            node = child
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _project_elements(data, position, end, as_class, tz_aware, projection):
+    """Decode only the elements of `data` between `position` and `end`
+    named by `projection` (see :func:`_projection`), stepping over the
+    rest by their lengths.
+    """
     result = as_class()
-    while data:
-        (key, value, data) = _element_to_dict(data, as_class, tz_aware)
+    for (element_type, name, start, value_end) in _iter_elements(data,
+                                                                  position,
+                                                                  end):
+        wanted = projection.get(name)
+        if wanted is True:
+            result[name] = _element_getter[element_type](data, start,
+                                                         as_class,
+                                                         tz_aware)[0]
+        elif wanted:
+            value = _project_value(data, element_type, start, as_class,
+                                   tz_aware, wanted)
+            if value is not None:
+                result[name] = value
+    return result
+
+
+def _project_value(data, element_type, position, as_class, tz_aware,
+                   projection):
+    """Apply `projection` to the embedded document or array at
+    `position`, returning ``None`` for any other type of value.
+    """
+    if element_type == "\x03":
+        end = _object_end(data, position)
+        return _project_elements(data, position + 4, end, as_class,
+                                 tz_aware, projection)
+    if element_type == "\x04":
+        # As on the server, projecting into an array projects each
+        # embedded document (or array) in it and drops everything else.
+        end = _object_end(data, position)
+        result = []
+        for (item_type, _, start, _) in _iter_elements(data, position + 4,
+                                                       end):
+            value = _project_value(data, item_type, start, as_class,
+                                   tz_aware, projection)
+            if value is not None:
+                result.append(value)
+        return result
+    return None
+
+
+def _iter_elements(data, position, end):
+    """Yield (type, name, value start, value end) for each element of
+    `data` between `position` and `end` without decoding any values.
+    """
+    while position < end:
+        element_type = data[position]
+        (name, start) = _get_c_string(data, position + 1)
+        position = _value_end(data, element_type, start)
+        if position > end:
+            raise InvalidBSON("not enough data for element")
+        yield (element_type, name, start, position)
+
+
+def _element_to_dict(data, position, as_class, tz_aware):
+    element_type = data[position]
+    (element_name, position) = _get_c_string(data, position + 1)
+    (value, position) = _get_element(element_type)(data, position,
+                                                   as_class, tz_aware)
+    return (element_name, value, position)
+
+
+def _elements_to_dict(data, position, end, as_class, tz_aware):
+    result = as_class()
+    while position < end:
+        (key, value, position) = _element_to_dict(data, position,
+                                                  as_class, tz_aware)
         result[key] = value
+    if position != end:
+        raise InvalidBSON("bad object or element length")
     return result
 
 
-def _bson_to_dict(data, as_class, tz_aware):
-    obj_size = struct.unpack("<i", data[:4])[0]
-    if len(data) < obj_size:
-        raise InvalidBSON("objsize too large")
-    if data[obj_size - 1] != "\x00":
-        raise InvalidBSON("bad eoo")
-    elements = data[4:obj_size - 1]
-    return (_elements_to_dict(elements, as_class, tz_aware), data[obj_size:])
+def _bson_to_dict(data, as_class, tz_aware, fields=None):
+    end = _object_end(data, 0)
+    if fields is not None:
+        document = _project_elements(data, 4, end, as_class, tz_aware,
+                                     _projection(fields))
+    else:
+        document = _elements_to_dict(data, 4, end, as_class, tz_aware)
+    return (document, data[end + 1:])
 if _use_c:
-    _bson_to_dict = _cbson._bson_to_dict
+    def _bson_to_dict(data, as_class, tz_aware, fields=None):
+        projection = None
+        if fields is not None:
+            projection = _projection(fields)
+        return _cbson._bson_to_dict(data, as_class, tz_aware, projection)
+
+
+# The encoder looks up a function for each value by its exact type,
+# falling back to a chain of isinstance checks (whose result is then
+# cached for that type). Each function gets the element's name, already
+# encoded as a C string, and returns the whole element.
+
+
+def _encode_float(name, value, check_keys):
+    return "\x01" + name + _DOUBLE.pack(value)
+
+
+def _encode_string(name, value, check_keys):
+    cstring = _make_c_string(value)
+    return "\x02" + name + _INT.pack(len(cstring)) + cstring
+
+
+def _encode_dict(name, value, check_keys):
+    return "\x03" + name + _py_dict_to_bson(value, check_keys, False)
+
+
+def _encode_raw(name, value, check_keys):
+    return "\x03" + name + value.raw
+
+
+def _encode_list(name, value, check_keys):
+    return "\x04" + name + _list_to_bson(value, check_keys)
+
+
+def _encode_binary(name, value, check_keys):
+    subtype = value.subtype
+    if subtype == 2:
+        value = _INT.pack(len(value)) + value
+    return "\x05" + name + _INT.pack(len(value)) + chr(subtype) + value
+
+
+def _encode_uuid(name, value, check_keys):
+    # Use Binary w/ subtype 3 for UUID instances
+    return "\x05" + name + _INT.pack(16) + "\x03" + value.bytes
+
+
+def _encode_objectid(name, value, check_keys):
+    return "\x07" + name + value.binary
+
+
+def _encode_bool(name, value, check_keys):
+    return "\x08" + name + (value and "\x01" or "\x00")
+
+
+def _encode_datetime(name, value, check_keys):
+    if value.utcoffset() is not None:
+        value = value - value.utcoffset()
+    millis = int(calendar.timegm(value.timetuple()) * 1000 +
+                 value.microsecond / 1000)
+    return "\x09" + name + _LONG.pack(millis)
+
+
+def _encode_none(name, value, check_keys):
+    return "\x0A" + name
+
+
+def _encode_regex(name, value, check_keys):
+    flags = ""
+    if value.flags & re.IGNORECASE:
+        flags += "i"
+    if value.flags & re.LOCALE:
+        flags += "l"
+    if value.flags & re.MULTILINE:
+        flags += "m"
+    if value.flags & re.DOTALL:
+        flags += "s"
+    if value.flags & re.UNICODE:
+        flags += "u"
+    if value.flags & re.VERBOSE:
+        flags += "x"
+    return "\x0B" + name + _make_c_string(value.pattern, True) + \
+        _make_c_string(flags)
+
+
+def _encode_dbref(name, value, check_keys):
+    return "\x03" + name + _py_dict_to_bson(value.as_doc(), False, False)
+
+
+def _encode_code(name, value, check_keys):
+    cstring = _make_c_string(value)
+    scope = _py_dict_to_bson(value.scope, False, False)
+    full_length = _INT.pack(8 + len(cstring) + len(scope))
+    return "\x0F" + name + full_length + _INT.pack(len(cstring)) + \
+        cstring + scope
+
+
+def _encode_int(name, value, check_keys):
+    if -2147483648 <= value <= 2147483647:
+        return "\x10" + name + _INT.pack(value)
+    if -9223372036854775808 <= value <= 9223372036854775807:
+        return "\x12" + name + _LONG.pack(value)
+    raise OverflowError("BSON can only handle up to 8-byte ints")
+
+
+def _encode_timestamp(name, value, check_keys):
+    return "\x11" + name + _TIMESTAMP.pack(value.inc, value.time)
+
+
+def _encode_minkey(name, value, check_keys):
+    return "\xFF" + name
+
+
+def _encode_maxkey(name, value, check_keys):
+    return "\x7F" + name
+
+
+_ENCODERS = {
+    float: _encode_float,
+    str: _encode_string,
+    unicode: _encode_string,
+    dict: _encode_dict,
+    SON: _encode_dict,
+    list: _encode_list,
+    tuple: _encode_list,
+    Binary: _encode_binary,
+    ObjectId: _encode_objectid,
+    bool: _encode_bool,
+    datetime.datetime: _encode_datetime,
+    type(None): _encode_none,
+    RE_TYPE: _encode_regex,
+    DBRef: _encode_dbref,
+    Code: _encode_code,
+    int: _encode_int,
+    long: _encode_int,
+    Timestamp: _encode_timestamp,
+    MinKey: _encode_minkey,
+    MaxKey: _encode_maxkey}
+
+# For subclasses, in the order they are tried. Binary and Code come
+# before str since they subclass it.
+_ENCODER_FALLBACKS = [
+    (float, _encode_float),
+    (Binary, _encode_binary),
+    (Code, _encode_code),
+    (basestring, _encode_string),
+    (dict, _encode_dict),
+    ((list, tuple), _encode_list),
+    (ObjectId, _encode_objectid),
+    (bool, _encode_bool),
+    ((int, long), _encode_int),
+    (datetime.datetime, _encode_datetime),
+    (Timestamp, _encode_timestamp),
+    (RE_TYPE, _encode_regex),
+    (DBRef, _encode_dbref),
+    (MinKey, _encode_minkey),
+    (MaxKey, _encode_maxkey)]
+
+if _use_uuid:
+    _ENCODERS[uuid.UUID] = _encode_uuid
+    _ENCODER_FALLBACKS.insert(0, (uuid.UUID, _encode_uuid))
+
+# Encoded names for the first array indexes.
+_INDEX_NAMES = [str(i) + "\x00" for i in range(1000)]
+
+# Encoded names of keys seen before, to save checking and encoding the
+# same keys over and over. Emptied if it grows past _MAX_NAMES.
+_NAMES = {}
+_MAX_NAMES = 10000
+
+
+def _find_encoder(value):
+    value_type = type(value)
+    if getattr(value_type, "_raw_document", False):
+        encoder = _encode_raw
+    else:
+        for (types, encoder) in _ENCODER_FALLBACKS:
+            if isinstance(value, types):
+                break
+        else:
+            raise InvalidDocument("cannot convert value of type %s to bson" %
+                                  value_type)
+    _ENCODERS[value_type] = encoder
+    return encoder
+
+
+def _value_to_bson(name, value, check_keys):
+    try:
+        encoder = _ENCODERS[type(value)]
+    except KeyError:
+        encoder = _find_encoder(value)
+    return encoder(name, value, check_keys)
 
 
 def _element_to_bson(key, value, check_keys):
@@ -252,113 +616,55 @@ def _element_to_bson(key, value, check_keys):
         if "." in key:
             raise InvalidDocument("key %r must not contain '.'" % key)
 
-    name = _make_c_string(key, True)
-    if isinstance(value, float):
-        return "\x01" + name + struct.pack("<d", value)
-
-    # Use Binary w/ subtype 3 for UUID instances
     try:
-        import uuid
-
-        if isinstance(value, uuid.UUID):
-            value = Binary(value.bytes, subtype=3)
-    except ImportError:
-        pass
-
-    if isinstance(value, Binary):
-        subtype = value.subtype
-        if subtype == 2:
-            value = struct.pack("<i", len(value)) + value
-        return "\x05%s%s%s%s" % (name, struct.pack("<i", len(value)),
-                                 chr(subtype), value)
-    if isinstance(value, Code):
-        cstring = _make_c_string(value)
-        scope = _dict_to_bson(value.scope, False, False)
-        full_length = struct.pack("<i", 8 + len(cstring) + len(scope))
-        length = struct.pack("<i", len(cstring))
-        return "\x0F" + name + full_length + length + cstring + scope
-    if isinstance(value, str):
-        cstring = _make_c_string(value)
-        length = struct.pack("<i", len(cstring))
-        return "\x02" + name + length + cstring
-    if isinstance(value, unicode):
-        cstring = _make_c_string(value)
-        length = struct.pack("<i", len(cstring))
-        return "\x02" + name + length + cstring
-    if isinstance(value, dict):
-        return "\x03" + name + _dict_to_bson(value, check_keys, False)
-    if isinstance(value, (list, tuple)):
-        as_dict = SON(zip([str(i) for i in range(len(value))], value))
-        return "\x04" + name + _dict_to_bson(as_dict, check_keys, False)
-    if isinstance(value, ObjectId):
-        return "\x07" + name + value.binary
-    if value is True:
-        return "\x08" + name + "\x01"
-    if value is False:
-        return "\x08" + name + "\x00"
-    if isinstance(value, (int, long)):
-        # TODO this is a really ugly way to check for this...
-        if value > 2 ** 64 / 2 - 1 or value < -2 ** 64 / 2:
-            raise OverflowError("BSON can only handle up to 8-byte ints")
-        if value > 2 ** 32 / 2 - 1 or value < -2 ** 32 / 2:
-            return "\x12" + name + struct.pack("<q", value)
-        return "\x10" + name + struct.pack("<i", value)
-    if isinstance(value, datetime.datetime):
-        if value.utcoffset() is not None:
-            value = value - value.utcoffset()
-        millis = int(calendar.timegm(value.timetuple()) * 1000 +
-                     value.microsecond / 1000)
-        return "\x09" + name + struct.pack("<q", millis)
-    if isinstance(value, Timestamp):
-        time = struct.pack("<I", value.time)
-        inc = struct.pack("<I", value.inc)
-        return "\x11" + name + inc + time
-    if value is None:
-        return "\x0A" + name
-    if isinstance(value, RE_TYPE):
-        pattern = value.pattern
-        flags = ""
-        if value.flags & re.IGNORECASE:
-            flags += "i"
-        if value.flags & re.LOCALE:
-            flags += "l"
-        if value.flags & re.MULTILINE:
-            flags += "m"
-        if value.flags & re.DOTALL:
-            flags += "s"
-        if value.flags & re.UNICODE:
-            flags += "u"
-        if value.flags & re.VERBOSE:
-            flags += "x"
-        return "\x0B" + name + _make_c_string(pattern, True) + \
-            _make_c_string(flags)
-    if isinstance(value, DBRef):
-        return _element_to_bson(key, value.as_doc(), False)
-    if isinstance(value, MinKey):
-        return "\xFF" + name
-    if isinstance(value, MaxKey):
-        return "\x7F" + name
-
-    raise InvalidDocument("cannot convert value of type %s to bson" %
-                          type(value))
+        name = _NAMES[key]
+    except KeyError:
+        name = _make_c_string(key, True)
+        if len(_NAMES) >= _MAX_NAMES:
+            _NAMES.clear()
+        _NAMES[key] = name
+    return _value_to_bson(name, value, check_keys)
+
+
+def _list_to_bson(value, check_keys):
+    elements = []
+    append = elements.append
+    names = _INDEX_NAMES
+    cached = len(names)
+    for (index, item) in enumerate(value):
+        if index < cached:
+            name = names[index]
+        else:
+            name = str(index) + "\x00"
+        append(_value_to_bson(name, item, check_keys))
+    elements = "".join(elements)
+    return _INT.pack(len(elements) + 5) + elements + "\x00"
 
 
 def _dict_to_bson(dict, check_keys, top_level=True):
+    if getattr(type(dict), "_raw_document", False):
+        return dict.raw
     try:
-        elements = ""
+        elements = []
+        append = elements.append
         if top_level and "_id" in dict:
-            elements += _element_to_bson("_id", dict["_id"], False)
+            append(_element_to_bson("_id", dict["_id"], False))
         for (key, value) in dict.iteritems():
             if not top_level or key != "_id":
-                elements += _element_to_bson(key, value, check_keys)
+                append(_element_to_bson(key, value, check_keys))
     except AttributeError:
         raise TypeError("encoder expected a mapping type but got: %r" % dict)
 
+    elements = "".join(elements)
     length = len(elements) + 5
     if length > 4 * 1024 * 1024:
         raise InvalidDocument("document too large - BSON documents are"
                               "limited to 4 MB")
-    return struct.pack("<i", length) + elements + "\x00"
+    return _INT.pack(length) + elements + "\x00"
+# The element encoders above always recurse into the pure version, so
+# that they can be used on their own (e.g. by apymongo.template) even
+# when the C extension is installed.
+_py_dict_to_bson = _dict_to_bson
 if _use_c:
     _dict_to_bson = _cbson._dict_to_bson
 
@@ -376,7 +682,7 @@ def _to_dicts(data, as_class=dict, tz_aware=True):
     return decode_all(data, as_class, tz_aware)
 
 
-def decode_all(data, as_class=dict, tz_aware=True):
+def decode_all(data, as_class=dict, tz_aware=True, offset=0, fields=None):
     """Decode BSON data to multiple documents.
 
     `data` must be a string of concatenated, valid, BSON-encoded
@@ -388,16 +694,55 @@ def decode_all(data, as_class=dict, tz_aware=True):
         documents
       - `tz_aware` (optional): if ``True``, return timezone-aware
         :class:`~datetime.datetime` instances
+      - `offset` (optional): position in `data` of the first
+        document, so that documents at the end of a larger buffer can
+        be decoded without slicing it first
+      - `fields` (optional): a list of key names to decode, or a dict
+        whose keys with true values are the names to decode. Names can
+        be dotted to reach into embedded documents and arrays. Other
+        elements are left out of the result, stepped over by their
+        lengths without being decoded.
+
+    If `as_class` is :class:`~bson.raw_bson.RawBSONDocument` the
+    documents are not decoded at all, just split apart, and `fields`
+    is ignored.
 
     .. versionadded:: 1.9
     """
+    if offset < 0 or offset > len(data):
+        raise ValueError("offset out of range")
+    raw = getattr(as_class, "_raw_document", False)
+    projection = None
+    if fields is not None:
+        projection = _projection(fields)
+
     docs = []
-    while len(data):
-        (doc, data) = _bson_to_dict(data, as_class, tz_aware)
-        docs.append(doc)
+    end = len(data)
+    while offset < end:
+        obj_end = _object_end(data, offset)
+        if raw:
+            docs.append(as_class(data[offset:obj_end + 1], tz_aware))
+        elif projection is None:
+            docs.append(_elements_to_dict(data, offset + 4, obj_end,
+                                          as_class, tz_aware))
+        else:
+            docs.append(_project_elements(data, offset + 4, obj_end,
+                                          as_class, tz_aware, projection))
+        offset = obj_end + 1
     return docs
 if _use_c:
-    decode_all = _cbson.decode_all
+    _decode_all = decode_all
+
+    def decode_all(data, as_class=dict, tz_aware=True, offset=0,
+                   fields=None):
+        if getattr(as_class, "_raw_document", False):
+            return _decode_all(data, as_class, tz_aware, offset)
+        projection = None
+        if fields is not None:
+            projection = _projection(fields)
+        return _cbson.decode_all(data, as_class, tz_aware, offset,
+                                 projection)
+    decode_all.__doc__ = _decode_all.__doc__
 
 
 def is_valid(bson):
@@ -457,8 +802,13 @@ class BSON(str):
             contain '.', raising :class:`~bson.errors.InvalidDocument` in
             either case
 
+        A :class:`~bson.raw_bson.RawBSONDocument` is passed through as
+        it is, without checking its keys.
+
         .. versionadded:: 1.9
         """
+        if getattr(type(document), "_raw_document", False):
+            return cls(document.raw)
         return cls(_dict_to_bson(document, check_keys))
 
     def to_dict(self, as_class=dict, tz_aware=False):
@@ -475,7 +825,7 @@ class BSON(str):
                       DeprecationWarning)
         return self.decode(as_class, tz_aware)
 
-    def decode(self, as_class=dict, tz_aware=False):
+    def decode(self, as_class=dict, tz_aware=False, fields=None):
         """Decode this BSON data.
 
         The default type to use for the resultant document is
@@ -495,10 +845,14 @@ class BSON(str):
             document
           - `tz_aware` (optional): if ``True``, return timezone-aware
             :class:`~datetime.datetime` instances
+          - `fields` (optional): only decode these keys, as for
+            :func:`decode_all`
 
         .. versionadded:: 1.9
         """
-        (document, _) = _bson_to_dict(self, as_class, tz_aware)
+        if getattr(as_class, "_raw_document", False):
+            return as_class(str(self), tz_aware)
+        (document, _) = _bson_to_dict(self, as_class, tz_aware, fields)
         return document
 
 
@@ -150,6 +150,45 @@ static int write_string(buffer_t buffer, PyObject* py_string) {
     return 1;
 }
 
+/* Is `value` a document that keeps its own BSON (e.g. a
+ * bson.raw_bson.RawBSONDocument)? Such classes set _raw_document. */
+static int is_raw_document(PyObject* value) {
+    int result;
+    PyObject* marker = PyObject_GetAttrString((PyObject*)Py_TYPE(value),
+                                              "_raw_document");
+    if (!marker) {
+        PyErr_Clear();
+        return 0;
+    }
+    result = PyObject_IsTrue(marker);
+    Py_DECREF(marker);
+    if (result == -1) {
+        PyErr_Clear();
+        return 0;
+    }
+    return result;
+}
+
+/* Copy the BSON of a raw document into the buffer as it is.
+ *
+ * returns 0 on failure */
+static int write_raw_document(buffer_t buffer, PyObject* document) {
+    int result;
+    PyObject* raw = PyObject_GetAttrString(document, "raw");
+    if (!raw) {
+        return 0;
+    }
+    if (!PyString_Check(raw)) {
+        PyErr_SetString(PyExc_TypeError, "raw document must be a str");
+        Py_DECREF(raw);
+        return 0;
+    }
+    result = buffer_write_bytes(buffer, PyString_AS_STRING(raw),
+                                (int)PyString_GET_SIZE(raw));
+    Py_DECREF(raw);
+    return result;
+}
+
 /* Get an error class from the bson.errors module.
  *
  * Returns a new ref */
@@ -594,6 +633,9 @@ static int write_element_to_buffer(buffer_t buffer, int type_byte, PyObject* val
     } else if (PyObject_IsInstance(value, MaxKey)) {
         *(buffer_get_buffer(buffer) + type_byte) = 0x7F;
         return 1;
+    } else if (is_raw_document(value)) {
+        *(buffer_get_buffer(buffer) + type_byte) = 0x03;
+        return write_raw_document(buffer, value);
     } else if (first_attempt) {
         /* Try reloading the modules and having one more go at it. */
         if (WARN(PyExc_RuntimeWarning, "couldn't encode - reloading python "
@@ -745,6 +787,9 @@ int write_dict(buffer_t buffer, PyObject* dict, unsigned char check_keys, unsign
     int length;
     int length_location;
 
+    if (!PyDict_Check(dict) && is_raw_document(dict)) {
+        return write_raw_document(buffer, dict);
+    }
     if (!PyDict_Check(dict)) {
         PyObject* errmsg = PyString_FromString("encoder expected a mapping type but got: ");
         PyObject* repr = PyObject_Repr(dict);
@@ -1234,6 +1279,229 @@ static PyObject* elements_to_dict(const char* string, int max,
     return dict;
 }
 
+/* Get the size of the value of type `type` at `position`, without
+ * decoding it. Returns -1 with InvalidBSON set if there is no value of
+ * that type there, or it runs past `max`. */
+static int value_size(const char* buffer, int position, int max, int type) {
+    int size;
+    switch (type) {
+    case 1:
+    case 9:
+    case 17:
+    case 18:
+        size = 8;
+        break;
+    case 2:
+    case 13:
+    case 14:
+        if (position + 4 > max) {
+            size = -1;
+            break;
+        }
+        memcpy(&size, buffer + position, 4);
+        size += 4;
+        break;
+    case 3:
+    case 4:
+    case 15:
+        if (position + 4 > max) {
+            size = -1;
+            break;
+        }
+        memcpy(&size, buffer + position, 4);
+        break;
+    case 5:
+        if (position + 4 > max) {
+            size = -1;
+            break;
+        }
+        memcpy(&size, buffer + position, 4);
+        size += 5;
+        break;
+    case 6:
+    case 10:
+    case -1:
+    case 127:
+        size = 0;
+        break;
+    case 7:
+        size = 12;
+        break;
+    case 8:
+        size = 1;
+        break;
+    case 11:
+        {
+            int pattern_length = strlen(buffer + position);
+            size = pattern_length + 1 +
+                strlen(buffer + position + pattern_length + 1) + 1;
+            break;
+        }
+    case 12:
+        if (position + 4 > max) {
+            size = -1;
+            break;
+        }
+        memcpy(&size, buffer + position, 4);
+        size += 4 + 12;
+        break;
+    case 16:
+        size = 4;
+        break;
+    default:
+        {
+            PyObject* InvalidBSON = _error("InvalidBSON");
+            PyErr_SetString(InvalidBSON, "unknown element type");
+            Py_DECREF(InvalidBSON);
+            return -1;
+        }
+    }
+    if (size < 0 || position + size > max) {
+        PyObject* InvalidBSON = _error("InvalidBSON");
+        PyErr_SetString(InvalidBSON, "not enough data for element");
+        Py_DECREF(InvalidBSON);
+        return -1;
+    }
+    return size;
+}
+
+static PyObject* project_elements(const char* string, int max,
+                                  PyObject* as_class, unsigned char tz_aware,
+                                  PyObject* projection);
+
+/* Apply `projection` to the embedded document or array of type `type`
+ * at `position`. Returns a new reference to None for any other type of
+ * value. */
+static PyObject* project_value(const char* buffer, int position, int max,
+                               int type, PyObject* as_class,
+                               unsigned char tz_aware, PyObject* projection) {
+    int size,
+        end;
+    PyObject* value;
+
+    if (type != 3 && type != 4) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    size = value_size(buffer, position, max, type);
+    if (size < 5) {
+        if (size != -1) {
+            PyObject* InvalidBSON = _error("InvalidBSON");
+            PyErr_SetString(InvalidBSON, "bad object or element length");
+            Py_DECREF(InvalidBSON);
+        }
+        return NULL;
+    }
+    if (type == 3) {
+        return project_elements(buffer + position + 4, size - 5,
+                                as_class, tz_aware, projection);
+    }
+
+    /* As on the server, projecting into an array projects each embedded
+     * document (or array) in it and drops everything else. */
+    value = PyList_New(0);
+    if (!value) {
+        return NULL;
+    }
+    end = position + size - 1;
+    position += 4;
+    while (position < end) {
+        PyObject* item;
+        int item_type = (int)buffer[position++];
+        int item_size;
+        position += strlen(buffer + position) + 1;
+        item_size = value_size(buffer, position, end, item_type);
+        if (item_size == -1) {
+            Py_DECREF(value);
+            return NULL;
+        }
+        item = project_value(buffer, position, end, item_type,
+                             as_class, tz_aware, projection);
+        if (!item) {
+            Py_DECREF(value);
+            return NULL;
+        }
+        if (item != Py_None && PyList_Append(value, item) == -1) {
+            Py_DECREF(item);
+            Py_DECREF(value);
+            return NULL;
+        }
+        Py_DECREF(item);
+        position += item_size;
+    }
+    return value;
+}
+
+/* Like elements_to_dict, but only decode the elements named in
+ * `projection` (a tree of dicts, as made by bson._projection), stepping
+ * over everything else by its length. */
+static PyObject* project_elements(const char* string, int max,
+                                  PyObject* as_class, unsigned char tz_aware,
+                                  PyObject* projection) {
+    int position = 0;
+    PyObject* dict = PyObject_CallObject(as_class, NULL);
+    if (!dict) {
+        return NULL;
+    }
+    while (position < max) {
+        int type = (int)string[position++];
+        int name_length = strlen(string + position);
+        int size;
+        PyObject* wanted;
+        PyObject* value = NULL;
+        PyObject* name = PyUnicode_DecodeUTF8(string + position, name_length, "strict");
+        if (!name) {
+            Py_DECREF(dict);
+            return NULL;
+        }
+        position += name_length + 1;
+        size = value_size(string, position, max, type);
+        if (size == -1) {
+            Py_DECREF(name);
+            Py_DECREF(dict);
+            return NULL;
+        }
+
+        wanted = PyDict_GetItem(projection, name);
+        if (wanted == Py_True) {
+            int value_position = position;
+            value = get_value(string, &value_position, type, as_class, tz_aware);
+        } else if (wanted && PyDict_Check(wanted) && PyDict_Size(wanted)) {
+            value = project_value(string, position, max, type, as_class,
+                                  tz_aware, wanted);
+        } else {
+            Py_INCREF(Py_None);
+            value = Py_None;
+            wanted = NULL;
+        }
+        if (!value) {
+            Py_DECREF(name);
+            Py_DECREF(dict);
+            return NULL;
+        }
+        if (wanted && (value != Py_None || wanted == Py_True) &&
+            PyObject_SetItem(dict, name, value) == -1) {
+            Py_DECREF(value);
+            Py_DECREF(name);
+            Py_DECREF(dict);
+            return NULL;
+        }
+        Py_DECREF(value);
+        Py_DECREF(name);
+        position += size;
+    }
+    return dict;
+}
+
+static PyObject* decode_elements(const char* string, int max,
+                                 PyObject* as_class, unsigned char tz_aware,
+                                 PyObject* projection) {
+    if (projection == Py_None) {
+        return elements_to_dict(string, max, as_class, tz_aware);
+    }
+    return project_elements(string, max, as_class, tz_aware, projection);
+}
+
 static PyObject* _cbson_bson_to_dict(PyObject* self, PyObject* args) {
     unsigned int size;
     Py_ssize_t total_size;
@@ -1244,8 +1512,14 @@ static PyObject* _cbson_bson_to_dict(PyObject* self, PyObject* args) {
     PyObject* dict;
     PyObject* remainder;
     PyObject* result;
+    PyObject* projection = Py_None;
 
-    if (!PyArg_ParseTuple(args, "OOb", &bson, &as_class, &tz_aware)) {
+    if (!PyArg_ParseTuple(args, "OOb|O", &bson, &as_class, &tz_aware,
+                          &projection)) {
+        return NULL;
+    }
+    if (projection != Py_None && !PyDict_Check(projection)) {
+        PyErr_SetString(PyExc_TypeError, "projection must be a dict");
         return NULL;
     }
 
@@ -1284,7 +1558,8 @@ static PyObject* _cbson_bson_to_dict(PyObject* self, PyObject* args) {
         return NULL;
     }
 
-    dict = elements_to_dict(string + 4, size - 5, as_class, tz_aware);
+    dict = decode_elements(string + 4, size - 5, as_class, tz_aware,
+                           projection);
     if (!dict) {
         return NULL;
     }
@@ -1308,8 +1583,15 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
     PyObject* result;
     PyObject* as_class = (PyObject*)&PyDict_Type;
     unsigned char tz_aware = 1;
+    Py_ssize_t offset = 0;
+    PyObject* projection = Py_None;
 
-    if (!PyArg_ParseTuple(args, "O|Ob", &bson, &as_class, &tz_aware)) {
+    if (!PyArg_ParseTuple(args, "O|ObnO", &bson, &as_class, &tz_aware,
+                          &offset, &projection)) {
+        return NULL;
+    }
+    if (projection != Py_None && !PyDict_Check(projection)) {
+        PyErr_SetString(PyExc_TypeError, "projection must be a dict");
         return NULL;
     }
 
@@ -1323,6 +1605,15 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
         return NULL;
     }
 
+    /* Start decoding `offset` bytes in, so callers holding a larger
+     * buffer (like a whole OP_REPLY) don't need to slice it first. */
+    if (offset < 0 || offset > total_size) {
+        PyErr_SetString(PyExc_ValueError, "offset out of range");
+        return NULL;
+    }
+    string += offset;
+    total_size -= offset;
+
     result = PyList_New(0);
 
     while (total_size > 0) {
@@ -1352,7 +1643,8 @@ static PyObject* _cbson_decode_all(PyObject* self, PyObject* args) {
             return NULL;
         }
 
-        dict = elements_to_dict(string + 4, size - 5, as_class, tz_aware);
+        dict = decode_elements(string + 4, size - 5, as_class, tz_aware,
+                               projection);
         if (!dict) {
             return NULL;
         }
@@ -0,0 +1,108 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tools for working with BSON documents without decoding them up front.
+"""
+
+from UserDict import DictMixin
+
+import bson
+
+
+class RawBSONDocument(DictMixin, object):
+    """A read-only document that keeps its BSON and decodes each value
+    only when it is looked up.
+
+    Pass this class as the `as_class` of a query (or of
+    :func:`bson.decode_all`) to skip decoding the documents up front.
+    Nothing is decoded until a key is accessed, and then only that
+    key's value; embedded documents come back as
+    :class:`RawBSONDocument` too. The original bytes are available as
+    :attr:`raw`, and :meth:`bson.BSON.encode` passes them through
+    untouched, so documents can be forwarded without being decoded at
+    all.
+    """
+
+    _raw_document = True
+
+    def __init__(self, bson_bytes, tz_aware=False):
+        """Wrap `bson_bytes`, a single BSON-encoded document.
+        """
+        self.__raw = bson_bytes
+        self.__tz_aware = tz_aware
+        self.__index = None
+
+    @property
+    def raw(self):
+        """The BSON bytes of this document.
+        """
+        return self.__raw
+
+    def __elements(self):
+        """Map each key to the type and position of its value, scanning
+        the document the first time it is needed.
+        """
+        if self.__index is None:
+            data = self.__raw
+            index = {}
+            keys = []
+            for (element_type, key, start, end) in bson._iter_elements(
+                    data, 4, len(data) - 1):
+                index[key] = (element_type, start, end)
+                keys.append(key)
+            self.__keys = keys
+            self.__index = index
+        return self.__index
+
+    def __getitem__(self, key):
+        (element_type, start, end) = self.__elements()[key]
+        if element_type == "\x03":
+            value = RawBSONDocument(self.__raw[start:end], self.__tz_aware)
+            if "$ref" not in value:
+                return value
+        return bson._element_getter[element_type](self.__raw, start, dict,
+                                                  self.__tz_aware)[0]
+
+    def __setitem__(self, key, value):
+        raise TypeError("RawBSONDocument is read-only")
+
+    def __delitem__(self, key):
+        raise TypeError("RawBSONDocument is read-only")
+
+    def keys(self):
+        self.__elements()
+        return list(self.__keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.__elements()
+
+    def has_key(self, key):
+        return key in self.__elements()
+
+    def __len__(self):
+        return len(self.__elements())
+
+    def __eq__(self, other):
+        if isinstance(other, RawBSONDocument):
+            return self.__raw == other.raw
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "RawBSONDocument(%r)" % (self.__raw,)
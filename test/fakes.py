@@ -0,0 +1,259 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Fake streams and replies for testing without a server."""
+
+import socket
+import struct
+
+import bson
+from apymongo.connection import Connection
+
+_QUERY = 2004
+_GET_MORE = 2005
+_OP_NAMES = {2001: "update", 2002: "insert", 2004: "query",
+             2005: "getmore", 2006: "delete", 2007: "killcursors"}
+
+
+def reply_body(docs, cursor_id=0, starting_from=0, flags=0):
+    """Get the body (everything after the header) of an OP_REPLY
+    holding `docs`.
+    """
+    return (struct.pack("<iqii", flags, cursor_id, starting_from, len(docs)) +
+            "".join([bson.BSON.encode(doc) for doc in docs]))
+
+
+def request_id(data):
+    """Get the request id of the message `data` starts with.
+    """
+    return struct.unpack_from("<i", data, 4)[0]
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.is_closed = False
+
+    def closed(self):
+        return self.is_closed
+
+    def close(self):
+        self.is_closed = True
+
+
+class ReplyStream(FakeStream):
+    """A stream whose reads are answered from replies fed to it.
+
+    If a `responder` is given it is called with everything written,
+    and the (response_to, body) pair it returns, if any, is replied
+    straight away.
+    """
+
+    def __init__(self, responder=None):
+        FakeStream.__init__(self)
+        self.responder = responder
+        self.written = []
+        self.buffer = ""
+        self.reads = []
+        self.close_callback = None
+        self.fail_writes = False
+
+    def set_close_callback(self, callback):
+        self.close_callback = callback
+
+    def write(self, data):
+        if self.fail_writes:
+            raise socket.error("broken pipe")
+        self.written.append(data)
+        if self.responder is not None:
+            reply = self.responder(data)
+            if reply is not None:
+                self.reply(*reply)
+
+    def read_bytes(self, n, callback):
+        # Like Tornado's, a closed stream can still be read from what
+        # was buffered before it closed.
+        if self.is_closed and len(self.buffer) < n:
+            raise IOError("stream is closed")
+        self.reads.append((n, callback))
+        self.__satisfy()
+
+    def reply(self, response_to, body, opcode=1):
+        self.buffer += struct.pack("<iiii", 16 + len(body), 0,
+                                   response_to, opcode) + body
+        self.__satisfy()
+
+    def __satisfy(self):
+        while self.reads and len(self.buffer) >= self.reads[0][0]:
+            (n, callback) = self.reads.pop(0)
+            (data, self.buffer) = (self.buffer[:n], self.buffer[n:])
+            callback(data)
+
+    def close(self):
+        FakeStream.close(self)
+        if self.close_callback is not None:
+            self.close_callback()
+
+
+def _cstring(data, position):
+    end = data.index("\x00", position)
+    return (data[position:end], end + 1)
+
+
+def _documents(data, position, end):
+    docs = []
+    while position < end:
+        size = struct.unpack_from("<i", data, position)[0]
+        docs.append(bson.BSON(data[position:position + size]).decode())
+        position += size
+    return docs
+
+
+def parse_messages(data):
+    """Split the messages in `data` into (operation, request_id,
+    namespace, documents) tuples, where `operation` is "insert",
+    "query", etc.
+
+    The documents of a getmore are its (limit, cursor_id) and those of
+    a killcursors the cursor ids.
+    """
+    messages = []
+    position = 0
+    while position < len(data):
+        (length, request_id, _, opcode) = struct.unpack_from("<iiii", data,
+                                                             position)
+        end = position + length
+        position += 20
+        namespace = None
+        if opcode == 2007:
+            count = struct.unpack_from("<i", data, position)[0]
+            docs = list(struct.unpack_from("<%dq" % count, data,
+                                           position + 4))
+        else:
+            (namespace, position) = _cstring(data, position)
+            if opcode == _QUERY:
+                position += 8
+            elif opcode == _GET_MORE:
+                docs = list(struct.unpack_from("<iq", data, position))
+            elif opcode in (2001, 2006):
+                position += 4
+            if opcode != _GET_MORE:
+                docs = _documents(data, position, end)
+        messages.append((_OP_NAMES[opcode], request_id, namespace, docs))
+        position = end
+    return messages
+
+
+def _reply(doc_or_error):
+    if isinstance(doc_or_error, basestring):
+        return reply_body([{"$err": doc_or_error}], flags=2)
+    return reply_body([doc_or_error])
+
+
+class FakeServer(object):
+    """Answers what is written to its streams like a standalone server
+    would.
+
+    A query on a namespace with `batches` set gets the first batch of
+    documents, and getmores get the following ones, the last with a
+    cursor id of 0. getlasterror commands are answered from
+    `last_errors` while there are any left, and with no error after
+    that; other commands are answered from `commands`, falling back to
+    ``{"ok": 1}``. In place of a batch or a command's response there
+    can be an error message string, which is passed back as a query
+    failure.
+
+    Everything but ``ismaster`` is recorded in `received`, and each
+    stream opened keeps the node it was opened to as `node`. While
+    `hold` is set, queries and getmores are not answered until
+    :meth:`release` is called.
+    """
+
+    def __init__(self):
+        self.batches = {}
+        self.commands = {}
+        self.last_errors = []
+        self.received = []
+        self.streams = []
+        self.hold = False
+        self.held = []
+
+    def connect(self, node, callback):
+        strm = ReplyStream(lambda data: self.__respond(strm, data))
+        strm.node = node
+        self.streams.append(strm)
+        callback(strm)
+
+    def release(self):
+        """Answer every message held back so far, oldest first.
+        """
+        held = self.held
+        self.held = []
+        for (strm, request_id, body) in held:
+            strm.reply(request_id, body)
+
+    def __respond(self, strm, data):
+        for (operation, request_id, namespace, docs) in parse_messages(data):
+            if operation == "query" and namespace.endswith(".$cmd"):
+                command = docs[0].keys()[0].lower()
+                if command == "ismaster":
+                    body = reply_body([{"ismaster": True, "ok": 1}])
+                else:
+                    self.received.append((operation, namespace, docs))
+                    body = _reply(self.__command(command))
+            elif operation in ("query", "getmore"):
+                self.received.append((operation, namespace, docs))
+                body = self.__batch(namespace, operation == "query")
+                if self.hold:
+                    self.held.append((strm, request_id, body))
+                    continue
+            else:
+                self.received.append((operation, namespace, docs))
+                continue
+            strm.reply(request_id, body)
+
+    def __command(self, command):
+        if command == "getlasterror":
+            if self.last_errors:
+                return self.last_errors.pop(0)
+            return {"err": None, "n": 0, "ok": 1}
+        return self.commands.get(command, {"ok": 1})
+
+    def __batch(self, namespace, first):
+        batches = self.batches.setdefault(namespace, [[]])
+        if first:
+            self.__starting_from = 0
+            self.__remaining = list(batches)
+        if not self.__remaining:
+            return reply_body([], flags=1)
+        batch = self.__remaining.pop(0)
+        if isinstance(batch, basestring):
+            return _reply(batch)
+        cursor_id = self.__remaining and 42 or 0
+        body = reply_body(batch, cursor_id, self.__starting_from)
+        self.__starting_from += len(batch)
+        return body
+
+
+class FakeConnection(Connection):
+    """A :class:`~apymongo.connection.Connection` whose streams all go
+    to `server`, a :class:`FakeServer`.
+    """
+
+    def __init__(self, server, **kwargs):
+        self.server = server
+        Connection.__init__(self, "fake", 27017, **kwargs)
+
+    def _Connection__connect(self, node, callback):
+        self.server.connect(node, callback)
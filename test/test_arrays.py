@@ -0,0 +1,177 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test decoding query results into NumPy arrays."""
+
+import datetime
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+from tornado.ioloop import IOLoop
+
+import bson
+from bson.objectid import ObjectId
+from apymongo import arrays
+from apymongo.errors import OperationFailure
+from test.fakes import FakeConnection, FakeServer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def build(schema, docs):
+    builder = arrays.ColumnBuilder(schema)
+    builder.add([bson.BSON.encode(doc) for doc in docs])
+    return builder.finish()
+
+
+class TestColumnBuilder(unittest.TestCase):
+
+    def setUp(self):
+        if numpy is None:
+            raise SkipTest("NumPy not installed")
+
+    def test_numbers(self):
+        columns = build({"i": "i4", "l": "i8", "f": "f8", "b": bool},
+                        [{"i": 1, "l": 2 ** 40, "f": 1.5, "b": True},
+                         {"i": -2, "l": 3, "f": -0.25, "b": False}])
+        self.assertEqual([1, -2], columns["i"].tolist())
+        self.assertEqual(numpy.dtype("i4"), columns["i"].dtype)
+        self.assertEqual([2 ** 40, 3], columns["l"].tolist())
+        self.assertEqual([1.5, -0.25], columns["f"].tolist())
+        self.assertEqual([True, False], columns["b"].tolist())
+        for column in columns.values():
+            self.failIf(column.mask.any())
+
+    def test_dates(self):
+        when = datetime.datetime(2011, 1, 1, 12, 30, 15, 250000)
+        columns = build({"ms": "datetime64[ms]", "s": "datetime64[s]"},
+                        [{"ms": when, "s": when}])
+        self.assertEqual(numpy.datetime64("2011-01-01T12:30:15.250"),
+                         columns["ms"][0])
+        self.assertEqual(numpy.datetime64("2011-01-01T12:30:15"),
+                         columns["s"][0])
+        self.assertEqual(numpy.dtype("datetime64[s]"), columns["s"].dtype)
+
+    def test_object_ids(self):
+        ids = [ObjectId(), ObjectId()]
+        columns = build({"_id": "V12"}, [{"_id": oid} for oid in ids])
+        self.assertEqual([oid.binary for oid in ids],
+                         [value.tostring() for value in columns["_id"]])
+
+    def test_missing(self):
+        columns = build({"a": "i4", "b.c": "f8"},
+                        [{"a": 1, "b": {"c": 2.5}},
+                         {"b": {}},
+                         {"a": 3},
+                         {"a": 4, "b": {"c": 5.0, "d": 1}}])
+        self.assertEqual([False, True, False, False],
+                         columns["a"].mask.tolist())
+        self.assertEqual([False, True, True, False],
+                         columns["b.c"].mask.tolist())
+        self.assertEqual([1, 3, 4], columns["a"].compressed().tolist())
+        self.assertEqual([2.5, 5.0], columns["b.c"].compressed().tolist())
+
+    def test_mixed_types(self):
+        # Values that don't fit the column are masked out.
+        columns = build({"n": "f8", "d": "datetime64[ms]", "o": "V12"},
+                        [{"n": 1, "d": 1, "o": u"x"},
+                         {"n": u"2", "d": datetime.datetime(2011, 1, 1),
+                          "o": ObjectId()},
+                         {"n": 2 ** 40, "d": None, "o": 1},
+                         {"n": True, "d": u"x", "o": {"a": 1}},
+                         {"n": {"x": 1}}])
+        self.assertEqual([1.0, 2.0 ** 40, 1.0],
+                         columns["n"].compressed().tolist())
+        self.assertEqual([False, True, False, False, True],
+                         columns["n"].mask.tolist())
+        self.assertEqual([True, False, True, True, True],
+                         columns["d"].mask.tolist())
+        self.assertEqual([True, False, True, True, True],
+                         columns["o"].mask.tolist())
+
+    def test_growth(self):
+        count = arrays._INITIAL_CAPACITY * 2 + 1
+        builder = arrays.ColumnBuilder({"i": "i4"})
+        builder.add([bson.BSON.encode({"i": i}) for i in range(count)])
+        builder.add([bson.BSON.encode({})])
+        column = builder.finish()["i"]
+        self.assertEqual(count + 1, len(column))
+        self.assertEqual(range(count), column.compressed().tolist())
+        self.assert_(column.mask[-1])
+
+    def test_bad_schema(self):
+        self.assertRaises(TypeError, arrays.ColumnBuilder, {})
+        self.assertRaises(TypeError, arrays.ColumnBuilder, [("a", "i4")])
+        self.assertRaises(TypeError, arrays.ColumnBuilder, {"a": "S10"})
+        self.assertRaises(TypeError, arrays.ColumnBuilder, {1: "i4"})
+        self.assertRaises(ValueError, arrays.ColumnBuilder,
+                          {"a": "i4", "a.b": "i4"})
+
+
+class TestToArrays(unittest.TestCase):
+
+    def setUp(self):
+        if numpy is None:
+            raise SkipTest("NumPy not installed")
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop)
+        self.collection = self.connection.test.things
+        self.results = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def test_batches(self):
+        self.server.batches["test.things"] = [
+            [{"x": 1, "y": 1.5}, {"x": 2}],
+            [{"y": 2.5, "z": u"skipped"}],
+            [{"x": 4, "y": 4.5}]]
+        self.collection.find().to_arrays({"x": "i8", "y": "f8"},
+                                         self.results.append)
+        (columns,) = self.results
+        self.assertEqual([1, 2, 4], columns["x"].compressed().tolist())
+        self.assertEqual([False, False, True, False],
+                         columns["x"].mask.tolist())
+        self.assertEqual([1.5, 2.5, 4.5], columns["y"].compressed().tolist())
+
+        # Only the fields in the schema are asked for.
+        (_, _, docs) = self.server.received[0]
+        self.assertEqual({"x": 1, "y": 1}, docs[1])
+        self.assertEqual(["query", "getmore", "getmore"],
+                         [operation for (operation, _, _)
+                          in self.server.received])
+
+    def test_error(self):
+        self.server.batches["test.things"] = [[{"x": 1}], "no good"]
+        self.collection.find().to_arrays({"x": "i8"}, self.results.append)
+        (error,) = self.results
+        self.assert_(isinstance(error, OperationFailure))
+
+    def test_bad_schema(self):
+        # Checked before anything is sent.
+        self.assertRaises(TypeError, self.collection.find().to_arrays,
+                          {"x": "S3"}, self.results.append)
+        self.assertEqual([], self.server.received)
+        self.assertEqual([], self.results)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test unordered bulk writes against a fake server."""
+
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from bson.errors import InvalidDocument
+from apymongo.errors import InvalidOperation, OperationFailure
+from apymongo.monitoring import OperationListener
+from test.fakes import FakeConnection, FakeServer
+
+
+class Recorder(OperationListener):
+
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append(("started", event))
+
+    def succeeded(self, event):
+        self.events.append(("succeeded", event))
+
+    def failed(self, event):
+        self.events.append(("failed", event))
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        # One stream, so a leaked one would hold up everything after.
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         max_pool_size=1)
+        self.collection = self.connection.test.things
+        self.results = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def operations(self):
+        return [(operation, docs) for (operation, _, docs)
+                in self.server.received]
+
+    def test_grouping(self):
+        bulk = self.collection.bulk()
+        bulk.insert({"_id": 1}).insert({"_id": 2})
+        bulk.update({"_id": 1}, {"$set": {"x": 1}})
+        bulk.insert({"_id": 3}).remove(2)
+        self.assertEqual(5, len(bulk))
+        bulk.execute(callback=self.results.append)
+
+        operations = self.operations()
+        self.assertEqual(["insert", "query", "update", "query",
+                          "insert", "query", "delete", "query"],
+                         [operation for (operation, _) in operations])
+        # Consecutive inserts share one message.
+        self.assertEqual([{"_id": 1}, {"_id": 2}], operations[0][1])
+        self.assertEqual([{"_id": 3}], operations[4][1])
+        self.assertEqual([{"_id": 2}], operations[6][1])
+        self.assertEqual("getlasterror", operations[1][1][0].keys()[0])
+
+    def test_results(self):
+        self.server.last_errors = [{"err": None, "n": 0, "ok": 1},
+                                   {"err": None, "n": 1, "ok": 1},
+                                   {"err": "no good", "code": 5, "ok": 1}]
+        bulk = self.collection.bulk()
+        bulk.insert({"_id": 1}).insert({"_id": 2})
+        bulk.update({"_id": 1}, {"$set": {"x": 1}})
+        bulk.remove(3)
+        bulk.execute(callback=self.results.append)
+
+        (results,) = self.results
+        self.assertEqual([1, 2], results[:2])
+        self.assertEqual(1, results[2]["n"])
+        self.assert_(isinstance(results[3], OperationFailure))
+        self.assertEqual(5, results[3].code)
+
+    def test_bad_last_error_response(self):
+        # Raised while checking the response, not passed back in it.
+        self.server.last_errors = ["bad"]
+        bulk = self.collection.bulk()
+        bulk.insert({"_id": 1}).remove(1)
+        bulk.execute(callback=self.results.append)
+
+        (results,) = self.results
+        self.assert_(isinstance(results[0], OperationFailure))
+        self.assertEqual({"err": None, "n": 0, "ok": 1}, results[1])
+
+        # The stream went back to the pool.
+        self.collection.find_one(callback=self.results.append)
+        self.assertEqual(2, len(self.results))
+
+    def test_events(self):
+        recorder = Recorder()
+        connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                    event_listeners=[recorder])
+        self.server.last_errors = [{"err": None, "n": 0, "ok": 1},
+                                   {"err": None, "n": 1, "ok": 1},
+                                   "bad"]
+        bulk = connection.test.things.bulk()
+        bulk.insert({"_id": 1}).insert({"_id": 2})
+        bulk.update({"_id": 1}, {"$set": {"x": 1}})
+        bulk.remove(1)
+        bulk.execute(callback=self.results.append)
+        connection.close()
+
+        # Every message goes out before any reply comes back.
+        self.assertEqual(["started"] * 3 + ["succeeded"] * 2 + ["failed"],
+                         [name for (name, _) in recorder.events])
+        events = [event for (name, event) in recorder.events[3:]]
+        self.assertEqual(["insert", "update", "delete"],
+                         [event.operation for event in events])
+        for event in events:
+            self.assertEqual("test.things", event.namespace)
+            self.assertNotEqual(None, event.encode_duration)
+            self.assert_(event.bytes_received > 0)
+        self.assert_(isinstance(events[2].failure, OperationFailure))
+
+    def test_invalid_document(self):
+        bulk = self.collection.bulk()
+        bulk.insert({"_id": 1}).insert({"$bad": 2})
+        self.assertRaises(InvalidDocument, bulk.execute,
+                          callback=self.results.append)
+        self.assertEqual([], self.server.received)
+        # Not marked executed, so it fails the same way again.
+        self.assertRaises(InvalidDocument, bulk.execute,
+                          callback=self.results.append)
+
+    def test_empty(self):
+        bulk = self.collection.bulk()
+        self.assertEqual(0, len(bulk))
+        self.assertRaises(InvalidOperation, bulk.execute,
+                          callback=self.results.append)
+        self.assertEqual([], self.server.received)
+
+    def test_executed_once(self):
+        bulk = self.collection.bulk().insert({"_id": 1})
+        bulk.execute(callback=self.results.append)
+        self.assertRaises(InvalidOperation, bulk.execute,
+                          callback=self.results.append)
+        self.assertEqual(1, len(self.results))
+
+
+if __name__ == "__main__":
+    unittest.main()
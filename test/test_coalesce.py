@@ -0,0 +1,116 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test coalescing unsafe inserts against a fake server."""
+
+import struct
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+import bson
+from apymongo import message
+from test.fakes import FakeConnection, FakeServer
+
+
+class TestCoalesce(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.results = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def connect(self, **kwargs):
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         coalesce_writes=True, **kwargs)
+        return self.connection.test.things
+
+    def run_once(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.io_loop.start()
+
+    def inserts(self):
+        return [[doc["_id"] for doc in docs]
+                for (operation, _, docs) in self.server.received
+                if operation == "insert"]
+
+    def test_flush_on_next_iteration(self):
+        collection = self.connect()
+        for i in range(1, 4):
+            collection.insert({"_id": i}, callback=self.results.append)
+        collection.insert([{"_id": 4}, {"_id": 5}],
+                          callback=self.results.append)
+        self.assertEqual([], self.server.received)
+
+        self.run_once()
+        self.assertEqual([[1, 2, 3, 4, 5]], self.inserts())
+        self.assertEqual([1, 2, 3, [4, 5]], self.results)
+
+    def test_flush_on_count(self):
+        collection = self.connect(max_batch_count=2)
+        for i in range(5):
+            collection.insert({"_id": i})
+        self.assertEqual([[0, 1], [2, 3]], self.inserts())
+        self.run_once()
+        self.assertEqual([[0, 1], [2, 3], [4]], self.inserts())
+
+    def test_flush_on_size(self):
+        size = len(bson.BSON.encode({"_id": 0}))
+        overhead = message._insert_overhead("test.things")
+        # One byte short of room for two documents and the rest of the
+        # message.
+        max_message_size = overhead + 2 * size - 1
+        collection = self.connect(max_message_size=max_message_size)
+        for i in range(3):
+            collection.insert({"_id": i})
+        self.run_once()
+        self.assertEqual([[0], [1], [2]], self.inserts())
+        for strm in self.server.streams:
+            for data in strm.written:
+                if struct.unpack_from("<i", data, 12)[0] == 2002:
+                    self.assert_(len(data) <= max_message_size)
+
+        self.connection.close()
+        self.server.received = []
+        collection = self.connect(max_message_size=max_message_size + 1)
+        for i in range(3):
+            collection.insert({"_id": i})
+        self.run_once()
+        self.assertEqual([[0, 1], [2]], self.inserts())
+
+    def test_flush_before_other_message(self):
+        collection = self.connect()
+        collection.insert({"_id": 1})
+        self.connection.test.others.insert({"_id": 2})
+        collection.insert({"_id": 3})
+        collection.find_one(callback=self.results.append)
+        # Every queue goes, oldest first, before the query is written.
+        self.assertEqual(["insert", "insert", "query"],
+                         [operation for (operation, _, _)
+                          in self.server.received])
+        self.assertEqual([[1, 3], [2]], self.inserts())
+
+        # Nothing is left to flush.
+        self.run_once()
+        self.assertEqual(3, len(self.server.received))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,6 +24,7 @@ sys.path[0:0] = [""]
 
 from nose.plugins.skip import SkipTest
 
+from tornado.ioloop import IOLoop
 from tornado.testing import AsyncTestCase
 
 from bson.son import SON
@@ -38,6 +39,7 @@ from apymongo.errors import (AutoReconnect,
                             InvalidURI,
                             OperationFailure)
 from test import version
+from test.fakes import FakeConnection, FakeServer
 
 
 def get_connection(*args, **kwargs):
@@ -68,24 +70,46 @@ class TestConnection(unittest.TestCase):
 
         Connection.HOST = "somedomainthatdoesntexist.org"
         Connection.PORT = 123456789
-        self.assertRaises(ConnectionFailure, Connection)
+        self.assert_(isinstance(self.connect_error(), ConnectionFailure))
         self.assert_(Connection(self.host, self.port))
 
         Connection.HOST = self.host
         Connection.PORT = self.port
         self.assert_(Connection())
 
+    def connect_error(self, *args):
+        """Get what a Connection that can't find a primary passes to
+        its callback.
+        """
+        io_loop = IOLoop(make_current=False)
+        results = []
+
+        def callback(result):
+            results.append(result)
+            io_loop.stop()
+
+        connection = Connection(io_loop=io_loop, callback=callback, *args)
+        if not results:
+            io_loop.add_timeout(time.time() + 10, io_loop.stop)
+            io_loop.start()
+        connection.close()
+        io_loop.close(all_fds=True)
+        return results[0]
+
     def test_connect(self):
-        self.assertRaises(ConnectionFailure, Connection,
-                          "somedomainthatdoesntexist.org")
-        self.assertRaises(ConnectionFailure, Connection, self.host, 123456789)
+        self.assert_(isinstance(
+                self.connect_error("somedomainthatdoesntexist.org"),
+                ConnectionFailure))
+        self.assert_(isinstance(self.connect_error(self.host, 123456789),
+                                ConnectionFailure))
 
         self.assert_(Connection(self.host, self.port))
 
     def test_host_w_port(self):
         self.assert_(Connection("%s:%d" % (self.host, self.port)))
-        self.assertRaises(ConnectionFailure, Connection,
-                          "%s:123456789" % self.host, self.port)
+        self.assert_(isinstance(
+                self.connect_error("%s:123456789" % self.host, self.port),
+                ConnectionFailure))
 
     def test_repr(self):
         self.assertEqual(repr(Connection(self.host, self.port)),
@@ -134,5 +158,42 @@ class TestConnectionAsync(AsyncTestCase):
         
 
 
+class TestLastError(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        # One stream, so a leaked one would hold up everything after.
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         max_pool_size=1)
+        self.results = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def test_error(self):
+        self.server.last_errors = [{"err": "no good", "code": 5, "ok": 1}]
+        self.connection.test.things.insert({"x": 1}, safe=True,
+                                           callback=self.results.append)
+        (error,) = self.results
+        self.assert_(isinstance(error, OperationFailure))
+        self.assertEqual(5, error.code)
+
+    def test_bad_response(self):
+        # Raised while checking the response, not passed back in it.
+        self.server.last_errors = [{"ok": 0, "errmsg": "boom"}]
+        self.connection.test.things.insert({"x": 1}, safe=True,
+                                           callback=self.results.append)
+        (error,) = self.results
+        self.assert_(isinstance(error, Exception))
+
+        # The stream went back to the pool.
+        self.connection.test.things.insert({"x": 2}, safe=True,
+                                           callback=self.results.append)
+        self.assertEqual(2, len(self.results))
+        self.assertFalse(isinstance(self.results[1], Exception))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,375 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test cursors against a fake server."""
+
+import sys
+import time
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from apymongo.errors import AutoReconnect, OperationFailure
+from apymongo.template import Param, QueryTemplate
+from test.fakes import FakeConnection, FakeServer
+
+
+class CursorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop)
+        self.collection = self.connection.test.things
+        self.batches = []
+        self.more = None
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def on_batch(self, batch, more):
+        self.batches.append(batch)
+        self.more = more
+
+    def operations(self):
+        return [operation for (operation, _, _) in self.server.received]
+
+    def values(self, batch):
+        return [doc["x"] for doc in batch]
+
+
+class TestQuerySpec(CursorTestCase):
+
+    def query(self):
+        (operation, _, docs) = self.server.received[-1]
+        self.assertEqual("query", operation)
+        return docs[0]
+
+    def test_wrapped_spec_not_changed(self):
+        spec = {"$query": {"x": 1}}
+        cursor = self.collection.find(spec=spec).sort("x").hint([("x", 1)])
+        cursor.each_batch(self.on_batch)
+        self.assertEqual({"$query": {"x": 1}}, spec)
+        self.assertEqual(SON([("$query", {"x": 1}), ("$orderby", {"x": 1}),
+                              ("$hint", {"x": 1})]), self.query())
+
+    def test_bound_template(self):
+        template = QueryTemplate({"$query": {"x": Param("x")}})
+        spec = template.bind(x=2)
+        self.collection.find(spec=spec).sort("x", -1).each_batch(self.on_batch)
+        self.assertEqual({"$query": {"x": 2}, "$orderby": {"x": -1}},
+                         self.query())
+
+        # Without modifiers the raw spec goes out as it is.
+        self.collection.find(spec=spec).each_batch(self.on_batch)
+        self.assertEqual({"$query": {"x": 2}}, self.query())
+
+
+class TestEachBatch(CursorTestCase):
+
+    def test_order(self):
+        self.server.batches["test.things"] = [[{"x": 1}, {"x": 2}],
+                                              [{"x": 3}], [{"x": 4}]]
+        self.collection.find().each_batch(self.on_batch)
+        self.assertEqual([[1, 2]], [self.values(b) for b in self.batches])
+        # Nothing more is asked for until the consumer wants it.
+        self.assertEqual(["query"], self.operations())
+
+        self.more()
+        self.assertEqual(["query", "getmore"], self.operations())
+        self.more()
+        self.assertEqual([[1, 2], [3], [4]],
+                         [self.values(b) for b in self.batches])
+        self.more()
+        self.assertEqual(None, self.batches[-1])
+        self.assertEqual(None, self.more)
+        self.assertEqual(["query", "getmore", "getmore"], self.operations())
+
+    def test_processor(self):
+        self.server.batches["test.things"] = [[{"x": 1}, {"x": 2}],
+                                              [{"x": 3}]]
+        def odd(doc, collection):
+            if doc["x"] % 2:
+                return doc
+        self.collection.find(processor=odd).each_batch(self.on_batch)
+        self.more()
+        self.more()
+        self.assertEqual([[1], [3], None],
+                         [b and self.values(b) for b in self.batches])
+
+    def test_no_results(self):
+        self.server.batches["test.things"] = [[]]
+        self.collection.find().each_batch(self.on_batch)
+        self.assertEqual([None], self.batches)
+        self.assertEqual(None, self.more)
+
+    def test_empty_batch(self):
+        # A batch the processor leaves nothing of is passed on while the
+        # cursor is alive, but an empty reply ends it.
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": -1}],
+                                              [{"x": 2}], []]
+        def positive(doc, collection):
+            if doc["x"] > 0:
+                return doc
+        self.collection.find(processor=positive).each_batch(self.on_batch)
+        while self.more is not None:
+            self.more()
+        self.assertEqual([[1], [], [2], None],
+                         [b and self.values(b) for b in self.batches])
+        self.assertEqual(4, len(self.server.received))
+
+    def test_last_batch_not_empty(self):
+        # The final batch is passed on before the end is signalled, and
+        # no more messages are sent.
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}]]
+        self.collection.find().each_batch(self.on_batch)
+        self.more()
+        self.assertEqual([2], self.values(self.batches[-1]))
+        self.assertNotEqual(None, self.more)
+        self.more()
+        self.assertEqual(None, self.batches[-1])
+        self.assertEqual(["query", "getmore"], self.operations())
+
+    def test_query_error(self):
+        self.server.batches["test.things"] = ["bad query"]
+        self.collection.find().each_batch(self.on_batch)
+        (error,) = self.batches
+        self.assert_(isinstance(error, OperationFailure))
+        self.assertEqual(None, self.more)
+
+    def test_getmore_error(self):
+        self.server.batches["test.things"] = [[{"x": 1}], "cursor not found"]
+        self.collection.find().each_batch(self.on_batch)
+        self.more()
+        self.assertEqual(2, len(self.batches))
+        self.assert_(isinstance(self.batches[1], OperationFailure))
+        self.assertEqual(None, self.more)
+        # No cursor is left to kill.
+        self.assertEqual(["query", "getmore"], self.operations())
+
+
+class TestRaw(CursorTestCase):
+
+    def test_byte_strings(self):
+        docs = [SON([("x", i), ("y", {"z": [i]})]) for i in range(3)]
+        self.server.batches["test.things"] = [docs[:2], docs[2:]]
+        seen = []
+        def processor(doc, collection):
+            seen.append(doc)
+            return RawBSONDocument(doc)
+        cursor = self.collection.find(raw=True, processor=processor)
+        cursor.each_batch(self.on_batch)
+        self.more()
+        self.more()
+        self.assertEqual([bson.BSON.encode(doc) for doc in docs], seen)
+        self.assertEqual([[0, 1], [2]],
+                         [self.values(b) for b in self.batches[:2]])
+        self.assertEqual(docs[2], dict(self.batches[1][0].iteritems()))
+        self.assertEqual(None, self.batches[2])
+
+
+class TestPrefetch(CursorTestCase):
+
+    def test_exhausted(self):
+        self.server.batches["test.things"] = [[{"x": 1}, {"x": 2}],
+                                              [{"x": 3}], [{"x": 4}]]
+        cursor = self.collection.find(prefetch=5)
+        cursor.each_batch(self.on_batch)
+        # The last reply has a cursor id of 0, so nothing more is asked
+        # for even though there is room for more batches.
+        self.assertEqual(["query", "getmore", "getmore"], self.operations())
+
+        while self.more is not None:
+            self.more()
+        self.assertEqual([[1, 2], [3], [4]],
+                         [self.values(b) for b in self.batches[:-1]])
+        self.assertEqual(None, self.batches[-1])
+        self.assertEqual(["query", "getmore", "getmore"], self.operations())
+
+    def test_prefetch_limit(self):
+        self.server.batches["test.things"] = [[{"x": i}] for i in range(5)]
+        cursor = self.collection.find(prefetch=2)
+        cursor.each_batch(self.on_batch)
+        self.assertEqual(["query", "getmore", "getmore"], self.operations())
+        # Using a batch makes room for one more.
+        self.more()
+        self.assertEqual(4, len(self.server.received))
+        self.assertEqual([[0], [1]], [self.values(b) for b in self.batches])
+
+    def test_error_in_flight(self):
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}],
+                                              "cursor went away"]
+        self.server.hold = True
+        cursor = self.collection.find(prefetch=1)
+        cursor.each_batch(self.on_batch)
+        self.server.release()
+        # The first getMore is in flight.
+        self.assertEqual([[1]], [self.values(b) for b in self.batches])
+        self.more()
+        self.assertEqual(1, len(self.batches))
+        self.server.release()
+        self.assertEqual([2], self.values(self.batches[1]))
+
+        # The next one fails while the consumer waits for it.
+        self.more()
+        self.assertEqual(2, len(self.batches))
+        self.server.release()
+        self.assert_(isinstance(self.batches[2], OperationFailure))
+        self.assertEqual(None, self.more)
+
+    def test_primary_lost_in_flight(self):
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}]]
+        self.server.hold = True
+        pool = self.connection._Connection__pool
+        cursor = self.collection.find(prefetch=1)
+        cursor.each_batch(self.on_batch)
+        self.server.release()
+        # The prefetched getMore's stream dies before its reply.
+        (strm,) = [s for s in self.server.streams if not s.closed()]
+        strm.close()
+        self.more()
+        self.assert_(isinstance(self.batches[-1], AutoReconnect))
+        # The connection was reset, as for any other read.
+        self.assert_(pool.closed)
+        self.assert_(pool is not self.connection._Connection__pool)
+
+    def test_error_after_ready_batches(self):
+        # Batches prefetched before the error are still used first.
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}],
+                                              [{"x": 3}], "no more"]
+        cursor = self.collection.find(prefetch=3)
+        cursor.each_batch(self.on_batch)
+        self.assertEqual(4, len(self.server.received))
+        while self.more is not None:
+            self.more()
+        self.assertEqual([[1], [2], [3]],
+                         [self.values(b) for b in self.batches[:3]])
+        self.assert_(isinstance(self.batches[3], OperationFailure))
+
+    def test_rewind(self):
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}]]
+        self.server.hold = True
+        cursor = self.collection.find(prefetch=1)
+        cursor.each_batch(self.on_batch)
+        self.server.release()
+        # A getMore is in flight when the cursor is rewound.
+        self.assertEqual(["query", "getmore"], self.operations())
+        cursor.rewind()
+        self.batches = []
+        self.server.batches["test.things"] = [[{"x": 3}], [{"x": 4}]]
+        cursor.each_batch(self.on_batch)
+
+        # Its reply comes in before the new query's, and is ignored.
+        self.server.release()
+        self.assertEqual([[3]], [self.values(b) for b in self.batches])
+        self.assertEqual(["query", "getmore", "query", "getmore"],
+                         self.operations())
+        self.server.release()
+        self.more()
+        self.assertEqual([[3], [4]], [self.values(b) for b in self.batches])
+        self.more()
+        self.assertEqual(None, self.batches[-1])
+
+    def test_close_in_flight(self):
+        self.server.batches["test.things"] = [[{"x": 1}], [{"x": 2}],
+                                              [{"x": 3}]]
+        self.server.hold = True
+        cursor = self.collection.find(prefetch=1)
+        cursor.each_batch(self.on_batch)
+        self.server.release()
+        self.assertEqual(["query", "getmore"], self.operations())
+
+        cursor.close()
+        self.assertEqual("killcursors", self.operations()[-1])
+        self.assertEqual([42], self.server.received[-1][2])
+        # The reply to the getMore is dropped, and nothing more is sent.
+        self.server.release()
+        self.assertEqual(1, len(self.batches))
+        self.assertEqual(3, len(self.server.received))
+
+        self.more()
+        self.assertEqual(None, self.batches[-1])
+
+
+class TestAdaptiveBatchSize(CursorTestCase):
+
+    def docs(self, count):
+        return [{"x": i} for i in range(count)]
+
+    def limits(self):
+        return [docs[0] for (operation, _, docs) in self.server.received
+                if operation == "getmore"]
+
+    def run_through(self, cursor):
+        cursor.each_batch(self.on_batch)
+        while self.more is not None:
+            self.more()
+
+    def test_growth(self):
+        self.server.batches["test.things"] = [self.docs(10), self.docs(20),
+                                              self.docs(40), self.docs(1)]
+        self.run_through(self.collection.find().adaptive_batch_size())
+        # At most doubling each time.
+        self.assertEqual([20, 40, 80], self.limits())
+
+    def test_target_bytes(self):
+        # Each of these documents is 12 bytes, and a reply's 20 byte
+        # header is shared among them.
+        self.server.batches["test.things"] = [self.docs(10), self.docs(1)]
+        self.run_through(self.collection.find().adaptive_batch_size(70))
+        self.assertEqual([5], self.limits())
+
+    def test_clamped(self):
+        # Never down to 1, which would close the cursor.
+        self.server.batches["test.things"] = [self.docs(10), self.docs(1)]
+        self.run_through(self.collection.find().adaptive_batch_size(1))
+        self.assertEqual([2], self.limits())
+
+    def test_shrink_when_slow(self):
+        self.server.batches["test.things"] = [self.docs(10), self.docs(1)]
+        self.server.hold = True
+        cursor = self.collection.find().adaptive_batch_size(max_latency=0.02)
+        cursor.each_batch(self.on_batch)
+        time.sleep(0.05)
+        self.server.hold = False
+        self.server.release()
+        self.more()
+        (limit,) = self.limits()
+        self.assert_(2 <= limit < 10)
+
+    def test_pool_wait_not_counted(self):
+        self.connection.close()
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         max_pool_size=1)
+        self.server.batches["test.things"] = [self.docs(10), self.docs(1)]
+        self.server.hold = True
+        # The only stream is busy until this is answered.
+        self.connection.test.others.find_one(callback=lambda _: None)
+        cursor = self.connection.test.things.find()
+        cursor.adaptive_batch_size(max_latency=0.02).each_batch(self.on_batch)
+        time.sleep(0.05)
+        self.server.hold = False
+        self.server.release()
+        self.assertEqual(1, len(self.batches))
+        self.more()
+        self.assertEqual([20], self.limits())
+
+
+if __name__ == "__main__":
+    unittest.main()
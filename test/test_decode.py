@@ -0,0 +1,161 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test decoding BSON with projections and offsets."""
+
+import datetime
+import struct
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+
+import bson
+from bson.binary import Binary
+from bson.code import Code
+from bson.dbref import DBRef
+from bson.errors import InvalidBSON
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.objectid import ObjectId
+from bson.son import SON
+from bson.timestamp import Timestamp
+
+# The pure Python decoder, even when the C extension is built.
+py_decode_all = getattr(bson, "_decode_all", bson.decode_all)
+
+
+class TestProjection(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = SON([("_id", 1),
+                        ("name", u"x"),
+                        ("sub", SON([("a", 1), ("b", 2)])),
+                        ("list", [{"a": 1, "b": 2}, 3, [{"a": 4}]]),
+                        ("ref", DBRef("coll", 5)),
+                        ("other", u"y")])
+        self.data = bson.BSON.encode(self.doc)
+        self.fields = ["name", "sub.b", "list.a", "ref.$id", "missing"]
+        self.expected = {"name": u"x",
+                         "sub": {"b": 2},
+                         "list": [{"a": 1}, [{"a": 4}]],
+                         "ref": {"$id": 5}}
+
+    def check(self, decode_all):
+        self.assertEqual([self.expected] * 2,
+                         decode_all(self.data * 2, dict, False, 0,
+                                    self.fields))
+        (doc,) = decode_all(self.data, SON, False, 0, self.fields)
+        self.assertEqual(["name", "sub", "list", "ref"], doc.keys())
+        self.assertEqual(self.expected, doc.to_dict())
+        self.assertEqual([{"sub": self.doc["sub"], "other": u"y"}],
+                         decode_all(self.data, dict, False, 0,
+                                    {"other": 1, "sub": True, "name": 0}))
+        # Names come back as unicode, as with a full decode.
+        (doc,) = decode_all(self.data, dict, False, 0, ["name"])
+        self.assert_(isinstance(doc.keys()[0], unicode))
+
+    def test_decode_all(self):
+        self.check(bson.decode_all)
+        self.assertEqual(self.expected,
+                         bson.BSON(self.data).decode(fields=self.fields))
+        self.assertRaises(TypeError, bson.decode_all, self.data, dict,
+                          False, 0, [1])
+
+    def test_decode_all_pure(self):
+        self.check(py_decode_all)
+
+    def test_decode_all_c(self):
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        (doc,) = bson.decode_all(self.data, fields=self.fields)
+        self.assertEqual(self.expected, doc)
+        self.assertEqual(self.expected,
+                         bson._bson_to_dict(self.data, dict, False,
+                                            self.fields)[0])
+
+
+class TestOffsets(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = SON([("_id", ObjectId()),
+                        ("int", 1),
+                        ("long", 2 ** 40),
+                        ("float", 1.5),
+                        ("text", u"h\xe9llo"),
+                        ("none", None),
+                        ("bool", True),
+                        ("date", datetime.datetime(2011, 1, 1, 12)),
+                        ("binary", Binary("\x00\x01", 5)),
+                        ("code", Code("f()")),
+                        ("scoped", Code("f(x)", {"x": 1})),
+                        ("timestamp", Timestamp(1, 2)),
+                        ("min", MinKey()),
+                        ("max", MaxKey()),
+                        ("sub", SON([("list", [1, [2], {"a": u"b"}])])),
+                        ("empty", [])])
+        self.data = bson.BSON.encode(self.doc)
+
+    def check(self, decode_all):
+        self.assertEqual([self.doc] * 3,
+                         decode_all(self.data * 3, SON, False))
+        # Decoding starts at the offset, without slicing it out first.
+        other = bson.BSON.encode({"other": 1})
+        self.assertEqual([self.doc],
+                         decode_all(other + self.data, SON, False,
+                                    len(other)))
+        self.assertEqual([], decode_all(self.data, dict, False,
+                                        len(self.data)))
+        self.assertRaises(ValueError, decode_all, self.data, dict, False,
+                          len(self.data) + 1)
+        self.assertRaises(ValueError, decode_all, self.data, dict, False,
+                          -1)
+        self.assertRaises(InvalidBSON, decode_all, self.data[:-3])
+        self.assertRaises(InvalidBSON, decode_all, self.data + "\x05")
+
+    def test_decode_all(self):
+        self.check(bson.decode_all)
+        (scoped,) = bson.decode_all(self.data, fields=["scoped"])
+        self.assertEqual({"x": 1}, scoped["scoped"].scope)
+
+    def test_decode_all_pure(self):
+        self.check(py_decode_all)
+        unknown = struct.pack("<i", 12) + "\x99a\x00\x01\x00\x00\x00\x00"
+        self.assertRaises(InvalidBSON, py_decode_all, unknown)
+
+    def test_projection_c(self):
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        # Every other type of element is stepped over in C as in Python.
+        for key in self.doc.keys() + ["sub.list", "sub.list.a"]:
+            self.assertEqual(py_decode_all(self.data, SON, False, 0, [key]),
+                             bson.decode_all(self.data, SON, False, 0, [key]))
+        unknown = struct.pack("<i", 12) + "\x99a\x00\x01\x00\x00\x00\x00"
+        self.assertRaises(InvalidBSON, bson.decode_all, unknown, dict, True,
+                          0, ["b"])
+        # A string's length running past the end of its document.
+        bad = struct.pack("<i", 15) + "\x02a\x00\x10\x00\x00\x00xy\x00\x00"
+        self.assertRaises(InvalidBSON, bson.decode_all, bad, dict, True, 0,
+                          ["b"])
+
+    def test_large_document(self):
+        # Each element used to copy the rest of the buffer.
+        doc = dict([("k%d" % i, u"x" * 10) for i in range(20000)])
+        (decoded,) = py_decode_all(bson.BSON.encode(doc))
+        self.assertEqual(doc, decoded)
+
+
+if __name__ == "__main__":
+    unittest.main()
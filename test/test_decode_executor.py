@@ -0,0 +1,203 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test decoding large replies in an executor."""
+
+import sys
+import threading
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from apymongo import helpers
+from apymongo.errors import (AutoReconnect,
+                             ConfigurationError,
+                             OperationFailure)
+from test.fakes import FakeConnection, FakeServer, reply_body
+
+
+class FakeFuture(object):
+    """Enough of a :class:`concurrent.futures.Future` for the connection.
+    """
+
+    def __init__(self):
+        self.__done = False
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+
+    def set_result(self, result):
+        self.__result = result
+        self.__finish()
+
+    def set_exception(self, error):
+        self.__error = error
+        self.__finish()
+
+    def __finish(self):
+        self.__done = True
+        for fn in self.__callbacks:
+            fn(self)
+
+    def result(self):
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+    def add_done_callback(self, fn):
+        if self.__done:
+            fn(self)
+        else:
+            self.__callbacks.append(fn)
+
+
+class FakeExecutor(object):
+    """Stands in for a :mod:`concurrent.futures` executor. Submitted
+    calls wait until :meth:`run` is called.
+    """
+
+    def __init__(self):
+        self.submitted = []
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        if self.shut_down:
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        future = FakeFuture()
+        self.submitted.append((future, fn, args))
+        return future
+
+    def run(self):
+        """Run everything submitted so far, on another thread.
+        """
+        def work():
+            for (future, fn, args) in submitted:
+                try:
+                    future.set_result(fn(*args))
+                except Exception, e:
+                    future.set_exception(e)
+        submitted = self.submitted
+        self.submitted = []
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+
+
+class TestDecodeExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.executor = FakeExecutor()
+        self.connection = None
+        self.results = []
+        self.threads = []
+
+    def tearDown(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def connect(self, decode_threshold=0):
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         decode_executor=self.executor,
+                                         decode_threshold=decode_threshold)
+        return self.connection
+
+    def callback(self, result):
+        self.results.append(result)
+        self.threads.append(threading.current_thread())
+
+    def run_once(self):
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.io_loop.start()
+
+    def test_bad_options(self):
+        self.assertRaises(TypeError, self.connect, "big")
+        self.assertRaises(ConfigurationError, self.connect, -1)
+        self.executor = object()
+        self.assertRaises(TypeError, self.connect)
+
+    def test_below_threshold(self):
+        response = reply_body([{"x": 1}])
+        self.connect(len(response) + 1)._unpack_response(response,
+                                                         self.callback)
+        self.assertEqual([], self.executor.submitted)
+        (result,) = self.results
+        self.assertEqual([{"x": 1}], result["data"])
+
+    def test_decoded_in_executor(self):
+        response = reply_body([{"x": 1}, {"x": 2}], cursor_id=42)
+        self.connect(len(response))._unpack_response(
+            response, self.callback, None, dict, False, False, ["x"])
+        ((_, fn, args),) = self.executor.submitted
+        self.assertEqual(helpers._unpack_response, fn)
+        self.assertEqual((response, None, dict, False, False, ["x"]), args)
+        self.assertEqual([], self.results)
+
+        # The result comes back through the IOLoop, not on the
+        # executor's thread.
+        self.executor.run()
+        self.assertEqual([], self.results)
+        self.run_once()
+        (result,) = self.results
+        self.assertEqual(42, result["cursor_id"])
+        self.assertEqual([{"x": 1}, {"x": 2}], result["data"])
+        self.assertEqual([threading.current_thread()], self.threads)
+
+    def test_error_reply(self):
+        connection = self.connect()
+        connection._unpack_response(reply_body([{"$err": "bad query"}],
+                                               flags=2), self.callback)
+        connection._unpack_response(reply_body([{"$err": "not master"}],
+                                               flags=2), self.callback)
+        connection._unpack_response(reply_body([], flags=1), self.callback,
+                                    42)
+        self.executor.run()
+        self.run_once()
+        self.assertEqual([OperationFailure, AutoReconnect, OperationFailure],
+                         [type(result) for result in self.results])
+        self.assertEqual([threading.current_thread()] * 3, self.threads)
+
+    def test_shut_down(self):
+        self.executor.shut_down = True
+        self.connect()._unpack_response(reply_body([{"x": 1}]),
+                                        self.callback)
+        (error,) = self.results
+        self.assert_(isinstance(error, RuntimeError))
+
+    def test_cursor(self):
+        self.server.batches["test.things"] = [[{"x": 1}], "cursor not found"]
+        collection = self.connect().test.things
+        batches = []
+        mores = []
+        def on_batch(batch, more):
+            batches.append(batch)
+            mores.append(more)
+        collection.find().each_batch(on_batch)
+        self.assertEqual([], batches)
+        self.executor.run()
+        self.run_once()
+        self.assertEqual([[{"x": 1}]], batches)
+
+        mores[-1]()
+        self.executor.run()
+        self.run_once()
+        self.assert_(isinstance(batches[-1], OperationFailure))
+        self.assertEqual(None, mores[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the type-dispatch BSON encoder."""
+
+import datetime
+import re
+import sys
+import unittest
+import uuid
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+
+import bson
+from bson.binary import Binary
+from bson.code import Code
+from bson.dbref import DBRef
+from bson.errors import InvalidDocument
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.objectid import ObjectId
+from bson.son import SON
+from bson.timestamp import Timestamp
+
+
+class MyInt(int):
+    pass
+
+
+class MyString(unicode):
+    pass
+
+
+class MyCode(Code):
+    pass
+
+
+class MyDict(dict):
+    pass
+
+
+def encode(doc, check_keys=False):
+    return bson._py_dict_to_bson(doc, check_keys)
+
+
+class TestEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = SON([("text", u"h\xe9llo"),
+                        ("bytes", "abc"),
+                        ("int", 1),
+                        ("long", 2 ** 40),
+                        ("float", -0.0),
+                        ("bool", False),
+                        ("none", None),
+                        ("date", datetime.datetime(2011, 1, 1, 12)),
+                        ("regex", re.compile("a.b", re.I)),
+                        ("binary", Binary("\x00\x01", 5)),
+                        ("uuid", uuid.UUID(int=1)),
+                        ("oid", ObjectId()),
+                        ("code", Code("f()")),
+                        ("scoped", Code("f(x)", {"x": 1})),
+                        ("ref", DBRef("coll", 1, "db")),
+                        ("timestamp", Timestamp(1, 2)),
+                        ("min", MinKey()),
+                        ("max", MaxKey()),
+                        ("tuple", (1, [2, {"a": 3}])),
+                        ("_id", 5)])
+
+    def test_round_trip(self):
+        data = encode(self.doc)
+        decoded = bson.BSON(data).decode(SON)
+        # The top level _id goes first.
+        self.assertEqual("_id", decoded.keys()[0])
+        self.assertEqual(5, decoded["_id"])
+        self.assertEqual(u"h\xe9llo", decoded["text"])
+        self.assertEqual([1, [2, {"a": 3}]], decoded["tuple"])
+        self.assertEqual(Code("f(x)", {"x": 1}), decoded["scoped"])
+        self.assertEqual(data, bson.BSON.encode(self.doc))
+
+    def test_subclasses(self):
+        for (value, plain) in [(MyInt(3), 3),
+                               (MyString(u"x"), u"x"),
+                               (MyCode("f()"), Code("f()")),
+                               (MyDict(a=1), {"a": 1})]:
+            self.assertEqual(encode({"v": plain}), encode({"v": value}))
+            # The encoder found is remembered for the type.
+            self.assert_(type(value) in bson._ENCODERS)
+            self.assertEqual(encode({"v": plain}), encode({"v": value}))
+
+    def test_unknown_type(self):
+        self.assertRaises(InvalidDocument, encode, {"v": object()})
+        self.failIf(object in bson._ENCODERS)
+
+    def test_keys(self):
+        self.assertRaises(InvalidDocument, encode, {1: "x"})
+        self.assertRaises(InvalidDocument, encode, {"a\x00b": 1})
+        self.assertRaises(InvalidDocument, encode, {"$a": 1}, True)
+        self.assertRaises(InvalidDocument, encode, {"a.b": 1}, True)
+        self.assertRaises(InvalidDocument, encode, {"x": {"$a": 1}}, True)
+        # Keys that were fine unchecked must still be checked later.
+        encode({"$a": 1, "a.b": 1})
+        self.assertRaises(InvalidDocument, encode, {"$a": 1}, True)
+        self.assertEqual(encode({u"k\xe9y": 1}),
+                         encode({u"k\xe9y".encode("utf-8"): 1}))
+
+    def test_long_list(self):
+        # Past the precomputed index names.
+        values = range(1500)
+        self.assertEqual({"list": values},
+                         bson.BSON(encode({"list": values})).decode())
+
+    def test_c(self):
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        self.assertEqual(bson._cbson._dict_to_bson(self.doc, False),
+                         encode(self.doc))
+        for value in [MyInt(3), MyString(u"x"), MyDict(a=1), 2 ** 62,
+                      -2 ** 31 - 1, [1, (2,)]]:
+            self.assertEqual(bson._cbson._dict_to_bson({"v": value}, False),
+                             encode({"v": value}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the helpers used by collections and cursors."""
+
+import datetime
+import struct
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+
+import bson
+from bson.errors import InvalidBSON
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+from bson.tz_util import utc
+from apymongo import helpers
+from apymongo.errors import OperationFailure
+from test.fakes import reply_body
+
+
+class TestSplitPoints(unittest.TestCase):
+
+    def test_numbers(self):
+        self.assertEqual([2.5, 5.0, 7.5], helpers._split_points(0, 10, 4))
+        self.assertEqual([0.5], helpers._split_points(0.0, 1.0, 2))
+        self.assertEqual([], helpers._split_points(0, 10, 1))
+        self.assertEqual([], helpers._split_points(5, 5, 4))
+
+    def test_object_ids(self):
+        start = datetime.datetime(2011, 1, 1, tzinfo=utc)
+        low = ObjectId.from_datetime(start)
+        high = ObjectId.from_datetime(start + datetime.timedelta(hours=3))
+        points = helpers._split_points(low, high, 3)
+        self.assertEqual([start + datetime.timedelta(hours=1),
+                          start + datetime.timedelta(hours=2)],
+                         [point.generation_time for point in points])
+
+    def test_narrow_object_id_range(self):
+        # Within one second, every split point would come before low.
+        stamp = ObjectId().binary[:4]
+        low = ObjectId(stamp + "\x00" * 7 + "\x01")
+        high = ObjectId(stamp + "\xff" * 8)
+        self.assertEqual([], helpers._split_points(low, high, 4))
+
+    def test_strictly_between(self):
+        for (low, high, count) in [(0, 1, 10), (10, 13, 2), (-5, 5, 3)]:
+            points = helpers._split_points(low, high, count)
+            self.assertEqual(sorted(set(points)), points)
+            for point in points:
+                self.assert_(low < point < high)
+
+    def test_other_types(self):
+        self.assertEqual([], helpers._split_points(u"a", u"z", 4))
+        self.assertEqual([], helpers._split_points(False, True, 4))
+        self.assertEqual([], helpers._split_points(0, ObjectId(), 4))
+
+
+class TestQueryShape(unittest.TestCase):
+
+    def test_values_replaced(self):
+        shape = helpers._query_shape(SON([("user", ObjectId()),
+                                          ("age", {"$gte": 18}),
+                                          ("name", u"x")]))
+        self.assertEqual(SON([("user", "<ObjectId>"),
+                              ("age", SON([("$gte", "<int>")])),
+                              ("name", "<unicode>")]), shape)
+        self.assertEqual(["user", "age", "name"], shape.keys())
+
+    def test_same_shape(self):
+        self.assertEqual(helpers._query_shape({"a": 1, "b": [1, 2]}),
+                         helpers._query_shape({"a": 2, "b": [3]}))
+        self.assertNotEqual(helpers._query_shape({"a": 1}),
+                            helpers._query_shape({"a": u"1"}))
+
+    def test_lists(self):
+        # The distinct shapes of the items, in the order first seen.
+        self.assertEqual({"$in": ["<int>", "<unicode>"]},
+                         helpers._query_shape({"$in": [1, u"a", 2, u"b"]}))
+        self.assertEqual({"$or": [{"a": "<int>"}, {"b": "<int>"}]},
+                         helpers._query_shape({"$or": [{"a": 1}, {"b": 2},
+                                                       {"a": 3}]}))
+        self.assertEqual({"$in": []}, helpers._query_shape({"$in": ()}))
+
+    def test_raw_document(self):
+        raw = RawBSONDocument(bson.BSON.encode({"a": 1, "b": {"c": u"d"}}))
+        self.assertEqual({"a": "<int>", "b": {"c": "<unicode>"}},
+                         helpers._query_shape(raw))
+
+
+class TestSplitDocuments(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = [bson.BSON.encode({"a": i, "b": u"x" * i})
+                     for i in range(3)]
+        self.data = "".join(self.docs)
+
+    def test_split(self):
+        self.assertEqual(self.docs, helpers._split_documents(self.data))
+        self.assertEqual([], helpers._split_documents(""))
+        self.assertEqual(self.docs[1:], helpers._split_documents(
+            "junk" + self.data, 4 + len(self.docs[0])))
+        self.assertEqual([], helpers._split_documents(self.data,
+                                                      len(self.data)))
+
+    def test_truncated(self):
+        for cut in (1, 4, 5, len(self.docs[-1]) - 1):
+            self.assertRaises(InvalidBSON, helpers._split_documents,
+                              self.data[:-cut])
+
+    def test_bad_size(self):
+        for size in (-1, 0, 4):
+            self.assertRaises(InvalidBSON, helpers._split_documents,
+                              struct.pack("<i", size) + self.data)
+        # Too big for what's left.
+        data = struct.pack("<i", len(self.data) + 5) + self.data
+        self.assertRaises(InvalidBSON, helpers._split_documents, data)
+
+
+class TestUnpackResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.docs = [SON([("_id", ObjectId()), ("n", i),
+                          ("sub", {"list": [i, u"x"]})]) for i in range(3)]
+
+    def test_raw(self):
+        response = reply_body(self.docs, cursor_id=42, starting_from=5)
+        result = helpers._unpack_response(response, raw=True)
+        self.assertEqual(42, result["cursor_id"])
+        self.assertEqual(5, result["starting_from"])
+        self.assertEqual(3, result["number_returned"])
+        self.assertEqual(len(response), result["length"])
+        self.assertEqual([bson.BSON.encode(doc) for doc in self.docs],
+                         result["data"])
+
+        # The byte strings can be wrapped and re-encoded unchanged.
+        raws = [RawBSONDocument(data) for data in result["data"]]
+        self.assertEqual(self.docs, [dict(raw.iteritems()) for raw in raws])
+        self.assertEqual(result["data"],
+                         [bson.BSON.encode(raw) for raw in raws])
+        self.assertEqual(helpers._unpack_response(response)["data"],
+                         [dict(raw.iteritems()) for raw in raws])
+
+    def test_raw_truncated(self):
+        response = reply_body(self.docs)
+        self.assertRaises(InvalidBSON, helpers._unpack_response,
+                          response[:-1], raw=True)
+
+    def test_raw_error(self):
+        # Errors are still decoded and raised.
+        response = reply_body([{"$err": "bad query"}], flags=2)
+        self.assertRaises(OperationFailure, helpers._unpack_response,
+                          response, raw=True)
+
+    def test_error_c(self):
+        # The C decoder takes no keyword arguments.
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        response = reply_body([{"$err": "bad query"}], flags=2)
+        decode_all = bson.decode_all
+        bson.decode_all = bson._cbson.decode_all
+        try:
+            self.assertRaises(OperationFailure, helpers._unpack_response,
+                              response)
+        finally:
+            bson.decode_all = decode_all
+
+
+if __name__ == "__main__":
+    unittest.main()
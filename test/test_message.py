@@ -0,0 +1,229 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test building wire protocol messages."""
+
+import datetime
+import struct
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+import bson
+from bson.errors import InvalidDocument
+from bson.son import SON
+from apymongo import message
+from apymongo.errors import InvalidOperation
+
+
+ZERO = "\x00\x00\x00\x00"
+
+
+def body(data):
+    """Everything in a single message but its length and request id.
+    """
+    return data[8:]
+
+
+class TestMessageCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = message._MessageCache(2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        self.assertEqual("1", cache.get("a"))
+        cache.put("c", "3")
+        self.assertEqual(2, len(cache))
+        self.assertEqual(None, cache.get("b"))
+        self.assertEqual("1", cache.get("a"))
+        self.assertEqual("3", cache.get("c"))
+
+    def test_put_existing(self):
+        cache = message._MessageCache(2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        # Replacing an entry counts as using it.
+        cache.put("a", "3")
+        cache.put("c", "4")
+        self.assertEqual(2, len(cache))
+        self.assertEqual(None, cache.get("b"))
+        self.assertEqual("3", cache.get("a"))
+
+    def test_many_uses(self):
+        cache = message._MessageCache(3)
+        for key in "abc":
+            cache.put(key, key.upper())
+        for _ in range(10):
+            self.assertEqual("A", cache.get("a"))
+            self.assertEqual("B", cache.get("b"))
+        cache.put("d", "D")
+        self.assertEqual(3, len(cache))
+        self.assertEqual(None, cache.get("c"))
+        cache.put("e", "E")
+        self.assertEqual(None, cache.get("a"))
+        self.assertEqual(["B", "D", "E"], [cache.get(key) for key in "bde"])
+
+    def test_commands(self):
+        command = SON([("count", "things"), ("query", {"x": 1})])
+        (first_id, first) = message.query(0, "db.$cmd", 0, -1, command)
+        (second_id, second) = message.query(0, "db.$cmd", 0, -1,
+                                            SON(command))
+        self.assertNotEqual(first_id, second_id)
+        self.assertEqual(struct.pack("<i", second_id), second[4:8])
+        self.assertEqual(body(first), body(second))
+
+        (_, other) = message.query(0, "db.$cmd", 0, -1,
+                                   SON([("count", "things"),
+                                        ("query", {"x": 2})]))
+        self.assertNotEqual(body(first), body(other))
+
+    def test_values_that_compare_equal(self):
+        for (a, b) in [(0.0, -0.0), (1, 1.0), (1, True), ("x", u"x")]:
+            (_, first) = message.query(0, "db.$cmd", 0, -1, {"v": a})
+            (_, second) = message.query(0, "db.$cmd", 0, -1, {"v": b})
+            self.assertEqual(bson.BSON.encode({"v": b}),
+                             second[-len(bson.BSON.encode({"v": b})):])
+            if bson.BSON.encode({"v": a}) != bson.BSON.encode({"v": b}):
+                self.assertNotEqual(body(first), body(second))
+
+    def test_uncacheable(self):
+        self.assertRaises(TypeError, message._freeze, {"v": object()})
+        # Commands holding such values are built, just not cached.
+        command = {"v": datetime.datetime(2011, 1, 1)}
+        encoded = bson.BSON.encode(command)
+        (_, data) = message.query(0, "db.$cmd", 0, -1, command)
+        self.assertEqual(encoded, data[-len(encoded):])
+
+
+def expected(opcode, *parts):
+    """The :func:`body` of a message for `opcode` made up of `parts`.
+    """
+    return struct.pack("<ii", 0, opcode) + "".join(parts)
+
+
+class TestBuilders(unittest.TestCase):
+
+    def check(self, msg, opcode, *parts):
+        (request_id, data) = msg
+        self.assertEqual(struct.pack("<ii", len(data), request_id), data[:8])
+        self.assertEqual(expected(opcode, *parts), body(data))
+
+    def test_insert(self):
+        docs = [{"i": 1}, {"s": "x" * 10}]
+        self.check(message.insert("db.c", docs, True, False, {}), 2002,
+                   ZERO, "db.c\x00",
+                   "".join([bson.BSON.encode(doc) for doc in docs]))
+        self.check(message.insert("db.c", docs[:1], True, False, {}, True),
+                   2002, struct.pack("<i", 1), "db.c\x00",
+                   bson.BSON.encode(docs[0]))
+
+    def test_insert_encoded(self):
+        encoded = [bson.BSON.encode({"i": i}) for i in range(3)]
+        self.check(message.insert_encoded("db.c", encoded), 2002,
+                   ZERO, "db.c\x00", "".join(encoded))
+
+    def test_update(self):
+        spec = {"_id": 1}
+        doc = {"$set": {"x": 2}}
+        self.check(message.update("db.c", True, True, spec, doc, False, {}),
+                   2001, ZERO, "db.c\x00", struct.pack("<i", 3),
+                   bson.BSON.encode(spec), bson.BSON.encode(doc))
+
+    def test_query(self):
+        spec = {"x": 1}
+        fields = {"x": 1, "_id": 0}
+        self.check(message.query(4, "db.c", 5, 10, spec), 2004,
+                   struct.pack("<I", 4), "db.c\x00",
+                   struct.pack("<ii", 5, 10), bson.BSON.encode(spec))
+        self.check(message.query(0, "db.c", 0, 0, spec, fields), 2004,
+                   ZERO, "db.c\x00", struct.pack("<ii", 0, 0),
+                   bson.BSON.encode(spec), bson.BSON.encode(fields))
+
+    def test_get_more(self):
+        self.check(message.get_more("db.c", 100, 2 ** 40), 2005,
+                   ZERO, "db.c\x00", struct.pack("<iq", 100, 2 ** 40))
+
+    def test_delete(self):
+        spec = {"x": {"$gt": 1}}
+        self.check(message.delete("db.c", spec, False, {}), 2006,
+                   ZERO, "db.c\x00", ZERO, bson.BSON.encode(spec))
+
+    def test_kill_cursors(self):
+        self.check(message.kill_cursors([1, 2 ** 40]), 2007,
+                   ZERO, struct.pack("<i", 2), struct.pack("<qq", 1, 2 ** 40))
+
+    def test_safe(self):
+        spec = {"_id": 1}
+        last_error = bson.BSON.encode(SON([("getlasterror", 1), ("w", 2)]))
+        for (request_id, data) in [
+                message.insert("db.c", [spec], True, True, {"w": 2}),
+                message.update("db.c", False, False, spec, spec,
+                               True, {"w": 2}),
+                message.delete("db.c", spec, True, {"w": 2})]:
+            # The write is followed by its getLastError, whose id is the
+            # one returned.
+            length = struct.unpack("<i", data[:4])[0]
+            self.check((request_id, data[length:]), 2004,
+                       ZERO, "admin.$cmd\x00", struct.pack("<ii", 0, -1),
+                       last_error)
+
+
+class TestInsertBatches(unittest.TestCase):
+
+    def batches(self, docs, safe=False, **kwargs):
+        return list(message.insert_batches("db.c", docs, True, safe, {},
+                                           **kwargs))
+
+    def test_split_by_count(self):
+        docs = [{"i": i} for i in range(5)]
+        batches = self.batches(docs, max_batch_count=2)
+        self.assertEqual([2, 2, 1], [count for (_, _, count) in batches])
+        for (request_id, data, count) in batches:
+            self.assertEqual(struct.pack("<i", len(data)), data[:4])
+            self.assertEqual(struct.pack("<i", request_id), data[4:8])
+
+        encoded = "".join([bson.BSON.encode(doc) for doc in docs[2:4]])
+        self.assert_(batches[1][1].endswith(encoded))
+
+    def test_split_by_size(self):
+        big = {"s": "x" * 100}
+        size = len(bson.BSON.encode(big))
+        batches = self.batches([big, big, {"s": "x" * 500}, big],
+                               max_message_size=2 * size + 30)
+        # The oversized document goes in a message of its own.
+        self.assertEqual([2, 1, 1], [count for (_, _, count) in batches])
+
+    def test_safe(self):
+        batches = self.batches([{"i": 1}, {"i": 2}], safe=True,
+                               max_batch_count=1)
+        for (request_id, data, _) in batches:
+            # Each insert is followed by its getLastError, whose id is
+            # the one returned.
+            length = struct.unpack("<i", data[:4])[0]
+            self.assertEqual(struct.pack("<i", request_id),
+                             data[length + 4:length + 8])
+            self.assert_("getlasterror" in data[length:])
+
+    def test_invalid_documents_raise_first(self):
+        docs = [{"i": 1}, {"i": 2}, {"$bad": 3}]
+        self.assertRaises(InvalidDocument, message.insert_batches,
+                          "db.c", docs, True, False, {}, False, 100, 1)
+        self.assertRaises(InvalidOperation, message.insert_batches,
+                          "db.c", [], True, False, {})
+        self.assertRaises(InvalidOperation, message.insert_batches,
+                          "db.c", iter([]), True, False, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
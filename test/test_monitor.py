@@ -0,0 +1,146 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the node monitor used by connections."""
+
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.testing import AsyncTestCase
+
+from apymongo.connection import Connection, _Monitor
+from apymongo.errors import AutoReconnect
+from test.fakes import (FakeConnection, FakeServer, ReplyStream,
+                        reply_body, request_id)
+
+
+class TestMonitor(AsyncTestCase):
+
+    def setUp(self):
+        super(TestMonitor, self).setUp()
+        self.connects = []
+        self.rounds = 0
+
+    def on_check(self):
+        self.rounds += 1
+
+    def refuse(self, node, callback):
+        self.connects.append(node)
+        callback(AutoReconnect("refused"))
+
+    def blackhole(self, node, callback):
+        self.connects.append(node)
+
+    def standalone(self, node, callback):
+        self.connects.append(node)
+        callback(ReplyStream(lambda data: (request_id(data),
+                                           reply_body([{"ismaster": True,
+                                                        "ok": 1}]))))
+
+    def wait_for(self, seconds):
+        self.io_loop.add_timeout(self.io_loop.time() + seconds, self.stop)
+        self.wait()
+
+    def test_connect_timeout(self):
+        nodes = set([("a", 1), ("b", 2)])
+        monitor = _Monitor(self.blackhole, nodes, self.io_loop, 60,
+                           self.stop, timeout=0.01)
+        monitor.start()
+        # The round finishes even though no connect ever returns.
+        self.wait()
+        self.assertEqual({("a", 1): None, ("b", 2): None}, monitor.roles)
+        self.assertEqual(None, monitor.primary)
+
+        # So the next round is not skipped.
+        monitor.check()
+        self.assertEqual(4, len(self.connects))
+        monitor.close()
+
+    def test_standalone_not_polled(self):
+        monitor = _Monitor(self.standalone, set([("a", 1)]), self.io_loop,
+                           0.01, self.on_check)
+        monitor.start()
+        self.wait_for(0.05)
+        self.assertEqual(1, self.rounds)
+        self.assertEqual(("a", 1), monitor.primary)
+        # Nor is its monitoring stream kept open.
+        self.assertEqual({}, monitor.dispatchers)
+
+        # Rounds can still be run by hand.
+        monitor.check()
+        self.assertEqual(2, self.rounds)
+        self.assertEqual(2, len(self.connects))
+        monitor.close()
+
+    def test_unreachable_node_polled(self):
+        # Until a primary turns up.
+        monitor = _Monitor(self.refuse, set([("a", 1)]), self.io_loop,
+                           0.01, self.on_check)
+        monitor.start()
+        self.wait_for(0.05)
+        self.assert_(self.rounds > 1)
+        monitor.close()
+
+    def test_several_nodes_polled(self):
+        monitor = _Monitor(self.refuse, set([("a", 1), ("b", 2)]),
+                           self.io_loop, 0.01, self.on_check)
+        monitor.start()
+        self.wait_for(0.05)
+        self.assert_(self.rounds > 1)
+        monitor.close()
+
+        rounds = self.rounds
+        self.wait_for(0.03)
+        self.assertEqual(rounds, self.rounds)
+
+
+class TestDiscovery(AsyncTestCase):
+
+    def test_no_primary(self):
+        # Nothing listens on port 1. Failing to find a primary must not
+        # raise out of the IOLoop.
+        connection = Connection("127.0.0.1", 1, io_loop=self.io_loop,
+                                heartbeat_interval=60)
+        self.io_loop.add_timeout(self.io_loop.time() + 0.1, self.stop)
+        self.wait()
+
+        connection.test.things.find_one(callback=self.stop)
+        self.assert_(isinstance(self.wait(), AutoReconnect))
+        connection.close()
+
+    def test_no_primary_callback(self):
+        Connection("127.0.0.1", 1, io_loop=self.io_loop,
+                   heartbeat_interval=60, callback=self.stop)
+        self.assert_(isinstance(self.wait(), AutoReconnect))
+
+    def test_failover_fills_pool(self):
+        server = FakeServer()
+        connection = FakeConnection(server, io_loop=self.io_loop,
+                                    min_pool_size=2)
+        other = ("other", 27017)
+        monitor = connection._Connection__monitor
+        monitor.roles[other] = "primary"
+        monitor.primary = other
+        connection._Connection__topology_checked()
+        self.assertEqual(other, (connection.host, connection.port))
+        # The new primary's pool is warmed up straight away, not at the
+        # next heartbeat.
+        self.assertEqual(2, len([strm for strm in server.streams
+                                 if strm.node == other]))
+        connection.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the operation events and histogram listener."""
+
+import sys
+import unittest
+import warnings
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from apymongo import message
+from apymongo.monitoring import (HistogramListener,
+                                 OperationFailedEvent,
+                                 OperationListener,
+                                 _Operation)
+from test.fakes import FakeConnection, FakeServer
+
+
+class Recorder(OperationListener):
+
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append(event)
+
+    def succeeded(self, event):
+        self.events.append(event)
+
+    def failed(self, event):
+        self.events.append(event)
+
+
+class TestMonitoring(unittest.TestCase):
+
+    def test_events(self):
+        recorder = Recorder()
+        query = message.query(0, "test.$cmd", 0, -1, {"ping": 1})
+        operation = _Operation([recorder], query, None)
+        operation.checked_out()
+        operation.received(100)
+        operation.succeeded()
+
+        (started, succeeded) = recorder.events
+        self.assertEqual("command", started.operation)
+        self.assertEqual("test.$cmd", started.namespace)
+        self.assertEqual(query[0], succeeded.request_id)
+        self.assertEqual(len(query[1]), succeeded.bytes_sent)
+        self.assertEqual(100, succeeded.bytes_received)
+        self.assert_(succeeded.duration >= succeeded.wire_duration)
+
+        operation = _Operation([recorder],
+                               message.kill_cursors([1, 2]), None)
+        operation.failed(ValueError())
+        self.assertEqual("killcursors", recorder.events[-1].operation)
+        self.assertEqual(None, recorder.events[-1].namespace)
+        self.assertEqual(None, recorder.events[-1].wire_duration)
+
+    def test_listener_errors_warn(self):
+
+        class Broken(OperationListener):
+
+            def started(self, event):
+                raise ValueError("broken")
+
+        operation = _Operation([Broken()],
+                               message.get_more("test.things", 0, 1), None)
+        warnings.simplefilter("error", RuntimeWarning)
+        try:
+            self.assertRaises(RuntimeWarning, operation.checked_out)
+        finally:
+            warnings.resetwarnings()
+
+    def test_histogram(self):
+        histograms = HistogramListener()
+        for i in range(1, 101):
+            operation = _Operation([histograms],
+                                   message.get_more("test.things", 0, 1),
+                                   None)
+            operation.checked_out()
+            operation.received(10)
+            operation.succeeded()
+            operation.duration = i / 1000.0
+            histograms.succeeded(operation)
+
+        summary = histograms.snapshot()["test.things"]
+        self.assertEqual(200, summary["count"])
+        self.assertEqual(0, summary["failures"])
+        self.assertEqual(2000, summary["bytes_received"])
+        # Half the durations are close to zero.
+        self.assert_(0.09 < summary["p99"] < 0.11)
+        self.assert_(summary["p50"] < 0.001)
+        self.assertEqual(None, histograms.percentile("test.other", 50))
+
+        histograms.reset()
+        self.assertEqual({}, histograms.snapshot())
+
+    def test_bad_last_error_response(self):
+        recorder = Recorder()
+        io_loop = IOLoop(make_current=False)
+        server = FakeServer()
+        server.last_errors = [{"ok": 0, "errmsg": "boom"}]
+        connection = FakeConnection(server, io_loop=io_loop,
+                                    event_listeners=[recorder])
+        results = []
+        try:
+            connection.test.things.insert({"x": 1}, safe=True,
+                                          callback=results.append)
+        finally:
+            connection.close()
+            io_loop.close(all_fds=True)
+
+        (started, failed) = recorder.events
+        self.assert_(isinstance(failed, OperationFailedEvent))
+        self.assertEqual(started.request_id, failed.request_id)
+        self.assertEqual("insert", failed.operation)
+        self.assertNotEqual(None, failed.duration)
+        self.assert_(failed.bytes_received > 0)
+        self.assert_(isinstance(failed.failure, Exception))
+        self.assert_(failed.failure is results[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test parallel collection scans against a fake server."""
+
+import struct
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from apymongo.read_preferences import ReadPreference
+from test.fakes import FakeConnection, FakeServer
+
+_SLAVE_OKAY = 4
+
+
+class TestParallelScan(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop)
+        self.collection = self.connection.test.things
+        self.results = []
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def query_flags(self):
+        """The flags of every query sent to test.things, in order.
+        """
+        flags = []
+        for strm in self.server.streams:
+            for data in strm.written:
+                if struct.unpack_from("<i", data, 12)[0] != 2004:
+                    continue
+                if data[20:].startswith("test.things\x00"):
+                    flags.append(struct.unpack_from("<i", data, 16)[0])
+        return flags
+
+    def test_read_preference(self):
+        self.server.batches["test.things"] = [[{"_id": 1}, {"_id": 2}]]
+        self.collection.parallel_scan(
+            4, callback=self.results.append,
+            read_preference=ReadPreference.PRIMARY_PREFERRED)
+        self.assertEqual([[{"_id": 1}, {"_id": 2}]], self.results)
+        # The two bounds and the scan itself.
+        flags = self.query_flags()
+        self.assertEqual(3, len(flags))
+        for flag in flags:
+            self.assert_(flag & _SLAVE_OKAY)
+
+    def test_default_read_preference(self):
+        self.server.batches["test.things"] = [[{"_id": 1}]]
+        self.collection.parallel_scan(4, callback=self.results.append)
+        self.assertEqual([[{"_id": 1}]], self.results)
+        flags = self.query_flags()
+        self.assertEqual(3, len(flags))
+        for flag in flags:
+            self.failIf(flag & _SLAVE_OKAY)
+
+
+if __name__ == "__main__":
+    unittest.main()
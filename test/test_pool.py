@@ -0,0 +1,311 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the stream pool used by connections."""
+
+import sys
+import time
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.testing import AsyncTestCase
+
+from apymongo.connection import _Pool, _StreamDispatcher
+from apymongo.errors import AutoReconnect, ConnectionFailure
+from test.fakes import FakeStream, ReplyStream
+
+
+def fake_factory(callback):
+    callback(FakeStream())
+
+
+class TestPool(AsyncTestCase):
+
+    def get_streams(self, pool, n):
+        streams = []
+        for _ in range(n):
+            pool.get_stream(streams.append)
+        return streams
+
+    def test_max_size(self):
+        pool = _Pool(fake_factory, self.io_loop, max_size=2)
+        streams = self.get_streams(pool, 3)
+        self.assertEqual(2, len(streams))
+        self.assertEqual(2, pool.size)
+        self.assertEqual(1, len(pool.waiters))
+
+        # The waiter gets the first stream to come back.
+        pool.return_stream(streams[0])
+        self.assertEqual(3, len(streams))
+        self.assert_(streams[2] is streams[0])
+
+    def test_reuse(self):
+        pool = _Pool(fake_factory, self.io_loop)
+        (first,) = self.get_streams(pool, 1)
+        pool.return_stream(first)
+        (second,) = self.get_streams(pool, 1)
+        self.assert_(first is second)
+        self.assertEqual(1, pool.size)
+
+    def test_closed_stream_discarded(self):
+        pool = _Pool(fake_factory, self.io_loop)
+        (first,) = self.get_streams(pool, 1)
+        first.close()
+        pool.return_stream(first)
+        self.assertEqual(0, pool.size)
+
+        (second,) = self.get_streams(pool, 1)
+        self.assert_(first is not second)
+
+    def test_pipelined(self):
+        pool = _Pool(fake_factory, self.io_loop, max_size=2, max_in_flight=3)
+        streams = self.get_streams(pool, 6)
+        self.assertEqual(6, len(streams))
+        self.assertEqual(2, len(set(streams)))
+        self.assertEqual(0, len(pool.waiters))
+
+        self.get_streams(pool, 1)
+        self.assertEqual(1, len(pool.waiters))
+
+    def test_wait_queue_timeout(self):
+        pool = _Pool(fake_factory, self.io_loop, max_size=1,
+                     wait_queue_timeout=0.01)
+        self.get_streams(pool, 1)
+
+        def callback(result):
+            self.assert_(isinstance(result, ConnectionFailure))
+            self.stop()
+
+        pool.get_stream(callback)
+        self.wait()
+        self.assertEqual(0, len(pool.waiters))
+
+    def test_fill(self):
+        pool = _Pool(fake_factory, self.io_loop, min_size=3)
+        results = []
+        pool.fill(results.append)
+        self.assertEqual([None], results)
+        self.assertEqual(3, pool.size)
+        self.assertEqual([0, 0, 0], pool.in_flight.values())
+
+        # Discarded streams are replaced to keep min_size open.
+        (strm,) = self.get_streams(pool, 1)
+        strm.close()
+        pool.return_stream(strm)
+        self.assertEqual(3, pool.size)
+
+    def test_reap(self):
+        pool = _Pool(fake_factory, self.io_loop, min_size=1,
+                     check_interval=60, max_idle_time=0)
+        (first, second) = self.get_streams(pool, 2)
+        pool.return_stream(first)
+        pool.return_stream(second)
+
+        # Idle streams are only evicted down to min_size.
+        pool.reap()
+        self.assertEqual(1, pool.size)
+        self.assertEqual({"idle": 1}, pool.evictions)
+
+        pool.max_lifetime = 0
+        pool.reap()
+        self.assertEqual(1, pool.size)
+        self.assertEqual({"idle": 1, "lifetime": 1}, pool.evictions)
+        pool.close()
+
+    def test_reap_ping(self):
+        answers = []
+
+        def ping(strm, callback):
+            answers.append(callback)
+
+        pool = _Pool(fake_factory, self.io_loop, check_interval=60, ping=ping)
+        (first, second) = self.get_streams(pool, 2)
+        pool.return_stream(first)
+        pool.return_stream(second)
+
+        # Only streams left idle since the last check get pinged.
+        pool.reap()
+        self.assertEqual([], answers)
+
+        pool.check_interval = 0
+        pool.reap()
+        self.assertEqual(2, len(answers))
+        self.assertEqual([1, 1], pool.in_flight.values())
+
+        answers[0](True)
+        answers[1](False)
+        self.assertEqual(1, pool.size)
+        self.assertEqual([0], pool.in_flight.values())
+        self.assertEqual({"ping": 1}, pool.evictions)
+        pool.close()
+
+    def pinging_pool(self, answers):
+        def ping(strm, callback):
+            answers.append(callback)
+
+        pool = _Pool(fake_factory, self.io_loop, max_size=1, max_in_flight=3,
+                     check_interval=60, ping=ping)
+        (strm,) = self.get_streams(pool, 1)
+        pool.return_stream(strm)
+        pool.check_interval = 0
+        pool.reap()
+        self.assertEqual(1, len(answers))
+        return (pool, strm)
+
+    def test_ping_not_shared(self):
+        answers = []
+        (pool, strm) = self.pinging_pool(answers)
+        # Pipelined requests don't share a stream being pinged.
+        results = []
+        pool.get_stream(results.append)
+        self.assertEqual([], results)
+        self.assertEqual(1, len(pool.waiters))
+
+        answers[0](True)
+        self.assertEqual([strm], results)
+        self.assertEqual([1], pool.in_flight.values())
+        pool.close()
+
+    def test_ping_timeout(self):
+        answers = []
+        (pool, strm) = self.pinging_pool(answers)
+        results = []
+        pool.get_stream(results.append)
+        self.io_loop.add_timeout(time.time() + 0.05, self.stop)
+        self.wait()
+        # Only the ping was using the stream when it was closed.
+        self.assert_(strm.closed())
+        self.assertEqual([], results)
+
+        answers[0](False)
+        (new,) = results
+        self.assert_(new is not strm)
+        self.failIf(new.closed())
+        self.assertEqual({"ping": 1}, pool.evictions)
+        pool.close()
+
+    def test_close(self):
+        pool = _Pool(fake_factory, self.io_loop, max_size=1)
+        (busy,) = self.get_streams(pool, 1)
+        results = []
+        pool.get_stream(results.append)
+        pool.close()
+        self.assert_(isinstance(results[0], ConnectionFailure))
+
+        self.failIf(busy.closed())
+        pool.return_stream(busy)
+        self.assert_(busy.closed())
+
+
+class TestStreamDispatcher(unittest.TestCase):
+
+    def test_routing(self):
+        strm = ReplyStream()
+        dispatcher = _StreamDispatcher(strm)
+        replies = []
+        for request_id in [1, 2, 3]:
+            dispatcher.send(request_id, "request %d" % request_id,
+                            lambda body, i=request_id:
+                            replies.append((i, body)))
+        self.assertEqual(["request 1", "request 2", "request 3"],
+                         strm.written)
+        # A single reader, whatever the number of requests in flight.
+        self.assertEqual(1, len(strm.reads))
+
+        # Replies go by responseTo, whatever order they come in.
+        strm.reply(2, "two")
+        strm.reply(3, "three")
+        self.assertEqual([(2, "two"), (3, "three")], replies)
+        strm.reply(1, "one")
+        self.assertEqual((1, "one"), replies[-1])
+        self.failIf(dispatcher.pending)
+        self.failIf(dispatcher.reading)
+        self.assertEqual([], strm.reads)
+
+        # A reply nobody is waiting for is dropped.
+        dispatcher.send(4, "request 4", lambda body: replies.append(body))
+        strm.reply(99, "stray")
+        strm.reply(4, "four")
+        self.assertEqual("four", replies[-1])
+
+    def test_send_from_callback(self):
+        strm = ReplyStream()
+        dispatcher = _StreamDispatcher(strm)
+        replies = []
+
+        def first(body):
+            replies.append(body)
+            dispatcher.send(2, "request 2", replies.append)
+
+        dispatcher.send(1, "request 1", first)
+        self.assertEqual(["request 1"], strm.written)
+        strm.reply(1, "one")
+        strm.reply(2, "two")
+        self.assertEqual(["one", "two"], replies)
+
+    def test_close_fails_pending(self):
+        strm = ReplyStream()
+        closed = []
+        dispatcher = _StreamDispatcher(strm, closed.append)
+        results = []
+        dispatcher.send(1, "request 1", results.append)
+        dispatcher.send(2, "request 2", results.append)
+        strm.close()
+        self.assertEqual([strm], closed)
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assert_(isinstance(result, AutoReconnect))
+        self.failIf(dispatcher.pending)
+
+    def test_reply_then_close(self):
+        strm = ReplyStream()
+        dispatcher = _StreamDispatcher(strm)
+        results = []
+        dispatcher.send(1, "request 1", results.append)
+        dispatcher.send(2, "request 2", results.append)
+        # The stream closes straight after the first reply, before its
+        # close callback has run.
+        strm.is_closed = True
+        strm.reply(1, "one")
+        self.assertEqual(2, len(results))
+        self.assert_("one" in results)
+        self.assert_([r for r in results if isinstance(r, AutoReconnect)])
+        self.failIf(dispatcher.pending)
+        self.failIf(dispatcher.reading)
+
+    def test_bad_opcode(self):
+        strm = ReplyStream()
+        dispatcher = _StreamDispatcher(strm)
+        results = []
+        dispatcher.send(1, "request 1", results.append)
+        dispatcher.send(2, "request 2", results.append)
+        strm.reply(1, "one", opcode=2004)
+        self.assert_(strm.closed())
+        self.assertEqual(2, len(results))
+        for result in results:
+            self.assert_(isinstance(result, AutoReconnect))
+
+    def test_write_error(self):
+        strm = ReplyStream()
+        strm.fail_writes = True
+        dispatcher = _StreamDispatcher(strm)
+        results = []
+        dispatcher.send(1, "request 1", results.append)
+        self.assert_(isinstance(results[0], AutoReconnect))
+        self.failIf(dispatcher.pending)
+        self.assertEqual([], strm.reads)
+
+
+if __name__ == "__main__":
+    unittest.main()
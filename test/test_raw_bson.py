@@ -0,0 +1,92 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the lazily decoded RawBSONDocument."""
+
+import datetime
+import re
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+
+import bson
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from bson.son import SON
+
+
+class TestRawBSONDocument(unittest.TestCase):
+
+    def setUp(self):
+        self.doc = SON([("_id", ObjectId()),
+                        ("number", 1),
+                        ("text", u"hello"),
+                        ("sub", {"list": [1, 2, {"q": None}]}),
+                        ("date", datetime.datetime(2011, 1, 1)),
+                        ("regex", re.compile("a.b")),
+                        ("ref", DBRef("coll", 1)),
+                        ("long", 2 ** 40)])
+        self.data = bson.BSON.encode(self.doc)
+
+    def test_decode_all(self):
+        raws = bson.decode_all(self.data * 2, RawBSONDocument)
+        self.assertEqual(2, len(raws))
+        self.assertEqual(self.data, raws[1].raw)
+        self.assertEqual(self.doc.keys(), raws[0].keys())
+
+    def test_values(self):
+        raw = bson.BSON(self.data).decode(RawBSONDocument)
+        full = bson.BSON(self.data).decode()
+        self.assertEqual(full, dict(raw.iteritems()))
+        self.assert_(isinstance(raw["sub"], RawBSONDocument))
+        self.assert_(isinstance(raw["ref"], DBRef))
+        self.assertRaises(KeyError, lambda: raw["missing"])
+        self.failIf("missing" in raw)
+
+    def test_encode(self):
+        raw = bson.BSON(self.data).decode(RawBSONDocument)
+        self.assertEqual(self.data, bson.BSON.encode(raw))
+        self.assertEqual(bson.BSON.encode(SON([("wrapped", self.doc)])),
+                         bson.BSON.encode(SON([("wrapped", raw)])))
+
+    def test_encode_nested(self):
+        raw = RawBSONDocument(self.data)
+        expected = bson._py_dict_to_bson(SON([("$query", self.doc),
+                                              ("list", [self.doc])]), False)
+        wrapped = SON([("$query", raw), ("list", [raw])])
+        self.assertEqual(expected, bson._py_dict_to_bson(wrapped, False))
+        self.assertEqual(expected, bson.BSON.encode(wrapped))
+
+    def test_encode_c(self):
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        raw = RawBSONDocument(self.data)
+        self.assertEqual(self.data, bson._cbson._dict_to_bson(raw, False))
+        wrapped = SON([("$query", raw), ("list", [raw])])
+        self.assertEqual(bson._py_dict_to_bson(wrapped, False),
+                         bson._cbson._dict_to_bson(wrapped, False))
+
+    def test_read_only(self):
+        raw = RawBSONDocument(self.data)
+
+        def assign():
+            raw["number"] = 2
+        self.assertRaises(TypeError, assign)
+
+
+if __name__ == "__main__":
+    unittest.main()
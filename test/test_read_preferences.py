@@ -0,0 +1,132 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test choosing a member with a read preference."""
+
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from apymongo.errors import AutoReconnect
+from apymongo.read_preferences import ReadPreference, select_node
+from test.fakes import FakeConnection, FakeServer
+
+PRIMARY = ("a", 27017)
+NEAR = ("b", 27017)
+FAR = ("c", 27017)
+RTTS = {PRIMARY: 0.001, NEAR: 0.002, FAR: 0.100}
+
+
+def select(mode, primary=PRIMARY, secondaries=[NEAR, FAR]):
+    return select_node(mode, primary, secondaries, RTTS, 0.015)
+
+
+class TestReadPreferences(unittest.TestCase):
+
+    def test_primary(self):
+        self.assertEqual(PRIMARY, select(ReadPreference.PRIMARY))
+        self.assertEqual(None, select(ReadPreference.PRIMARY, primary=None))
+
+    def test_primary_preferred(self):
+        self.assertEqual(PRIMARY, select(ReadPreference.PRIMARY_PREFERRED))
+        self.assertEqual(NEAR, select(ReadPreference.PRIMARY_PREFERRED,
+                                      primary=None))
+
+    def test_secondary(self):
+        for _ in range(20):
+            self.assertEqual(NEAR, select(ReadPreference.SECONDARY))
+        self.assertEqual(None, select(ReadPreference.SECONDARY,
+                                      secondaries=[]))
+        self.assertEqual(PRIMARY, select(ReadPreference.SECONDARY_PREFERRED,
+                                         secondaries=[]))
+
+    def test_nearest(self):
+        seen = set([select(ReadPreference.NEAREST) for _ in range(100)])
+        self.assertEqual(set([PRIMARY, NEAR]), seen)
+
+
+class TestRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.server.batches["test.things"] = [[{"x": 1}]]
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop)
+        self.collection = self.connection.test.things
+        self.batches = []
+
+        # Open a stream to the primary, and leave it in its pool.
+        self.collection.find().each_batch(self.on_batch)
+        self.primary_streams = self.streams(("fake", 27017))
+        self.assertEqual(1, len(self.primary_streams))
+
+    def tearDown(self):
+        self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def on_batch(self, batch, more):
+        self.batches.append(batch)
+
+    def streams(self, node):
+        return [strm for strm in self.server.streams
+                if strm.node == node and not strm.closed()]
+
+    def add_secondary(self):
+        monitor = self.connection._Connection__monitor
+        monitor.roles[NEAR] = "secondary"
+        monitor.rtts[NEAR] = 0.002
+
+    def find(self, mode):
+        self.collection.find(read_preference=mode).each_batch(self.on_batch)
+
+    def assertPrimaryOpen(self):
+        for strm in self.primary_streams:
+            self.assertFalse(strm.closed())
+
+    def test_secondary_read(self):
+        self.add_secondary()
+        self.find(ReadPreference.SECONDARY)
+        self.assertEqual([{"x": 1}], self.batches[-1])
+        self.assertEqual(1, len(self.streams(NEAR)))
+        self.assertEqual(self.primary_streams,
+                         self.streams(("fake", 27017)))
+
+    def test_no_secondary(self):
+        self.find(ReadPreference.SECONDARY)
+        self.assert_(isinstance(self.batches[-1], AutoReconnect))
+        self.assertPrimaryOpen()
+
+    def test_secondary_fails(self):
+        self.add_secondary()
+        self.server.hold = True
+        self.find(ReadPreference.SECONDARY)
+        (strm,) = self.streams(NEAR)
+        strm.close()
+        self.assert_(isinstance(self.batches[-1], AutoReconnect))
+        self.assertPrimaryOpen()
+
+        # The next read to the member goes down a new stream.
+        self.server.hold = False
+        self.find(ReadPreference.SECONDARY)
+        self.assertEqual([{"x": 1}], self.batches[-1])
+        self.assertEqual(1, len(self.streams(NEAR)))
+        self.assertEqual(2, len([s for s in self.server.streams
+                                 if s.node == NEAR]))
+        self.assertPrimaryOpen()
+
+
+if __name__ == "__main__":
+    unittest.main()
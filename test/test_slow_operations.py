@@ -0,0 +1,149 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test the slow operation log against a fake server."""
+
+import datetime
+import sys
+import time
+import unittest
+sys.path[0:0] = [""]
+
+from tornado.ioloop import IOLoop
+
+from bson.son import SON
+from apymongo.errors import ConfigurationError
+from test.fakes import FakeConnection, FakeServer
+
+
+class TestSlowOperations(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = IOLoop(make_current=False)
+        self.server = FakeServer()
+        self.connection = None
+        self.results = []
+
+    def tearDown(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.io_loop.close(all_fds=True)
+
+    def connect(self, **kwargs):
+        self.connection = FakeConnection(self.server, io_loop=self.io_loop,
+                                         **kwargs)
+        return self.connection
+
+    def test_bad_options(self):
+        self.assertRaises(TypeError, self.connect, slow_op_threshold_ms="1")
+        self.assertRaises(ConfigurationError, self.connect,
+                          slow_op_threshold_ms=-1)
+        self.assertRaises(TypeError, self.connect, slow_op_log_size=1.5)
+        self.assertRaises(ConfigurationError, self.connect,
+                          slow_op_log_size=0)
+
+    def test_threshold(self):
+        connection = self.connect()
+        self.assertEqual(None, connection.slow_op_threshold_ms)
+        self.failIf(connection._is_slow(1000))
+        connection.close()
+
+        connection = self.connect(slow_op_threshold_ms=10)
+        self.assertEqual(10, connection.slow_op_threshold_ms)
+        self.failIf(connection._is_slow(0.009))
+        self.assert_(connection._is_slow(0.01))
+        self.assert_(connection._is_slow(0.5))
+
+    def test_off_by_default(self):
+        self.server.hold = True
+        self.connect().test.things.find_one(callback=self.results.append)
+        time.sleep(0.02)
+        self.server.release()
+        self.assertEqual(1, len(self.results))
+        self.assertEqual([], self.connection.slow_operations())
+
+    def test_only_slow(self):
+        collection = self.connect(slow_op_threshold_ms=20).test.things
+        collection.find_one(callback=self.results.append)
+        self.assertEqual([], self.connection.slow_operations())
+
+        self.server.hold = True
+        collection.find_one(callback=self.results.append)
+        time.sleep(0.03)
+        self.server.release()
+        (entry,) = self.connection.slow_operations()
+        self.assert_(entry["millis"] >= 20)
+
+    def test_entry(self):
+        self.server.batches["test.things"] = [[{"x": 1}, {"x": 2}],
+                                              [{"x": 3}]]
+        collection = self.connect(slow_op_threshold_ms=0).test.things
+        before = datetime.datetime.utcnow()
+        batches = []
+        mores = []
+        def on_batch(batch, more):
+            batches.append(batch)
+            mores.append(more)
+        cursor = collection.find(spec={"x": {"$gt": 0}, "y": u"a"})
+        cursor.sort("x").hint([("x", 1)]).each_batch(on_batch)
+        mores[-1]()
+        after = datetime.datetime.utcnow()
+
+        (query, getmore) = self.connection.slow_operations()
+        self.assertEqual("query", query["op"])
+        self.assertEqual("getmore", getmore["op"])
+        for entry in (query, getmore):
+            self.assertEqual("test.things", entry["ns"])
+            self.assertEqual({"x": {"$gt": "<int>"}, "y": "<unicode>"},
+                             entry["query"])
+            self.assertEqual(SON([("x", 1)]), entry["orderby"])
+            self.assertEqual(SON([("x", 1)]), entry["hint"])
+            self.assert_(before <= entry["ts"] <= after)
+            self.assert_(entry["millis"] >= 0)
+        self.assertEqual(2, query["nreturned"])
+        self.assertEqual(1, getmore["nreturned"])
+        self.assertEqual(1, query["batches"])
+        self.assertEqual(2, getmore["batches"])
+
+    def test_command(self):
+        connection = self.connect(slow_op_threshold_ms=0)
+        connection.test.command("ping", callback=self.results.append)
+        (entry,) = connection.slow_operations()
+        self.assertEqual("command", entry["op"])
+        self.assertEqual("test.$cmd", entry["ns"])
+        self.assertEqual({"ping": "<int>"}, entry["query"])
+        self.assertEqual(None, entry["orderby"])
+        self.assertEqual(None, entry["hint"])
+
+    def test_oldest_dropped(self):
+        connection = self.connect(slow_op_threshold_ms=0, slow_op_log_size=3)
+        for i in range(5):
+            connection.test["c%d" % i].find_one(callback=self.results.append)
+        self.assertEqual(["test.c2", "test.c3", "test.c4"],
+                         [entry["ns"] for entry in
+                          connection.slow_operations()])
+
+        # The log is a copy.
+        connection.slow_operations().pop()
+        self.assertEqual(3, len(connection.slow_operations()))
+
+        connection.clear_slow_operations()
+        self.assertEqual([], connection.slow_operations())
+        connection.test.c5.find_one(callback=self.results.append)
+        self.assertEqual(["test.c5"], [entry["ns"] for entry in
+                                       connection.slow_operations()])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test precompiled query templates."""
+
+import sys
+import unittest
+sys.path[0:0] = [""]
+
+from nose.plugins.skip import SkipTest
+
+import bson
+from bson.objectid import ObjectId
+from bson.son import SON
+from apymongo import message
+from apymongo.template import Param, QueryTemplate
+
+
+class TestQueryTemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.template = QueryTemplate({"user": Param("user"),
+                                       "active": True,
+                                       "age": {"$gte": Param("age"),
+                                               "$lt": 100},
+                                       "tags": {"$in": ["a", Param("tag")]},
+                                       "_id": {"$exists": True}})
+        self.user = ObjectId()
+
+    def expected(self):
+        return {"user": self.user,
+                "active": True,
+                "age": {"$gte": 18, "$lt": 100},
+                "tags": {"$in": ["a", u"b"]},
+                "_id": {"$exists": True}}
+
+    def test_bind(self):
+        self.assertEqual(frozenset(["user", "age", "tag"]),
+                         self.template.params)
+        bound = self.template.bind(user=self.user, age=18, tag=u"b")
+        self.assertEqual(bson.BSON.encode(self.expected()), bound.raw)
+
+    def test_bad_params(self):
+        self.assertRaises(TypeError, self.template.bind, user=1, age=2)
+        self.assertRaises(TypeError, self.template.bind,
+                          user=1, age=2, tag=3, other=4)
+
+    def test_query_wrapper(self):
+        # Cursors wrap the spec in $query when sorting, hinting etc.
+        bound = self.template.bind(user=self.user, age=18, tag=u"b")
+        # Only top level documents get "_id" moved first, so decode the
+        # expected query into a SON to keep the order it was bound in.
+        query = bson.BSON.encode(self.expected()).decode(as_class=SON)
+        expected = SON([("$query", query), ("$orderby", {"age": 1})])
+        wrapped = SON([("$query", bound), ("$orderby", {"age": 1})])
+        self.assertEqual(bson._py_dict_to_bson(expected, False),
+                         bson._py_dict_to_bson(wrapped, False))
+
+        (_, data) = message.query(0, "db.c", 0, 0, wrapped)
+        (_, plain) = message.query(0, "db.c", 0, 0, expected)
+        # Skip the request ids.
+        self.assertEqual(plain[8:], data[8:])
+
+    def test_query_wrapper_c(self):
+        if not bson._use_c:
+            raise SkipTest("C extension not built")
+        bound = self.template.bind(user=self.user, age=18, tag=u"b")
+        wrapped = SON([("$query", bound)])
+        self.assertEqual(bson._py_dict_to_bson(wrapped, False),
+                         bson._cbson._dict_to_bson(wrapped, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmark for the pure Python BSON encoder and decoder.
+
+Encodes the medium and large documents from tools/benchmark.py, then
+decodes documents of growing size and reports the time taken per
+element, which should stay flat as documents get bigger, with and
+without a projection picking out a single element. Uses the pure
+Python code even if the C extension is installed. Needs no server.
+"""
+
+import datetime
+import sys
+import timeit
+sys.path[0:0] = [""]
+
+import bson
+from bson.objectid import ObjectId
+from bson.son import SON
+
+if bson._use_c:
+    decode_all = bson._decode_all
+else:
+    decode_all = bson.decode_all
+dict_to_bson = bson._py_dict_to_bson
+
+# The same documents as tools/benchmark.py uses.
+medium = {"integer": 5,
+          "number": 5.05,
+          "boolean": False,
+          "array": ["test", "benchmark"]
+          }
+large = {"base_url": "http://www.example.com/test-me",
+         "total_word_count": 6743,
+         "access_time": datetime.datetime.utcnow(),
+         "meta_tags": {"description": "i am a long description string",
+                       "author": "Holly Man",
+                       "dynamically_created_meta_tag": "who know\n what"
+                       },
+         "page_structure": {"counted_tags": 3450,
+                            "no_of_js_attached": 10,
+                            "no_of_images": 6
+                            },
+         "harvested_words": ["10gen", "web", "open", "source",
+                             "application", "paas", "platform-as-a-service",
+                             "technology", "helps", "developers", "focus",
+                             "building", "mongodb", "mongo"] * 20
+         }
+
+values = [5,
+          5.05,
+          False,
+          u"benchmark",
+          ObjectId(),
+          datetime.datetime(2011, 1, 1),
+          ["test", 1],
+          {"embedded": 1}]
+
+
+def make_document(n):
+    return SON([("key%d" % i, values[i % len(values)]) for i in range(n)])
+
+
+def timed(name, function, number, elements=1, unit="document"):
+    best = min(timeit.repeat(function, repeat=3, number=number))
+    print "%s%.2f us/%s" % (name + (60 - len(name)) * ".",
+                            best * 1e6 / number / elements, unit)
+
+
+def main():
+    for (name, document) in [("medium", medium), ("large", large)]:
+        timed("encode %s" % name,
+              lambda: dict_to_bson(document, True), 10000)
+
+    for n in [10, 100, 1000, 10000, 100000]:
+        data = bson.BSON.encode(make_document(n))
+        number = max(1, 100000 / n)
+        timed("decode %d elements (%d bytes)" % (n, len(data)),
+              lambda: decode_all(data), number, n, "element")
+        # Everything but one element is stepped over.
+        timed("decode 1 of %d elements" % n,
+              lambda: decode_all(data, fields=["key1"]), number, n,
+              "element")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Copyright 2011 GovData Project.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Microbenchmark for building wire protocol messages.
+
+Compares the builders in :mod:`apymongo.message` against the ones they
+replaced, copied here unchanged. Needs no server.
+"""
+
+import random
+import struct
+import sys
+import timeit
+sys.path[0:0] = [""]
+
+import bson
+from bson.son import SON
+from apymongo import message
+from apymongo.errors import InvalidOperation
+
+_ZERO = "\x00\x00\x00\x00"
+
+doc = {"integer": 5,
+       "number": 5.05,
+       "boolean": False,
+       "array": ["test", "benchmark"],
+       "text": "x" * 100}
+
+
+def baseline_pack_message(operation, data):
+    request_id = random.randint(-2 ** 31 - 1, 2 ** 31)
+    msg = struct.pack("<i", 16 + len(data))
+    msg += struct.pack("<i", request_id)
+    msg += _ZERO
+    msg += struct.pack("<i", operation)
+    return (request_id, msg + data)
+
+
+def baseline_last_error(args):
+    cmd = SON([("getlasterror", 1)])
+    cmd.update(args)
+    data = struct.pack("<I", 0)
+    data += bson._make_c_string("admin.$cmd")
+    data += struct.pack("<i", 0)
+    data += struct.pack("<i", -1)
+    data += bson.BSON.encode(cmd)
+    return baseline_pack_message(2004, data)
+
+
+def baseline_insert(collection_name, docs, check_keys, safe,
+                    last_error_args):
+    """The old message.insert, kept here for comparison."""
+    data = _ZERO
+    data += bson._make_c_string(collection_name)
+    bson_data = "".join([bson.BSON.encode(doc, check_keys) for doc in docs])
+    if not bson_data:
+        raise InvalidOperation("cannot do an empty bulk insert")
+    data += bson_data
+    if safe:
+        (_, insert_message) = baseline_pack_message(2002, data)
+        (request_id, error_message) = baseline_last_error(last_error_args)
+        return (request_id, insert_message + error_message)
+    else:
+        return baseline_pack_message(2002, data)
+
+
+def baseline_update(collection_name, upsert, multi, spec, doc, safe,
+                    last_error_args):
+    """The old message.update, kept here for comparison."""
+    options = 0
+    if upsert:
+        options += 1
+    if multi:
+        options += 2
+
+    data = _ZERO
+    data += bson._make_c_string(collection_name)
+    data += struct.pack("<i", options)
+    data += bson.BSON.encode(spec)
+    data += bson.BSON.encode(doc)
+    if safe:
+        (_, update_message) = baseline_pack_message(2001, data)
+        (request_id, error_message) = baseline_last_error(last_error_args)
+        return (request_id, update_message + error_message)
+    else:
+        return baseline_pack_message(2001, data)
+
+
+def timed(name, function, number):
+    best = min(timeit.repeat(function, repeat=5, number=number))
+    print "%s%.3f ms" % (name + (60 - len(name)) * ".",
+                         best * 1000 / number)
+
+
+def main():
+    print "C extension: %s" % bson.has_c()
+    for n in [1, 100, 1000, 10000]:
+        docs = [doc] * n
+        number = max(1, 10000 / n)
+        for safe in [False, True]:
+            label = "insert x%d%s" % (n, safe and " (safe)" or "")
+            timed(label + " baseline",
+                  lambda: baseline_insert("db.coll", docs, True, safe, {}),
+                  number)
+            timed(label + " current",
+                  lambda: message.insert("db.coll", docs, True, safe, {}),
+                  number)
+    spec = {"_id": 1}
+    for safe in [False, True]:
+        label = "update%s" % (safe and " (safe)" or "")
+        timed(label + " baseline",
+              lambda: baseline_update("db.coll", False, False, spec, doc,
+                                      safe, {}),
+              10000)
+        timed(label + " current",
+              lambda: message.update("db.coll", False, False, spec, doc,
+                                     safe, {}),
+              10000)
+
+
+if __name__ == "__main__":
+    main()